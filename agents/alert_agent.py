@@ -1,44 +1,53 @@
 from core.agent_base import BaseAgent
+from core.agent_scheduler import JobScheduler
+from core.records import Insight
 import json
-import time
 
 class AlertAgent(BaseAgent):
+    subscriptions = ("anomalies_detected",)
+    
     def __init__(self, agent_id=None):
         super().__init__(agent_id, "alert")
         self.alert_check_frequency = 300  # Check every 5 minutes
         self.alert_channels = ["system"]  # Default channel
+        self.jobs = JobScheduler(self.agent_type)
+        self._schedule_insight_check()
     
-    def run(self, db_connector):
-        self.update_status(db_connector, "active")
-        
-        while True:
-            try:
-                # Process configuration messages
-                messages = self.get_messages(db_connector)
-                for message in messages:
-                    if message["message_type"] == "configuration":
-                        config = json.loads(message["content"])
-                        if "alert_channels" in config:
-                            self.alert_channels = config["alert_channels"]
-                    
-                    # Process anomaly notifications
-                    elif message["message_type"] == "anomalies_detected":
-                        content = json.loads(message["content"])
-                        anomalies = content.get("anomalies", [])
-                        date = content.get("date")
-                        
-                        for anomaly in anomalies:
-                            self.process_anomaly(db_connector, date, anomaly)
-                
-                # Check for unprocessed high-severity insights
-                self.check_unprocessed_insights(db_connector)
-                
-                time.sleep(self.alert_check_frequency)
+    def run_once(self, db_connector):
+        # Process configuration messages
+        messages = self.get_messages(db_connector)
+        for message in messages:
+            if message["message_type"] == "configuration":
+                config = message.payload
+                if "alert_channels" in config:
+                    self.alert_channels = config["alert_channels"]
+                if "alert_check_frequency" in config:
+                    self.alert_check_frequency = config["alert_check_frequency"]
+                    self._schedule_insight_check()
+            
+            # Process anomaly notifications
+            elif message["message_type"] == "anomalies_detected":
+                content = message.payload
+                anomalies = content.get("anomalies", [])
+                date = content.get("date")
                 
-            except Exception as e:
-                self.logger.error(f"Error in alert agent: {str(e)}")
-                self.update_status(db_connector, "error")
-                time.sleep(60)  # Wait before retrying
+                for anomaly in anomalies:
+                    self.process_anomaly(db_connector, date, anomaly)
+        
+        # Check for unprocessed high-severity insights; in a cluster only the leader scans
+        if not self.is_leader():
+            self.jobs.reset()
+            return self.cluster.heartbeat_interval
+        
+        self.jobs.run_due(db_connector)
+        return self.jobs.seconds_until_next()
+    
+    def _schedule_insight_check(self):
+        self.jobs.add_job(
+            "insight_check", self.alert_check_frequency,
+            lambda db_connector, scheduled_for: self.check_unprocessed_insights(db_connector),
+            catch_up=False, run_immediately=True
+        )
     
     def process_anomaly(self, db_connector, date, anomaly):
         """Process a single anomaly and generate appropriate alerts"""
@@ -70,11 +79,16 @@ class AlertAgent(BaseAgent):
                 # Additional channels (email, SMS, etc.) would be implemented here
     
     def check_unprocessed_insights(self, db_connector):
-        """Check for high-severity insights that haven't been processed yet"""
+        """Check for high-severity insights that haven't been processed or announced yet
+        
+        Anomaly insights marked ``announced`` were already alerted on through
+        an anomalies_detected message, so they are skipped.
+        """
         query = """
-        SELECT id, date, insight_type, description, severity, metrics
+        SELECT id, date, insight_type, description, severity, metrics::text AS metrics_json
         FROM sales_insights
         WHERE severity = 'high' AND date >= CURRENT_DATE - INTERVAL '3 days'
+        AND COALESCE((metrics->>'announced')::boolean, FALSE) = FALSE
         AND id NOT IN (
             SELECT json_extract_path_text(content::json, 'insight_id')::integer
             FROM system_notifications
@@ -83,7 +97,7 @@ class AlertAgent(BaseAgent):
         )
         """
         
-        insights = db_connector.query(query, ())
+        insights = db_connector.query(query, (), record_class=Insight)
         
         for insight in insights:
             subject = f"HIGH PRIORITY INSIGHT: {insight['insight_type']} on {insight['date']}"
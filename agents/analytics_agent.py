@@ -3,27 +3,151 @@ Analytics Agent module.
 
 This agent is responsible for analyzing collected data and generating insights.
 """
-import logging
-from datetime import datetime
+import os
+import copy
+import time
+import datetime
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from core.agent_base import BaseAgent
+from core.source_stats import SourceStatsManager
+from config.settings import ANALYTICS_CONFIG
+from utils.result_cache import ResultCache
+from utils.anomaly_detection import (
+    AnomalyDetector, partition_series, detect_partition, merge_detections
+)
 
-class AnalyticsAgent:
+class AnalyticsAgent(BaseAgent):
     """
     Agent responsible for analyzing data and generating insights.
     """
     
-    def __init__(self, config=None, db_connector=None):
+    subscriptions = ("data_collected",)
+    
+    def __init__(self, config=None, db_connector=None, agent_id=None):
         """
         Initialize the Analytics Agent.
         
         Args:
             config (dict): Configuration parameters for the agent
             db_connector: Database connector for retrieving and storing data
+            agent_id (str, optional): Agent identifier in the registry
         """
-        self.logger = logging.getLogger(__name__)
+        super().__init__(agent_id, "analytics")
         self.config = config or {}
         self.db_connector = db_connector
         self.analysis_methods = self.config.get('analysis_methods', ['basic'])
+        self.stream_data = self.config.get('stream_data', True)
+        self.columnar_fetch = self._setting('columnar_fetch')
+        self.anomaly_metric = self.config.get('anomaly_metric', 'total_sales')
+        self.alert_recipient = self.config.get('alert_recipient', 'alert_agent')
+        self.detector = AnomalyDetector(
+            window=self._setting('window'),
+            z_threshold=self._setting('z_threshold'),
+            min_history=self._setting('min_history'),
+            seasonal_weeks=self._setting('seasonal_weeks')
+        )
+        self._source_stats = None
+        self.execution_mode = self._setting('execution_mode')
+        self.process_workers = self._setting('process_workers') or os.cpu_count() or 1
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self.result_cache = ResultCache(
+            max_entries=self._setting('result_cache_size'),
+            ttl=self._setting('result_cache_ttl')
+        )
+        self.next_analysis = 0.0  # time.monotonic() of the next scheduled analysis
+    
+    def run(self, db_connector):
+        """
+        Analyze recent data on a schedule and whenever new data is collected.
+        
+        Args:
+            db_connector: Database connector used by the agent loop
+        """
+        if self.db_connector is None:
+            self.db_connector = db_connector
+        super().run(db_connector)
+    
+    def close(self):
+        """
+        Release the notification listener and shut down the analysis process pool.
+        """
+        super().close()
+        self.close_process_pool()
+    
+    def run_once(self, db_connector):
+        """
+        Handle new messages and tasks, and run the analysis when it is due.
+        
+        Args:
+            db_connector: Database connector used by the agent loop
+            
+        Returns:
+            float: Seconds until the next scheduled analysis
+        """
+        if self.db_connector is None:
+            self.db_connector = db_connector
+        
+        messages = self.get_messages(db_connector)
+        for message in messages:
+            if message["message_type"] == "configuration":
+                self.config.update(message.payload)
+                self.analysis_methods = self.config.get('analysis_methods', self.analysis_methods)
+                self.execution_mode = self._setting('execution_mode')
+                self._source_stats = None
+                self.result_cache.clear()
+            
+            # Fresh metrics were stored; analyze them right away
+            elif message["message_type"] == "data_collected":
+                self.next_analysis = time.monotonic()
+        
+        self.drain_tasks(db_connector)
+        
+        if time.monotonic() >= self.next_analysis:
+            # Online analysis is split across nodes by source shard; a full
+            # window analysis covers all sources and runs only on the leader
+            if self._setting('online_analysis'):
+                self.analyze_incremental(self.owned_shards())
+            elif self.is_leader():
+                today = datetime.date.today()
+                start = today - datetime.timedelta(days=self._setting('analysis_window_days'))
+                self.analyze_data(time_range=(start.isoformat(), today.isoformat()))
+            self.next_analysis = time.monotonic() + self._setting('analysis_frequency')
+        
+        return self.next_analysis - time.monotonic()
+    
+    def process_task(self, db_connector, task):
+        """
+        Handle a claimed analytics task.
+        
+        Args:
+            db_connector: Database connector
+            task (dict): Claimed task row
+        """
+        task_data = self.load_task_data(task)
         
+        if task_data.get("type") == "analyze_data":
+            time_range = None
+            if task_data.get("start_date") and task_data.get("end_date"):
+                time_range = (task_data["start_date"], task_data["end_date"])
+            
+            results = self.analyze_data(
+                data_source=task_data.get("source"),
+                time_range=time_range,
+                analysis_method=task_data.get("analysis_method")
+            )
+            status = "failed" if "error" in results else "completed"
+            self.update_task_status(db_connector, task["task_id"], status, {
+                "insights": len(results.get('insights', [])),
+                "anomalies": len(results.get('anomalies', [])),
+                "error": results.get('error')
+            })
+        else:
+            super().process_task(db_connector, task)
+    
     def analyze_data(self, data_source=None, time_range=None, analysis_method=None):
         """
         Analyze data from the specified source within the given time range.
@@ -32,16 +156,16 @@ class AnalyticsAgent:
             data_source (str, optional): Source of data to analyze
             time_range (tuple, optional): Start and end time for analysis
             analysis_method (str, optional): Specific analysis method to use
-            
+        
         Returns:
             dict: Analysis results and insights
         """
-        self.logger.info(f"Starting data analysis at {datetime.now()}")
+        self.logger.info(f"Starting data analysis at {datetime.datetime.now()}")
         
         method = analysis_method or self.analysis_methods[0]
         
         results = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.datetime.now().isoformat(),
             'data_source': data_source,
             'time_range': time_range,
             'analysis_method': method,
@@ -50,12 +174,31 @@ class AnalyticsAgent:
         }
         
         try:
-            # Retrieve data for analysis
+            # Retrieve data for analysis (streamed through a server-side cursor
+            # so memory stays bounded for long time ranges)
             if self.db_connector:
-                data = self.db_connector.retrieve_data(
-                    source=data_source,
-                    time_range=time_range
-                )
+                # Identical parameters over unchanged rows give identical
+                # results; return them without re-analyzing or re-storing
+                cache_key = self._cache_key(data_source, time_range, method)
+                cached = self.result_cache.get(cache_key) if cache_key else None
+                if cached is not None:
+                    self.logger.info(f"Returning cached {method} analysis for {data_source or 'all sources'}")
+                    return copy.deepcopy(cached)
+                
+                if self.columnar_fetch and method in ('basic', 'advanced'):
+                    # Anomaly detection only needs three columns as arrays
+                    data = self.db_connector.retrieve_data(
+                        source=data_source,
+                        time_range=time_range,
+                        columnar=True,
+                        columns=('date', 'source', self.anomaly_metric)
+                    )
+                else:
+                    data = self.db_connector.retrieve_data(
+                        source=data_source,
+                        time_range=time_range,
+                        stream=self.stream_data
+                    )
                 
                 # Perform analysis based on the specified method
                 if method == 'basic':
@@ -68,13 +211,20 @@ class AnalyticsAgent:
                 # Update results with analysis output
                 results.update(analysis_results)
                 
+                # Alert on anomalies found in the most recent days
+                if self.config.get('notify_anomalies', True):
+                    self._notify_anomalies(results)
+                
                 # Store analysis results if needed
-                if self.config.get('store_analysis_results', True):
+                if self.config.get('store_analysis_results', True) and results['insights']:
                     self.db_connector.store_analysis_results(results)
                 
+                if cache_key:
+                    self.result_cache.put(cache_key, copy.deepcopy(dict(results, cached=True)))
+            
             else:
                 results['error'] = "No database connector available for data retrieval"
-                
+        
         except Exception as e:
             error_msg = f"Error during data analysis: {str(e)}"
             self.logger.error(error_msg)
@@ -83,72 +233,398 @@ class AnalyticsAgent:
         self.logger.info(f"Data analysis completed with {len(results.get('insights', []))} insights generated.")
         return results
     
-    def _perform_basic_analysis(self, data):
+    def analyze_incremental(self, shards=None):
         """
-        Perform basic statistical analysis on the data.
+        Score and fold only the closed days added since the last run into the
+        persisted per-source running statistics.
         
         Args:
-            data (list): Data to analyze
+            shards (list, optional): Only analyze sources hashing into these shards
             
         Returns:
-            dict: Analysis results
+            dict: Analysis results and insights
         """
-        # This is a placeholder for actual analysis logic
-        # In a real implementation, this would contain statistical analysis
+        results = {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'data_source': None,
+            'time_range': None,
+            'analysis_method': 'online',
+            'insights': [],
+            'anomalies': [],
+            'metrics': {}
+        }
         
-        # For demonstration, return simple metrics
-        if not data:
-            return {'insights': [], 'metrics': {}}
-            
-        return {
-            'insights': ['Sample insight from basic analysis'],
+        if not self.db_connector:
+            results['error'] = "No database connector available for data retrieval"
+            return results
+        
+        if self._source_stats is None:
+            self._source_stats = SourceStatsManager(
+                self.db_connector,
+                metrics=self._setting('online_metrics'),
+                alpha=self._setting('ewma_alpha'),
+                min_history=self._setting('min_history'),
+                z_threshold=self._setting('z_threshold'),
+                grace_period=self._setting('close_grace_period')
+            )
+        
+        if shards == []:
+            return results
+        
+        update = self._source_stats.update(shards=shards)
+        if update['status'] != 'success':
+            results['error'] = f"Error updating source statistics: {update['error']}"
+            return results
+        
+        if not update['rows']:
+            self.logger.info("No new closed days to analyze")
+            return results
+        
+        anomalies = update['anomalies']
+        results.update({
+            'date': update['end_date'],
+            'insights': [{
+                'description': (
+                    f"Detected {len(anomalies)} anomalies in {update['rows']} new daily rows "
+                    f"across {update['sources']} sources"
+                ),
+                'severity': 'low'
+            }] + [self._anomaly_insight(anomaly, 'online') for anomaly in anomalies],
+            'anomalies': anomalies,
             'metrics': {
-                'count': len(data),
-                'data_points_analyzed': len(data)
+                'count': update['rows'],
+                'data_points_analyzed': update['rows'],
+                'metrics': list(self._source_stats.metrics),
+                'sources_analyzed': update['sources'],
+                'end_date': update['end_date'],
+                'anomalies_count': len(anomalies),
+                'z_threshold': self._source_stats.z_threshold,
+                'baseline': 'ewma'
             }
-        }
+        })
+        
+        if self.config.get('notify_anomalies', True):
+            self._notify_anomalies(results)
+        if self.config.get('store_analysis_results', True):
+            self.db_connector.store_analysis_results(results)
+        
+        self.logger.info(f"Incremental analysis completed with {len(anomalies)} anomalies")
+        return results
     
-    def _perform_advanced_analysis(self, data):
+    def _perform_basic_analysis(self, data):
         """
-        Perform advanced analysis on the data, potentially using ML techniques.
+        Score each day against the trailing rolling mean and standard deviation.
         
         Args:
-            data (list): Data to analyze
-            
+            data (iterable): Data to analyze, either a list or a row stream
+        
         Returns:
             dict: Analysis results
         """
-        # This is a placeholder for advanced analysis logic
-        # In a real implementation, this might include machine learning models
+        return self._detect_anomalies(data, seasonal=False)
+    
+    def _perform_advanced_analysis(self, data):
+        """
+        Score each day against same-weekday baselines, falling back to the
+        rolling baseline while too few weeks of history exist.
         
-        return {
-            'insights': ['Sample insight from advanced analysis'],
-            'metrics': {
-                'count': len(data) if data else 0,
-                'data_points_analyzed': len(data) if data else 0,
-                'confidence_score': 0.85
-            }
-        }
+        Args:
+            data (iterable): Data to analyze, either a list or a row stream
+        
+        Returns:
+            dict: Analysis results
+        """
+        return self._detect_anomalies(data, seasonal=True)
     
     def _perform_custom_analysis(self, data, method):
         """
         Perform custom analysis based on the specified method.
         
         Args:
-            data (list): Data to analyze
+            data (iterable): Data to analyze, either a list or a row stream
             method (str): Custom analysis method name
-            
+        
         Returns:
             dict: Analysis results
         """
         # This is a placeholder for custom analysis methods
         # In a real implementation, this would dispatch to different analysis algorithms
+        count = self._count_rows(data)
         
         return {
             'insights': [f'Sample insight from {method} analysis'],
             'metrics': {
-                'count': len(data) if data else 0,
-                'data_points_analyzed': len(data) if data else 0,
+                'count': count,
+                'data_points_analyzed': count,
                 'method': method
             }
         }
+    
+    def _detect_anomalies(self, data, seasonal):
+        """
+        Run the vectorized anomaly detector over all sources in the data.
+        
+        Args:
+            data (iterable): sales_metrics rows, either a list or a row stream
+            seasonal (bool): Use day-of-week baselines
+        
+        Returns:
+            dict: Insights, anomalies and metrics
+        """
+        dates, sources, values = self._load_columns(data)
+        if len(values) == 0:
+            return {'insights': [], 'anomalies': [], 'metrics': {}}
+        
+        if self.execution_mode == 'process':
+            detection = self._detect_in_processes(dates, sources, values, seasonal)
+        else:
+            detection = self.detector.detect(dates, sources, values, seasonal=seasonal)
+        anomalies = detection['anomalies']
+        
+        method = 'advanced' if seasonal else 'basic'
+        insights = [{
+            'description': (
+                f"Detected {len(anomalies)} {self.anomaly_metric} anomalies across "
+                f"{detection['sources']} sources over {detection['days']} days"
+            ),
+            'severity': 'low'
+        }]
+        insights.extend(self._anomaly_insight(anomaly, method) for anomaly in anomalies)
+        
+        return {
+            'date': detection['end_date'],
+            'insights': insights,
+            'anomalies': anomalies,
+            'metrics': {
+                'count': len(values),
+                'data_points_analyzed': len(values),
+                'metric': self.anomaly_metric,
+                'sources_analyzed': detection['sources'],
+                'days_analyzed': detection['days'],
+                'start_date': detection['start_date'],
+                'end_date': detection['end_date'],
+                'anomalies_count': len(anomalies),
+                'z_threshold': self.detector.z_threshold,
+                'baseline': 'day_of_week' if seasonal else 'rolling',
+                'source_stats': detection['source_stats']
+            }
+        }
+    
+    def _detect_in_processes(self, dates, sources, values, seasonal):
+        """
+        Run the anomaly detector on the process pool, split by data source.
+        
+        Sources are grouped into about two partitions per worker and shipped
+        as packed NumPy buffers, so the GIL-bound agent threads only pay for
+        encoding and merging. Falls back to in-process detection if the
+        pool fails.
+        
+        Args:
+            dates (list): Row dates
+            sources (list): Row sources
+            values (list): Row metric values
+            seasonal (bool): Use day-of-week baselines
+            
+        Returns:
+            dict: Merged detection results
+        """
+        partitions = partition_series(dates, sources, values, self.process_workers * 2)
+        futures = []
+        
+        try:
+            pool = self._get_process_pool()
+            for partition in partitions:
+                futures.append(pool.submit(detect_partition, self.detector.settings, partition, seasonal))
+            return merge_detections([future.result() for future in futures])
+        except Exception as e:
+            self.logger.error(f"Process pool analysis failed, analyzing in-process: {str(e)}")
+            # Drop partitions that have not started before abandoning the pool
+            for future in futures:
+                future.cancel()
+            self.close_process_pool()
+            return self.detector.detect(dates, sources, values, seasonal=seasonal)
+    
+    def _get_process_pool(self):
+        """
+        Return the analysis process pool, starting it on first use.
+        
+        Workers are spawned rather than forked, since forking a process that
+        runs agent threads and holds open database connections is unsafe.
+        
+        Returns:
+            ProcessPoolExecutor: The shared pool
+        """
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                self.logger.info(f"Started analysis process pool with {self.process_workers} workers")
+            return self._process_pool
+    
+    def close_process_pool(self):
+        """
+        Shut down the analysis process pool, if running.
+        """
+        with self._process_pool_lock:
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=False)
+                self._process_pool = None
+    
+    def get_cache_stats(self):
+        """
+        Return analysis result cache statistics (hits, misses, evictions).
+        
+        Returns:
+            dict: Cache statistics
+        """
+        return self.result_cache.stats()
+    
+    def _cache_key(self, data_source, time_range, method):
+        """
+        Build the result cache key from the analysis parameters and the
+        current version of the rows they cover.
+        
+        Args:
+            data_source (str): Source of data to analyze
+            time_range (tuple): Start and end time for analysis
+            method (str): Analysis method
+            
+        Returns:
+            tuple: Cache key, or None if the data version is unavailable
+        """
+        version = self.db_connector.get_data_version(source=data_source, time_range=time_range)
+        if version is None:
+            return None
+        return (data_source, tuple(time_range) if time_range else None, method, version)
+    
+    def _anomaly_insight(self, anomaly, method):
+        """
+        Build a structured insight for one anomaly, dated on the anomalous day.
+        
+        Args:
+            anomaly (dict): Anomaly in the anomalies_detected message format
+            method (str): Analysis method that found it
+            
+        Returns:
+            dict: Insight with date, insight_type, description, severity and metrics
+        """
+        metric = anomaly.get('metric', self.anomaly_metric)
+        direction = "above" if anomaly['z_score'] > 0 else "below"
+        severity = "high" if abs(anomaly['z_score']) >= self._setting('high_severity_z') else "medium"
+        
+        return {
+            'date': anomaly['date'],
+            'insight_type': anomaly['type'],
+            'description': (
+                f"{anomaly['source']} {metric} on {anomaly['date']} was "
+                f"{anomaly['value']:.2f}, {abs(anomaly['z_score']):.1f} standard deviations "
+                f"{direction} the expected {anomaly['expected']:.2f}"
+            ),
+            'severity': severity,
+            'metrics': {
+                'source': anomaly['source'],
+                'metric': metric,
+                'value': anomaly['value'],
+                'expected': anomaly['expected'],
+                'z_score': anomaly['z_score'],
+                'analysis_method': method
+            }
+        }
+    
+    def _load_columns(self, data):
+        """
+        Split metric rows into date, source and value columns.
+        
+        Args:
+            data: Column arrays from a columnar fetch, or a list of rows or
+                row generator
+            
+        Returns:
+            tuple: (dates, sources, values) arrays or lists
+        """
+        if isinstance(data, dict):
+            values = data[self.anomaly_metric].astype(np.float64)
+            present = ~np.isnan(values)
+            return data['date'][present], data['source'][present], values[present]
+        
+        dates, sources, values = [], [], []
+        for row in data or []:
+            value = row[self.anomaly_metric]
+            if value is None:
+                continue
+            dates.append(row['date'])
+            sources.append(row['source'])
+            values.append(float(value))
+        return dates, sources, values
+    
+    def _notify_anomalies(self, results):
+        """
+        Publish anomalies from the most recent days to alert agents, one
+        anomalies_detected message per date.
+        
+        The insights of published anomalies are marked ``announced`` in
+        their metrics, so the alert agent's periodic insight scan does not
+        alert on them a second time. Call this before storing the results.
+        
+        Args:
+            results (dict): Analysis results
+        """
+        end_date = results.get('metrics', {}).get('end_date')
+        if not results.get('anomalies') or not end_date:
+            return
+        
+        cutoff = (
+            datetime.date.fromisoformat(end_date)
+            - datetime.timedelta(days=self._setting('alert_recent_days') - 1)
+        ).isoformat()
+        
+        by_date = {}
+        announced = set()
+        for anomaly in results['anomalies']:
+            if anomaly['date'] >= cutoff:
+                by_date.setdefault(anomaly['date'], []).append(anomaly)
+                announced.add((anomaly['date'], anomaly['source'], anomaly.get('metric', self.anomaly_metric)))
+        
+        for insight in results.get('insights') or []:
+            metrics = insight.get('metrics') if isinstance(insight, dict) else None
+            if metrics and (insight.get('date'), metrics.get('source'), metrics.get('metric')) in announced:
+                metrics['announced'] = True
+        
+        self.publish_many(
+            self.db_connector,
+            "anomalies_detected",
+            [{"date": date, "anomalies": anomalies} for date, anomalies in by_date.items()],
+            fallback_recipient=self.alert_recipient
+        )
+    
+    def _setting(self, key):
+        """
+        Read an analytics setting, preferring the agent config over defaults.
+        
+        Args:
+            key (str): Setting name from ANALYTICS_CONFIG
+        
+        Returns:
+            The configured value
+        """
+        return self.config.get(key, ANALYTICS_CONFIG[key])
+    
+    def _count_rows(self, data):
+        """
+        Count rows in a list or a streamed result without materializing it.
+        
+        Args:
+            data (iterable): List of rows or row generator
+        
+        Returns:
+            int: Number of rows
+        """
+        if isinstance(data, dict):
+            return len(next(iter(data.values()), ()))
+        if not data:
+            return 0
+        if hasattr(data, '__len__'):
+            return len(data)
+        return sum(1 for _ in data)
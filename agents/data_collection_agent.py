@@ -1,114 +1,445 @@
 from core.agent_base import BaseAgent
+from core.agent_scheduler import JobScheduler
+from core.cluster import all_shards, lock_shards, shard_condition
+from core.order_horizon import settled_order_id
+from core.rollup_manager import RollupManager
+from config.settings import COLLECTION_CONFIG
+from utils.hyperloglog import HyperLogLog
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
-import json
-import time
+
+# Advisory lock class id serializing collection runs that read and advance
+# watermarks; locks are taken per source shard (see core.cluster)
+COLLECTION_LOCK_ID = 7301001
+
+# Replaces a day's metrics for a source with freshly aggregated values
+REPLACE_METRICS_QUERY = """
+INSERT INTO sales_metrics (
+    date, total_sales, total_orders, average_order_value, source,
+    unique_customers, customers_hll, created_at, updated_at
+) VALUES %s
+ON CONFLICT (date, source) DO UPDATE SET
+    total_sales = EXCLUDED.total_sales,
+    total_orders = EXCLUDED.total_orders,
+    average_order_value = EXCLUDED.average_order_value,
+    unique_customers = EXCLUDED.unique_customers,
+    customers_hll = EXCLUDED.customers_hll,
+    updated_at = CURRENT_TIMESTAMP
+RETURNING id
+"""
+
+METRICS_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)"
 
 class DataCollectionAgent(BaseAgent):
     def __init__(self, agent_id=None):
         super().__init__(agent_id, "data_collection")
         self.collection_frequency = 3600  # Default: collect every hour
+        self.incremental_collection = COLLECTION_CONFIG["incremental"]
+        self.backfill_chunk_days = COLLECTION_CONFIG["backfill_chunk_days"]
+        self.backfill_workers = COLLECTION_CONFIG["backfill_workers"]
+        self.hll_precision = COLLECTION_CONFIG["hll_precision"]
+        self.jobs = JobScheduler(self.agent_type)
+        self._schedule_collection()
     
-    def run(self, db_connector):
-        self.update_status(db_connector, "active")
-        
-        while True:
-            try:
-                # Process any configuration messages
-                messages = self.get_messages(db_connector)
-                for message in messages:
-                    if message["message_type"] == "configuration":
-                        config = json.loads(message["content"])
-                        if "collection_frequency" in config:
-                            self.collection_frequency = config["collection_frequency"]
-                            self.logger.info(f"Updated collection frequency to {self.collection_frequency} seconds")
-                
-                # Get pending tasks
-                tasks = self.get_pending_tasks(db_connector)
-                for task in tasks:
-                    task_data = json.loads(task["task_data"])
-                    task_id = task["task_id"]
-                    
-                    self.update_task_status(db_connector, task_id, "in_progress")
+    def run_once(self, db_connector):
+        # Process any configuration messages
+        messages = self.get_messages(db_connector)
+        for message in messages:
+            if message["message_type"] == "configuration":
+                config = message.payload
+                if "collection_frequency" in config:
+                    self.collection_frequency = config["collection_frequency"]
+                    self._schedule_collection()
+                    self.logger.info(f"Updated collection frequency to {self.collection_frequency} seconds")
+        
+        # Claim and process pending tasks
+        tasks = self.drain_tasks(db_connector)
+        
+        # Perform regular data collection if no specific tasks
+        if not tasks:
+            self.jobs.run_due(db_connector)
+        
+        return self.jobs.seconds_until_next()
+    
+    def _schedule_collection(self):
+        self.jobs.add_job(
+            "collection", self.collection_frequency, self.run_scheduled_collection,
+            catch_up=False, run_immediately=True
+        )
+    
+    def run_scheduled_collection(self, db_connector, scheduled_for):
+        """Collect new sales data for this node's shards and refresh the rollups"""
+        shards = self.owned_shards()
+        if shards != []:
+            if self.incremental_collection:
+                self.collect_sales_data_incremental(db_connector, shards)
+            else:
+                today = datetime.date.today().isoformat()
+                self.collect_sales_data(db_connector, today, shards)
+        
+        # Fold the same new orders into the hourly/daily/monthly rollups; the
+        # rollups cover all sources, so in a cluster only the leader refreshes them
+        if self.is_leader():
+            RollupManager(db_connector).refresh()
+    
+    def process_task(self, db_connector, task):
+        """Handle a claimed data collection task"""
+        task_data = self.load_task_data(task)
+        task_id = task["task_id"]
+        
+        if task_data.get("type") == "collect_sales_data":
+            if task_data.get("mode") == "incremental":
+                result = self.collect_sales_data_incremental(db_connector)
+            else:
+                result = self.collect_sales_data(db_connector, task_data.get("date"))
+            self.update_task_status(db_connector, task_id, "completed", result)
+            
+            # Notify analytics agents
+            self.publish(
+                db_connector,
+                "data_collected",
+                {"date": task_data.get("date"), "metrics_id": result.get("metrics_id")},
+                fallback_recipient="analytics_agent"
+            )
+        elif task_data.get("type") == "refresh_rollups":
+            result = RollupManager(db_connector).refresh()
+            status = "completed" if result["status"] == "success" else "failed"
+            self.update_task_status(db_connector, task_id, status, result)
+        elif task_data.get("type") == "backfill_sales_data":
+            result = self.backfill_sales_data(
+                db_connector,
+                task_data.get("start_date"),
+                task_data.get("end_date"),
+                task_id=task_id
+            )
+            status = "completed" if result["status"] == "success" else "failed"
+            self.update_task_status(db_connector, task_id, status, result)
+            
+            self.publish(
+                db_connector,
+                "data_collected",
+                {"start_date": task_data.get("start_date"), "end_date": task_data.get("end_date")},
+                fallback_recipient="analytics_agent"
+            )
+        else:
+            super().process_task(db_connector, task)
+    
+    def collect_sales_data(self, db_connector, date, shards=None):
+        """Collect sales data for a specific date and store aggregated metrics
+        
+        With ``shards`` only sources hashing into those shards are collected.
+        """
+        self.logger.info(f"Collecting sales data for {date}")
+        
+        result = self._collect_date_range(db_connector, date, date, shards)
+        if result["status"] == "success":
+            self.logger.info(f"Collected and stored sales data for {date} ({result['records_count']} records)")
+        
+        result.pop("start_date")
+        result.pop("end_date")
+        result["date"] = date
+        return result
+    
+    def backfill_sales_data(self, db_connector, start_date, end_date, task_id=None):
+        """Rebuild sales metrics for a date range in chunks processed in parallel
+        
+        Each chunk aggregates its days in a single GROUP BY pass and stores
+        them with one bulk upsert. Progress is written to the task result
+        after every chunk when ``task_id`` is given.
+        """
+        self.logger.info(f"Backfilling sales data from {start_date} to {end_date}")
+        
+        start = datetime.date.fromisoformat(str(start_date))
+        end = datetime.date.fromisoformat(str(end_date))
+        
+        chunks = []
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + datetime.timedelta(days=self.backfill_chunk_days - 1), end)
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = chunk_end + datetime.timedelta(days=1)
+        
+        progress = {
+            "status": "running",
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "chunks_total": len(chunks),
+            "chunks_done": 0,
+            "records_count": 0,
+            "errors": []
+        }
+        
+        if chunks:
+            # Every chunk runs on its own pooled connection
+            with ThreadPoolExecutor(max_workers=min(self.backfill_workers, len(chunks))) as executor:
+                futures = [
+                    executor.submit(self._collect_date_range, db_connector, chunk_start, chunk_end)
+                    for chunk_start, chunk_end in chunks
+                ]
+                for future in as_completed(futures):
+                    result = future.result()
+                    progress["chunks_done"] += 1
+                    if result["status"] == "success":
+                        progress["records_count"] += result["records_count"]
+                    else:
+                        progress["errors"].append({
+                            "start_date": result["start_date"],
+                            "end_date": result["end_date"],
+                            "error": result["error"]
+                        })
                     
-                    if task_data.get("type") == "collect_sales_data":
-                        result = self.collect_sales_data(db_connector, task_data.get("date"))
-                        self.update_task_status(db_connector, task_id, "completed", result)
-                        
-                        # Notify analytics agent
-                        self.send_message(
-                            db_connector, 
-                            "analytics_agent", 
-                            "data_collected",
-                            {"date": task_data.get("date"), "metrics_id": result.get("metrics_id")}
-                        )
+                    if task_id:
+                        self.update_task_progress(db_connector, task_id, progress)
+        
+        progress["status"] = "error" if progress["errors"] else "success"
+        self.logger.info(
+            f"Backfilled {progress['records_count']} sales metrics records "
+            f"in {len(chunks)} chunks ({len(progress['errors'])} failed)"
+        )
+        return progress
+    
+    def _collect_date_range(self, db_connector, start_date, end_date, shards=None):
+        """Aggregate orders for a date range in one pass and replace the stored metrics
+        
+        Re-running is idempotent. For sources collected incrementally only
+        orders up to the source's watermark are counted; later orders are
+        merged in by the next incremental run. With ``shards`` only sources
+        hashing into those shards are collected.
+        """
+        # Use MCP to query the orders table
+        query = """
+        SELECT 
+            DATE(o.date) as date,
+            SUM(o.amount_total) as total_sales,
+            COUNT(*) as total_orders,
+            AVG(o.amount_total) as average_order_value,
+            o.source,
+            array_agg(DISTINCT o.client_id) as client_ids
+        FROM orders o
+        LEFT JOIN collection_watermarks w ON w.source = o.source
+        WHERE o.date >= %s::date AND o.date < %s::date + 1
+        AND (w.last_order_id IS NULL OR o.id <= w.last_order_id)
+        {shard_filter}
+        GROUP BY DATE(o.date), o.source
+        """
+        
+        start_date = str(start_date)
+        end_date = str(end_date)
+        params = (start_date, end_date)
+        if shards is None:
+            query = query.format(shard_filter="")
+        else:
+            query = query.format(shard_filter="AND " + shard_condition("o.source"))
+            params += (list(shards),)
+        
+        try:
+            with db_connector.transaction():
+                # Shared lock: ranges may be rebuilt in parallel, but not while
+                # an incremental run is moving the watermarks
+                lock_shards(
+                    db_connector, COLLECTION_LOCK_ID,
+                    all_shards() if shards is None else shards, shared=True
+                )
                 
-                # Perform regular data collection if no specific tasks
-                if not tasks:
-                    today = datetime.date.today().isoformat()
-                    self.collect_sales_data(db_connector, today)
+                # Execute the query using MCP
+                results = db_connector.query(query, params)
                 
-                time.sleep(self.collection_frequency)
+                # unique_customers is always the sketch's estimate, as on the
+                # incremental path, so both paths store the same value
+                rows = []
+                for result in results:
+                    sketch = self._customer_sketch(result["client_ids"])
+                    rows.append((
+                        result["date"],
+                        result["total_sales"],
+                        result["total_orders"],
+                        result["average_order_value"],
+                        result["source"],
+                        sketch.count(),
+                        sketch.to_bytes()
+                    ))
                 
-            except Exception as e:
-                self.logger.error(f"Error in data collection agent: {str(e)}")
-                self.update_status(db_connector, "error")
-                time.sleep(60)  # Wait before retrying
+                # Store all aggregated records in a single multi-row upsert
+                metrics_ids = db_connector.execute_many(
+                    REPLACE_METRICS_QUERY, rows, template=METRICS_TEMPLATE
+                )
+                if metrics_ids is None:
+                    raise RuntimeError("Failed to store aggregated sales metrics")
+            
+            return {
+                "status": "success",
+                "start_date": start_date,
+                "end_date": end_date,
+                "records_count": len(metrics_ids),
+                "metrics_id": metrics_ids
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Error collecting sales data for {start_date} to {end_date}: {str(e)}")
+            return {
+                "status": "error",
+                "start_date": start_date,
+                "end_date": end_date,
+                "error": str(e)
+            }
     
-    def collect_sales_data(self, db_connector, date):
-        """Collect sales data for a specific date and store aggregated metrics"""
-        self.logger.info(f"Collecting sales data for {date}")
+    def collect_sales_data_incremental(self, db_connector, shards=None):
+        """Aggregate orders added since the last run and merge them into each day's metrics
+        
+        Orders are scanned from the lowest watermark, so sources without a
+        watermark yet are picked up as they appear; their rows are replaced
+        rather than merged since the scan covers all of their orders. Only
+        orders up to the settled order id are scanned, so an order that
+        commits after a higher id is picked up by a later run. With
+        ``shards`` only sources hashing into those shards are collected, so
+        nodes owning different shards collect in parallel.
+        """
+        self.logger.info("Collecting new sales data incrementally")
         
-        # Use MCP to query the orders table
         query = """
         SELECT 
-            %s as date,
-            SUM(amount_total) as total_sales,
+            DATE(o.date) as date,
+            o.source,
+            SUM(o.amount_total) as total_sales,
             COUNT(*) as total_orders,
-            AVG(amount_total) as average_order_value,
-            source,
-            COUNT(DISTINCT client_id) as unique_customers
-        FROM orders
-        WHERE DATE(date) = %s
-        GROUP BY source
+            MAX(o.id) as last_order_id,
+            array_agg(DISTINCT o.client_id) as client_ids,
+            w.last_order_id IS NULL as is_new_source
+        FROM orders o
+        LEFT JOIN collection_watermarks w ON w.source = o.source
+        WHERE o.id > (SELECT COALESCE(MIN(last_order_id), 0) FROM collection_watermarks {watermark_filter})
+        AND o.id > COALESCE(w.last_order_id, 0)
+        AND o.id <= %s
+        {shard_filter}
+        GROUP BY DATE(o.date), o.source, w.last_order_id
+        """
+        if shards is None:
+            query = query.format(watermark_filter="", shard_filter="")
+        else:
+            query = query.format(
+                watermark_filter="WHERE " + shard_condition("source"),
+                shard_filter="AND " + shard_condition("o.source")
+            )
+        
+        # Customer sketches arrive already merged with the stored ones
+        merge_query = """
+        INSERT INTO sales_metrics (
+            date, total_sales, total_orders, average_order_value, source,
+            unique_customers, customers_hll, created_at, updated_at
+        ) VALUES %s
+        ON CONFLICT (date, source) DO UPDATE SET
+            total_sales = sales_metrics.total_sales + EXCLUDED.total_sales,
+            total_orders = sales_metrics.total_orders + EXCLUDED.total_orders,
+            average_order_value = (sales_metrics.total_sales + EXCLUDED.total_sales)
+                / (sales_metrics.total_orders + EXCLUDED.total_orders),
+            unique_customers = EXCLUDED.unique_customers,
+            customers_hll = EXCLUDED.customers_hll,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING id
+        """
+        
+        sketches_query = """
+        SELECT m.date, m.source, m.customers_hll
+        FROM sales_metrics m
+        JOIN unnest(%s::date[], %s::text[]) AS k(date, source)
+            ON m.date = k.date AND m.source = k.source
+        WHERE m.customers_hll IS NOT NULL
+        """
+        
+        watermark_query = """
+        INSERT INTO collection_watermarks (source, last_order_id, updated_at)
+        VALUES %s
+        ON CONFLICT (source) DO UPDATE SET
+            last_order_id = GREATEST(collection_watermarks.last_order_id, EXCLUDED.last_order_id),
+            updated_at = CURRENT_TIMESTAMP
         """
         
         try:
-            # Execute the query using MCP
-            results = db_connector.query(query, (date, date))
+            # Read before the collection transaction starts; see settled_order_id()
+            settled_id = settled_order_id(db_connector)
+            if shards is None:
+                params = (settled_id,)
+            else:
+                params = (list(shards), settled_id, list(shards))
             
-            # Store each aggregated record
-            metrics_ids = []
-            for result in results:
-                insert_query = """
-                INSERT INTO sales_metrics (
-                    date, total_sales, total_orders, 
-                    average_order_value, source, created_at
-                ) VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                RETURNING id
-                """
+            with db_connector.transaction():
+                lock_shards(db_connector, COLLECTION_LOCK_ID, all_shards() if shards is None else shards)
+                results = db_connector.query(query, params)
+                
+                # Stored sketches of the days that receive new orders
+                merge_keys = [
+                    (result["date"], result["source"])
+                    for result in results if not result["is_new_source"]
+                ]
+                stored_sketches = {}
+                if merge_keys:
+                    dates, sources = zip(*merge_keys)
+                    for stored in db_connector.query(sketches_query, (list(dates), list(sources))):
+                        stored_sketches[(stored["date"], stored["source"])] = HyperLogLog.from_bytes(
+                            stored["customers_hll"]
+                        )
+                
+                replace_rows = []
+                merge_rows = []
+                watermarks = {}
+                orders_count = 0
                 
-                metric_id = db_connector.execute(insert_query, (
-                    date, 
-                    result["total_sales"],
-                    result["total_orders"],
-                    result["average_order_value"],
-                    result["source"]
-                ))
-                metrics_ids.append(metric_id)
+                for result in results:
+                    sketch = self._customer_sketch(result["client_ids"])
+                    stored = stored_sketches.get((result["date"], result["source"]))
+                    if stored is not None:
+                        sketch.merge(stored)
+                    
+                    row = (
+                        result["date"],
+                        result["total_sales"],
+                        result["total_orders"],
+                        result["total_sales"] / result["total_orders"],
+                        result["source"],
+                        sketch.count(),
+                        sketch.to_bytes()
+                    )
+                    (replace_rows if result["is_new_source"] else merge_rows).append(row)
+                    watermarks[result["source"]] = max(
+                        watermarks.get(result["source"], 0), result["last_order_id"]
+                    )
+                    orders_count += result["total_orders"]
+                
+                metrics_ids = (
+                    db_connector.execute_many(REPLACE_METRICS_QUERY, replace_rows, template=METRICS_TEMPLATE) or []
+                ) + (
+                    db_connector.execute_many(merge_query, merge_rows, template=METRICS_TEMPLATE) or []
+                )
+                
+                if watermarks:
+                    db_connector.execute_many(
+                        watermark_query,
+                        [(source, last_id) for source, last_id in watermarks.items()],
+                        template="(%s, %s, CURRENT_TIMESTAMP)"
+                    )
             
-            self.logger.info(f"Collected and stored sales data for {date} ({len(metrics_ids)} records)")
+            dates = sorted({row[0].isoformat() for row in replace_rows + merge_rows})
+            self.logger.info(
+                f"Merged {orders_count} new orders into {len(metrics_ids)} sales metrics records"
+            )
             
             return {
                 "status": "success",
-                "date": date,
+                "mode": "incremental",
+                "orders_count": orders_count,
+                "dates": dates,
                 "records_count": len(metrics_ids),
                 "metrics_id": metrics_ids
             }
             
         except Exception as e:
-            self.logger.error(f"Error collecting sales data for {date}: {str(e)}")
+            self.logger.error(f"Error collecting incremental sales data: {str(e)}")
             return {
                 "status": "error",
-                "date": date,
+                "mode": "incremental",
                 "error": str(e)
             }
+    
+    def _customer_sketch(self, client_ids):
+        """Build a HyperLogLog sketch of distinct customers"""
+        return HyperLogLog(self.hll_precision).update(client_ids or [])
@@ -0,0 +1,37 @@
+from core.agent_base import BaseAgent
+from core.agent_scheduler import JobScheduler
+from core.partition_manager import PartitionManager
+from config.settings import RETENTION_CONFIG
+
+class MaintenanceAgent(BaseAgent):
+    def __init__(self, agent_id=None):
+        super().__init__(agent_id, "maintenance")
+        self.partition_manager = None
+        self.jobs = JobScheduler(self.agent_type)
+        self.jobs.add_job(
+            "partition_maintenance", RETENTION_CONFIG["check_interval"],
+            lambda db_connector, scheduled_for: self.maintain_partitions(db_connector),
+            catch_up=False, run_immediately=True
+        )
+
+    def run_once(self, db_connector):
+        for message in self.get_messages(db_connector):
+            self.logger.warning(f"Ignoring message of type {message['message_type']}")
+
+        # Partition maintenance is singleton work; in a cluster only the leader runs it
+        if not self.is_leader():
+            self.jobs.reset()
+            return self.cluster.heartbeat_interval
+
+        self.jobs.run_due(db_connector)
+        return self.jobs.seconds_until_next()
+
+    def maintain_partitions(self, db_connector):
+        """Create upcoming message and task partitions and retire expired ones"""
+        if self.partition_manager is None:
+            self.partition_manager = PartitionManager(db_connector)
+
+        result = self.partition_manager.maintain()
+        if result["status"] == "error":
+            raise RuntimeError(result["error"])
+        return result
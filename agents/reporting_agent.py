@@ -1,9 +1,13 @@
 from core.agent_base import BaseAgent
+from core.agent_scheduler import JobScheduler
+from core.rollup_manager import RollupManager
+from utils.hyperloglog import HyperLogLog
+from config.settings import REPORTING_CONFIG
 import json
-import time
 import datetime
 import random
 import os
+import numpy as np
 
 class ReportingAgent(BaseAgent):
     def __init__(self, agent_id=None):
@@ -14,86 +18,101 @@ class ReportingAgent(BaseAgent):
             "monthly": True
         }
         self.report_directory = "reports"
+        self.jobs = JobScheduler(self.agent_type)
+        self.report_jobs = {
+            "daily": self.run_daily_report,
+            "weekly": self.run_weekly_report,
+            "monthly": self.run_monthly_report
+        }
+        for report_type, schedule in REPORTING_CONFIG["schedules"].items():
+            self.jobs.add_job(f"{report_type}_report", schedule, self.report_jobs[report_type])
         
         # Ensure report directory exists
         os.makedirs(self.report_directory, exist_ok=True)
         
-    def run(self, db_connector):
-        self.update_status(db_connector, "active")
+    def run_once(self, db_connector):
+        # Process configuration messages
+        messages = self.get_messages(db_connector)
+        for message in messages:
+            if message["message_type"] == "configuration":
+                config = message.payload
+                if "reporting_schedule" in config:
+                    self.update_schedule(config["reporting_schedule"])
         
-        last_daily_report = None
-        last_weekly_report = None
-        last_monthly_report = None
+        # Generate reports that are due, including runs missed while stopped.
+        # In a cluster only the leader does; followers check back each heartbeat
+        if self.is_leader():
+            self.jobs.run_due(db_connector)
+            next_check = self.jobs.seconds_until_next()
+        else:
+            self.jobs.reset()
+            next_check = self.cluster.heartbeat_interval
         
-        while True:
-            try:
-                # Process configuration messages
-                messages = self.get_messages(db_connector)
-                for message in messages:
-                    if message["message_type"] == "configuration":
-                        config = json.loads(message["content"])
-                        if "reporting_schedule" in config:
-                            self.reporting_schedule.update(config["reporting_schedule"])
-                
-                # Check if reports need to be generated
-                now = datetime.datetime.now()
-                today = now.date()
-                
-                # Daily report (once per day)
-                if (self.reporting_schedule["daily"] and 
-                    (last_daily_report is None or last_daily_report < today)):
-                    
-                    yesterday = (today - datetime.timedelta(days=1)).isoformat()
-                    self.generate_daily_report(db_connector, yesterday)
-                    last_daily_report = today
-                
-                # Weekly report (on Mondays)
-                if (self.reporting_schedule["weekly"] and now.weekday() == 0 and
-                    (last_weekly_report is None or last_weekly_report < today)):
-                    
-                    week_start = (today - datetime.timedelta(days=7)).isoformat()
-                    week_end = (today - datetime.timedelta(days=1)).isoformat()
-                    self.generate_weekly_report(db_connector, week_start, week_end)
-                    last_weekly_report = today
-                
-                # Monthly report (on 1st of month)
-                if (self.reporting_schedule["monthly"] and now.day == 1 and
-                    (last_monthly_report is None or last_monthly_report < today)):
-                    
-                    # Calculate previous month's date range
-                    last_month = now.replace(day=1) - datetime.timedelta(days=1)
-                    month_start = last_month.replace(day=1).isoformat()
-                    month_end = last_month.isoformat()
-                    
-                    self.generate_monthly_report(db_connector, month_start, month_end)
-                    last_monthly_report = today
-                
-                # Process specific report requests
-                tasks = self.get_pending_tasks(db_connector)
-                for task in tasks:
-                    task_data = json.loads(task["task_data"])
-                    task_id = task["task_id"]
-                    
-                    self.update_task_status(db_connector, task_id, "in_progress")
-                    
-                    if task_data.get("type") == "custom_report":
-                        start_date = task_data.get("start_date")
-                        end_date = task_data.get("end_date")
-                        report_type = task_data.get("report_type", "sales_summary")
-                        
-                        result = self.generate_custom_report(
-                            db_connector, start_date, end_date, report_type
-                        )
-                        
-                        self.update_task_status(db_connector, task_id, "completed", result)
-                
-                # Sleep until next check (every hour)
-                time.sleep(3600)
-                
-            except Exception as e:
-                self.logger.error(f"Error in reporting agent: {str(e)}")
-                self.update_status(db_connector, "error")
-                time.sleep(60)  # Wait before retrying
+        # Process specific report requests
+        self.drain_tasks(db_connector)
+        
+        return next_check
+    
+    def update_schedule(self, schedule):
+        """Apply a reporting_schedule update.
+        
+        Each entry maps a report type to a bool enabling or disabling it, or
+        to a cron expression replacing its schedule.
+        """
+        for report_type, value in schedule.items():
+            if report_type not in self.report_jobs:
+                self.logger.warning(f"Unknown report type in schedule: {report_type}")
+                continue
+            if isinstance(value, str):
+                self.jobs.add_job(f"{report_type}_report", value, self.report_jobs[report_type])
+                value = True
+            self.reporting_schedule[report_type] = value
+    
+    def run_daily_report(self, db_connector, scheduled_for):
+        """Generate the daily report for the day before ``scheduled_for``"""
+        if self.reporting_schedule["daily"]:
+            day = scheduled_for.date() - datetime.timedelta(days=1)
+            result = self.generate_daily_report(db_connector, day.isoformat())
+            if result["status"] != "success":
+                raise RuntimeError(result.get("error", "report generation failed"))
+    
+    def run_weekly_report(self, db_connector, scheduled_for):
+        """Generate the weekly report for the 7 days before ``scheduled_for``"""
+        if self.reporting_schedule["weekly"]:
+            today = scheduled_for.date()
+            week_start = (today - datetime.timedelta(days=7)).isoformat()
+            week_end = (today - datetime.timedelta(days=1)).isoformat()
+            result = self.generate_weekly_report(db_connector, week_start, week_end)
+            if result["status"] != "success":
+                raise RuntimeError(result.get("error", "report generation failed"))
+    
+    def run_monthly_report(self, db_connector, scheduled_for):
+        """Generate the monthly report for the month before ``scheduled_for``"""
+        if self.reporting_schedule["monthly"]:
+            last_month = scheduled_for.date().replace(day=1) - datetime.timedelta(days=1)
+            month_start = last_month.replace(day=1).isoformat()
+            month_end = last_month.isoformat()
+            result = self.generate_monthly_report(db_connector, month_start, month_end)
+            if result["status"] != "success":
+                raise RuntimeError(result.get("error", "report generation failed"))
+    
+    def process_task(self, db_connector, task):
+        """Handle a claimed report request"""
+        task_data = self.load_task_data(task)
+        task_id = task["task_id"]
+        
+        if task_data.get("type") == "custom_report":
+            start_date = task_data.get("start_date")
+            end_date = task_data.get("end_date")
+            report_type = task_data.get("report_type", "sales_summary")
+            
+            result = self.generate_custom_report(
+                db_connector, start_date, end_date, report_type
+            )
+            
+            self.update_task_status(db_connector, task_id, "completed", result)
+        else:
+            super().process_task(db_connector, task)
     
     def generate_daily_report(self, db_connector, date):
         """Generate a daily sales report"""
@@ -177,20 +196,25 @@ class ReportingAgent(BaseAgent):
         self.logger.info(f"Generating weekly report for {start_date} to {end_date}")
         
         try:
-            # Get aggregated sales data for the week
-            query = """
-            SELECT 
-                source,
-                SUM(total_sales) as weekly_sales, 
-                SUM(total_orders) as weekly_orders,
-                AVG(average_order_value) as avg_order_value
-            FROM sales_metrics
-            WHERE date >= %s AND date <= %s
-            GROUP BY source
-            ORDER BY weekly_sales DESC
-            """
+            # Get aggregated sales data for the week from the daily rollup
+            rollups = RollupManager(db_connector)
+            rollups.refresh()
+            
+            # Distinct customers from merged daily sketches
+            unique_customers, total_unique_customers = self._unique_customers(
+                db_connector, start_date, end_date
+            )
             
-            sales_data = db_connector.query(query, (start_date, end_date))
+            sales_data = [
+                {
+                    "source": row["source"],
+                    "weekly_sales": row["total_sales"],
+                    "weekly_orders": row["total_orders"],
+                    "avg_order_value": row["avg_order_value"],
+                    "unique_customers": unique_customers.get(row["source"], 0)
+                }
+                for row in rollups.source_totals(start_date, end_date)
+            ]
             
             # Get top insights for the week
             insights_query = """
@@ -212,7 +236,8 @@ class ReportingAgent(BaseAgent):
                 "sales_data": sales_data,
                 "insights": insights,
                 "total_weekly_sales": sum(s["weekly_sales"] for s in sales_data) if sales_data else 0,
-                "total_weekly_orders": sum(s["weekly_orders"] for s in sales_data) if sales_data else 0
+                "total_weekly_orders": sum(s["weekly_orders"] for s in sales_data) if sales_data else 0,
+                "total_unique_customers": total_unique_customers
             }
             
             # Generate report artifact
@@ -259,33 +284,28 @@ class ReportingAgent(BaseAgent):
         self.logger.info(f"Generating monthly report for {start_date} to {end_date}")
         
         try:
-            # Get aggregated sales data for the month
-            query = """
-            SELECT 
-                source,
-                SUM(total_sales) as monthly_sales, 
-                SUM(total_orders) as monthly_orders,
-                AVG(average_order_value) as avg_order_value
-            FROM sales_metrics
-            WHERE date >= %s AND date <= %s
-            GROUP BY source
-            ORDER BY monthly_sales DESC
-            """
+            # Get aggregated sales data for the month from the monthly rollup
+            rollups = RollupManager(db_connector)
+            rollups.refresh()
             
-            sales_data = db_connector.query(query, (start_date, end_date))
+            # Distinct customers from merged daily sketches
+            unique_customers, total_unique_customers = self._unique_customers(
+                db_connector, start_date, end_date
+            )
             
-            # Get daily trends for the month
-            trends_query = """
-            SELECT 
-                date,
-                SUM(total_sales) as daily_sales
-            FROM sales_metrics
-            WHERE date >= %s AND date <= %s
-            GROUP BY date
-            ORDER BY date
-            """
+            sales_data = [
+                {
+                    "source": row["source"],
+                    "monthly_sales": row["total_sales"],
+                    "monthly_orders": row["total_orders"],
+                    "avg_order_value": row["avg_order_value"],
+                    "unique_customers": unique_customers.get(row["source"], 0)
+                }
+                for row in rollups.source_totals(start_date, end_date)
+            ]
             
-            daily_trends = db_connector.query(trends_query, (start_date, end_date))
+            # Get daily trends for the month from the daily rollup
+            daily_trends = rollups.daily_totals(start_date, end_date)
             
             # Generate report content
             report_data = {
@@ -296,7 +316,8 @@ class ReportingAgent(BaseAgent):
                 "sales_data": sales_data,
                 "daily_trends": daily_trends,
                 "total_monthly_sales": sum(s["monthly_sales"] for s in sales_data) if sales_data else 0,
-                "total_monthly_orders": sum(s["monthly_orders"] for s in sales_data) if sales_data else 0
+                "total_monthly_orders": sum(s["monthly_orders"] for s in sales_data) if sales_data else 0,
+                "total_unique_customers": total_unique_customers
             }
             
             # Generate report artifact
@@ -338,18 +359,41 @@ class ReportingAgent(BaseAgent):
                 "error": str(e)
             }
     
+    def _unique_customers(self, db_connector, start_date, end_date):
+        """Estimate distinct customers per source and overall by merging daily sketches"""
+        query = """
+        SELECT source, customers_hll
+        FROM sales_metrics
+        WHERE date >= %s AND date <= %s AND customers_hll IS NOT NULL
+        """
+        
+        sketches = {}
+        for row in db_connector.query(query, (start_date, end_date)):
+            sketch = HyperLogLog.from_bytes(row["customers_hll"])
+            if row["source"] in sketches:
+                sketches[row["source"]].merge(sketch)
+            else:
+                sketches[row["source"]] = sketch
+                
+        per_source = {source: sketch.count() for source, sketch in sketches.items()}
+        total = HyperLogLog.merge_all(sketches.values()).count()
+        return per_source, total
+    
     def generate_custom_report(self, db_connector, start_date, end_date, report_type):
         """Generate a custom report based on specified parameters"""
         self.logger.info(f"Generating custom {report_type} report for {start_date} to {end_date}")
     
-    def _collect_report_data(self, report_type, time_range, sources):
+    def _collect_report_data(self, db_connector, report_type, time_range, sources, columnar=False):
         """
         Collect data needed for the report.
         
         Args:
+            db_connector: Database connector to read from
             report_type (str): Type of report
             time_range (tuple): Time range for the report
             sources (list): Data sources to include
+            columnar (bool): Summarize each source from a columnar fetch
+                instead of embedding every row in the report
             
         Returns:
             dict: Collected data for the report
@@ -357,7 +401,7 @@ class ReportingAgent(BaseAgent):
         report_data = {
             'metadata': {
                 'report_type': report_type,
-                'generated_at': datetime.now().isoformat(),
+                'generated_at': datetime.datetime.now().isoformat(),
                 'time_range': time_range,
                 'sources': sources
             },
@@ -366,16 +410,24 @@ class ReportingAgent(BaseAgent):
         
         # Collect data for each source
         for source in sources:
-            source_data = self.db_connector.retrieve_data(
-                source=source,
-                time_range=time_range
-            )
+            if columnar:
+                source_data = self._summarize_source_columns(db_connector.retrieve_data(
+                    source=source,
+                    time_range=time_range,
+                    columnar=True,
+                    columns=('date', 'total_sales', 'total_orders')
+                ))
+            else:
+                source_data = db_connector.retrieve_data(
+                    source=source,
+                    time_range=time_range
+                )
             
             report_data['data'][source] = source_data
             
         # If this is an analysis report, also get analysis results
         if report_type in ['analysis', 'insights']:
-            analysis_results = self.db_connector.retrieve_analysis_results(
+            analysis_results = db_connector.retrieve_analysis_results(
                 time_range=time_range,
                 sources=sources
             )
@@ -384,7 +436,7 @@ class ReportingAgent(BaseAgent):
             
         # If this is an alert report, get alert history
         if report_type in ['alerts', 'incidents']:
-            alert_history = self.db_connector.retrieve_alerts(
+            alert_history = db_connector.retrieve_alerts(
                 time_range=time_range,
                 sources=sources
             )
@@ -393,6 +445,28 @@ class ReportingAgent(BaseAgent):
             
         return report_data
     
+    def _summarize_source_columns(self, columns):
+        """
+        Aggregate sales_metrics column arrays with vectorized reductions.
+        
+        Args:
+            columns (dict): Arrays returned by a columnar retrieve_data call
+            
+        Returns:
+            dict: Row count, totals and covered date range
+        """
+        dates = columns['date']
+        if not len(dates):
+            return {'rows': 0, 'total_sales': 0, 'total_orders': 0, 'first_date': None, 'last_date': None}
+        
+        return {
+            'rows': len(dates),
+            'total_sales': round(float(np.nansum(columns['total_sales'])), 2),
+            'total_orders': int(np.nansum(columns['total_orders'])),
+            'first_date': str(dates.min()),
+            'last_date': str(dates.max())
+        }
+    
     def _format_report(self, report_data, report_type, output_format):
         """
         Format the report data according to the specified output format.
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Size and speed benchmark for message and task payload codecs.
+
+Encodes representative payloads (a configuration message, an anomaly list
+and a report payload) with every PayloadCodec format, with and without
+compression, and reports the encoded size and encode/decode times.
+
+Usage:
+    python -m benchmarks.codec_benchmark [--anomalies 500] [--days 90] [--sources 20]
+"""
+import argparse
+import datetime
+import random
+import time
+from utils.payload_codec import PayloadCodec, decode_payload
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Benchmark message and task payload codecs')
+    parser.add_argument('--anomalies', type=int, default=500, help='Anomalies in the anomaly payload')
+    parser.add_argument('--days', type=int, default=90, help='Days in the report payload')
+    parser.add_argument('--sources', type=int, default=20, help='Sources in the report payload')
+    parser.add_argument('--threshold', type=int, default=1024, help='Compression threshold in bytes')
+    parser.add_argument('--repeat', type=int, default=200, help='Encode/decode rounds per measurement')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    return parser.parse_args()
+
+def build_payloads(args):
+    """Generate payloads shaped like the ones agents exchange."""
+    rng = random.Random(args.seed)
+    sources = [f"source_{index}" for index in range(args.sources)]
+
+    configuration = {"alert_channels": ["system", "email"], "alert_check_frequency": 300}
+
+    anomalies = {
+        "date": "2025-04-05",
+        "anomalies": [
+            {
+                "type": "sales_anomaly",
+                "source": rng.choice(sources),
+                "date": "2025-04-05",
+                "metric": "total_sales",
+                "value": round(rng.uniform(100, 100000), 2),
+                "expected": round(rng.uniform(100, 100000), 2),
+                "z_score": rng.gauss(0, 3)
+            }
+            for _ in range(args.anomalies)
+        ]
+    }
+
+    report = {
+        "report_type": "sales_summary",
+        "start_date": "2025-01-01",
+        "end_date": "2025-03-31",
+        "daily": [
+            {
+                "date": (datetime.date(2025, 1, 1) + datetime.timedelta(days=day)).isoformat(),
+                "source": source,
+                "total_sales": round(rng.uniform(1000, 50000), 2),
+                "total_orders": rng.randrange(10, 2000),
+                "unique_customers": rng.randrange(10, 1500)
+            }
+            for day in range(args.days)
+            for source in sources
+        ]
+    }
+
+    return {"configuration": configuration, "anomalies": anomalies, "report": report}
+
+def measure(codec, payload, repeat):
+    """Return (encoded bytes, encode µs, decode µs) for one payload."""
+    encoded = codec.encode(payload)
+    if decode_payload(encoded) != payload:
+        raise AssertionError(f"{codec.format} round trip changed the payload")
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        codec.encode(payload)
+    encode_time = (time.perf_counter() - started) / repeat
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        decode_payload(encoded)
+    decode_time = (time.perf_counter() - started) / repeat
+
+    return len(encoded), encode_time * 1e6, decode_time * 1e6
+
+def main():
+    """Main function."""
+    args = parse_args()
+    payloads = build_payloads(args)
+    codecs = [
+        ("json", PayloadCodec("json", compress_threshold=0)),
+        ("json+zlib", PayloadCodec("json", compress_threshold=args.threshold)),
+        ("binary", PayloadCodec("binary", compress_threshold=0)),
+        ("binary+zlib", PayloadCodec("binary", compress_threshold=args.threshold))
+    ]
+
+    print(f"{'payload':>14} {'codec':>12} {'bytes':>10} {'ratio':>7} {'encode us':>11} {'decode us':>11}")
+    for name, payload in payloads.items():
+        baseline = None
+        for label, codec in codecs:
+            size, encode_us, decode_us = measure(codec, payload, args.repeat)
+            baseline = baseline or size
+            print(f"{name:>14} {label:>12} {size:>10} {size / baseline:>7.2f} "
+                  f"{encode_us:>11.1f} {decode_us:>11.1f}")
+
+if __name__ == '__main__':
+    main()
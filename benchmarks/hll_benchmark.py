@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Accuracy and speed benchmark for HyperLogLog unique-customer sketches.
+
+Compares merging daily sketches against exact distinct counting, either on
+synthetic data (default) or against COUNT(DISTINCT client_id) over the
+orders table of a configured database.
+
+Usage:
+    python -m benchmarks.hll_benchmark [--days 90] [--sources 20] [--precision 12]
+    python -m benchmarks.hll_benchmark --database --start 2025-01-01 --end 2025-03-31
+"""
+import argparse
+import random
+import time
+from utils.hyperloglog import HyperLogLog
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Benchmark HyperLogLog unique-customer counts')
+    parser.add_argument('--days', type=int, default=90, help='Days of synthetic data')
+    parser.add_argument('--sources', type=int, default=20, help='Number of synthetic sources')
+    parser.add_argument('--customers-per-day', type=int, default=500, help='Orders per source and day')
+    parser.add_argument('--customer-pool', type=int, default=200000, help='Distinct customers to draw from')
+    parser.add_argument('--precision', type=int, default=12, help='Sketch precision')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--database', action='store_true', help='Benchmark against the configured database')
+    parser.add_argument('--start', help='Start date for --database mode')
+    parser.add_argument('--end', help='End date for --database mode')
+    return parser.parse_args()
+
+def run_synthetic(args):
+    """Compare sketch merges with exact set unions on generated data."""
+    rng = random.Random(args.seed)
+    
+    print(f"Generating {args.days} days x {args.sources} sources x {args.customers_per_day} orders...")
+    daily_customers = [
+        [
+            {f"client_{rng.randrange(args.customer_pool)}" for _ in range(args.customers_per_day)}
+            for _ in range(args.sources)
+        ]
+        for _ in range(args.days)
+    ]
+    
+    started = time.perf_counter()
+    daily_sketches = [
+        [HyperLogLog(args.precision).update(customers).to_bytes() for customers in day]
+        for day in daily_customers
+    ]
+    build_time = time.perf_counter() - started
+    sketch_bytes = sum(len(sketch) for day in daily_sketches for sketch in day)
+    print(f"Built {args.days * args.sources} daily sketches in {build_time:.2f}s "
+          f"({sketch_bytes / (args.days * args.sources):.0f} bytes each on average)")
+    
+    print()
+    print(f"{'range':>8} {'exact':>10} {'estimate':>10} {'error':>8} {'exact ms':>10} {'hll ms':>8}")
+    for range_days in sorted({min(days, args.days) for days in (1, 7, 30, args.days)}):
+        started = time.perf_counter()
+        exact = len(set().union(*(customers for day in daily_customers[:range_days] for customers in day)))
+        exact_time = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        estimate = HyperLogLog.merge_all(
+            sketch for day in daily_sketches[:range_days] for sketch in day
+        ).count()
+        hll_time = time.perf_counter() - started
+        
+        error = (estimate - exact) / exact if exact else 0.0
+        print(f"{range_days:>7}d {exact:>10} {estimate:>10} {error:>+8.2%} "
+              f"{exact_time * 1000:>10.1f} {hll_time * 1000:>8.1f}")
+
+def run_database(args):
+    """Compare merged sales_metrics sketches with COUNT(DISTINCT) over orders."""
+    from core.db_connector import DBConnector
+    
+    db = DBConnector()
+    
+    started = time.perf_counter()
+    exact = db.query(
+        "SELECT COUNT(DISTINCT client_id) as customers FROM orders "
+        "WHERE date >= %s::date AND date < %s::date + 1",
+        (args.start, args.end)
+    )[0]["customers"]
+    exact_time = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    rows = db.query(
+        "SELECT customers_hll FROM sales_metrics "
+        "WHERE date >= %s AND date <= %s AND customers_hll IS NOT NULL",
+        (args.start, args.end)
+    )
+    estimate = HyperLogLog.merge_all(row["customers_hll"] for row in rows).count()
+    hll_time = time.perf_counter() - started
+    
+    error = (estimate - exact) / exact if exact else 0.0
+    print(f"COUNT(DISTINCT): {exact} in {exact_time * 1000:.1f} ms")
+    print(f"Merged {len(rows)} sketches: {estimate} in {hll_time * 1000:.1f} ms ({error:+.2%})")
+    
+    db.disconnect()
+
+def main():
+    """Main function."""
+    args = parse_args()
+    
+    if args.database:
+        if not args.start or not args.end:
+            raise SystemExit("--database requires --start and --end")
+        run_database(args)
+    else:
+        run_synthetic(args)
+
+if __name__ == '__main__':
+    main()
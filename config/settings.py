@@ -7,6 +7,167 @@ DATABASE_CONFIG = {
     "password": "your_password"
 }
 
+# Connection pool shared by all agent threads. Connections above max_size
+# (up to max_overflow) are opened under load and closed once returned.
+DATABASE_POOL_CONFIG = {
+    "min_size": 2,
+    "max_size": 10,
+    "max_overflow": 5,
+    "checkout_timeout": 30,  # Seconds to wait for a free connection
+    "health_check_interval": 60  # Ping connections idle longer than this
+}
+
+QUERY_CONFIG = {
+    "stream_itersize": 2000,  # Rows fetched per round trip by server-side cursors
+    "bulk_page_size": 1000,  # Rows per multi-row INSERT statement
+    "copy_chunk_size": 50000  # Rows buffered per COPY round trip
+}
+
+# Agents LISTEN on notify_channel and are woken as soon as a message addressed
+# to them is sent. Without a listener they fall back to polling.
+MESSAGING_CONFIG = {
+    "use_notifications": True,
+    "notify_channel": "agent_messages",
+    "poll_interval": 60,  # Seconds between polls when notifications are unavailable
+    # Agents in the same process exchange messages through an in-memory
+    # MessageBroker; only messages to other processes go through the database
+    "broker": True,
+    "broker_persist": True,  # Write locally delivered messages to agent_messages
+    "broker_flush_interval": 1.0,  # Seconds between write-behind batches
+    "broker_batch_size": 500  # Consumed messages that trigger an early flush
+}
+
+# Message content and task_data are stored as bytes encoded by PayloadCodec:
+# "json" or the more compact "binary" format. Payloads of at least
+# compress_threshold bytes are zlib-compressed. Readers detect the format
+# from each payload, so changing these settings needs no migration.
+PAYLOAD_CODEC_CONFIG = {
+    "format": "json",
+    "compress_threshold": 1024,  # Bytes; 0 disables compression
+    "compression_level": 6
+}
+
+# Task workers started by the scheduler for each agent type. They claim tasks
+# with FOR UPDATE SKIP LOCKED, so any number of workers (on any number of
+# nodes) can drain agent_tasks in parallel without processing a task twice.
+TASK_WORKER_CONFIG = {
+    "workers": {
+        "data_collection": 2,
+        "reporting": 2
+    },
+    "claim_batch_size": 1,  # Tasks claimed per round trip
+    "idle_wait": 5  # Seconds a worker waits when no task is pending
+}
+
+# Scheduler configuration
+SCHEDULER_CONFIG = {
+    "stop_timeout": 10,  # Seconds stop_agent/stop_agents wait for threads to exit
+    # Scheduled jobs record their last run in scheduled_job_runs; after
+    # downtime, catch-up jobs rerun at most this many missed occurrences
+    "max_catch_up_runs": 31,
+    "job_retry_delay": 60  # Seconds before a failed job is retried
+}
+
+# Several nodes (main.py processes) can share one database. Each node
+# heartbeats in agent_registry; sources are hashed into shard_count shards
+# that are divided among live nodes, and singleton work (reports, alert
+# scans, rollups) runs only on the node holding the role's advisory lock.
+CLUSTER_CONFIG = {
+    "enabled": False,
+    "shard_count": 64,
+    "heartbeat_interval": 10,  # Seconds between node heartbeats
+    "node_timeout": 30  # Nodes without a heartbeat for this long are considered dead
+}
+
+# Agent status changes and liveness are written to agent_registry by a
+# HeartbeatService in one batched statement every flush_interval seconds.
+# Changes to immediate_statuses are written at once, so a stopped agent stops
+# showing as running without waiting for the next flush. last_active only
+# advances when an agent completes a loop iteration, so idle agents run one
+# at least every max_idle seconds.
+HEARTBEAT_CONFIG = {
+    "enabled": True,
+    "flush_interval": 15,
+    "immediate_statuses": ["error", "inactive"],
+    "max_idle": 60  # Seconds
+}
+
+# AsyncAgentRuntime runs agents as coroutines on one event loop. Their blocking
+# steps share max_workers threads, which should not exceed the connection pool
+# size so steps never queue on a connection checkout.
+ASYNC_RUNTIME_CONFIG = {
+    "max_workers": 10,
+    "stop_timeout": 10  # Seconds stop() waits for agent coroutines to finish
+}
+
+# agent_messages and agent_tasks are partitioned by month. The maintenance
+# agent creates partitions premake_months ahead and, once a month is older
+# than the retention period, detaches its partition into the agent_archive
+# schema (or drops it when archive is False). Partitions that still hold
+# unread messages or unfinished tasks are kept. Creating and detaching
+# partitions briefly lock the parent table against sends and claims; a cron
+# expression such as "15 3 * * *" for check_interval runs it off-peak.
+RETENTION_CONFIG = {
+    "messages_months": 3,
+    "tasks_months": 3,
+    "premake_months": 2,
+    "archive": True,
+    "check_interval": 3600,  # Seconds between partition maintenance runs, or a cron expression
+    "lock_timeout": 5  # Seconds partition DDL waits for a table lock before retrying on the next run
+}
+
+# Incremental collection aggregates only orders above each source's
+# high-water mark and merges them into that day's sales_metrics row.
+COLLECTION_CONFIG = {
+    "incremental": True,
+    "backfill_chunk_days": 7,  # Days aggregated per backfill chunk
+    "backfill_workers": 4,  # Chunks processed in parallel
+    "hll_precision": 12,  # Unique-customer sketches: 2^12 registers, ~1.6% error
+    # Seconds to wait for running order inserts before scanning up to the
+    # newest order id; orders of slower inserts are picked up on a later run
+    "settle_wait": 2
+}
+
+# Cron schedules (minute hour day-of-month month day-of-week) of the
+# periodic reports; each run covers the period before its scheduled time
+REPORTING_CONFIG = {
+    "schedules": {
+        "daily": "5 0 * * *",
+        "weekly": "10 0 * * 1",
+        "monthly": "15 0 1 * *"
+    }
+}
+
+# Anomaly detection: each day is scored against the trailing `window` days
+# (or, for advanced analysis, the same weekday over `seasonal_weeks` weeks).
+ANALYTICS_CONFIG = {
+    "window": 28,
+    "z_threshold": 3.0,
+    "high_severity_z": 4.0,  # Anomaly insights at or beyond this are stored as "high"
+    "min_history": 7,  # Days of history required before a day is scored
+    "seasonal_weeks": 8,
+    "analysis_window_days": 90,  # Days loaded by scheduled analysis runs
+    "analysis_frequency": 3600,  # Seconds between scheduled analysis runs
+    "alert_recent_days": 1,  # Only anomalies this close to the latest day are alerted
+    # Scheduled runs fold only new closed days into persisted running
+    # statistics (analytics_source_stats) instead of re-reading the window
+    "online_analysis": True,
+    "online_metrics": ["total_sales", "total_orders"],
+    "ewma_alpha": 0.1,  # Weight of the newest day in the exponentially weighted baseline
+    # A past day is folded into the running statistics only once its
+    # sales_metrics row has not changed for this many seconds, so late orders
+    # collected after midnight are included; keep it above the collection interval
+    "close_grace_period": 7200,
+    # "process" runs windowed anomaly detection on a process pool, split by
+    # source, so heavy analysis does not compete for the GIL with agent threads
+    "execution_mode": "thread",
+    "process_workers": None,  # Defaults to the number of CPUs
+    "columnar_fetch": True,  # Load analysis input as NumPy column arrays, not row dicts
+    # analyze_data results are reused while the analyzed rows are unchanged
+    "result_cache_size": 128,
+    "result_cache_ttl": 3600  # Seconds
+}
+
 LOGGING_CONFIG = {
     "version": 1,
     "formatters": {
@@ -1,18 +1,85 @@
 import json
 import uuid
+import time
+import select
+import socket
 import datetime
+import threading
 import logging
 from abc import ABC, abstractmethod
+from config.settings import MESSAGING_CONFIG, TASK_WORKER_CONFIG
+from core.records import Message, Task
+from utils.payload_codec import PayloadCodec, decode_payload
+
+SEND_MESSAGES_QUERY = """
+INSERT INTO agent_messages (sender_id, recipient_id, message_type, content)
+VALUES %s
+RETURNING id
+"""
+
+# Wakes every recipient of a batch with one statement
+NOTIFY_RECIPIENTS_QUERY = "SELECT pg_notify(%s, recipient) FROM unnest(%s::text[]) AS recipient"
+
+# Claims and acknowledges the oldest unread messages in one statement;
+# SKIP LOCKED lets concurrent readers of the same recipient split a backlog
+RECEIVE_MESSAGES_QUERY = """
+WITH next AS (
+    SELECT id
+    FROM agent_messages
+    WHERE recipient_id = %s AND is_read = FALSE
+    ORDER BY created_at, id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE agent_messages m
+SET is_read = TRUE
+FROM next
+WHERE m.id = next.id
+RETURNING m.id, m.sender_id, m.recipient_id, m.message_type, m.content, m.is_read, m.created_at
+"""
+
+PEEK_MESSAGES_QUERY = """
+SELECT id, sender_id, recipient_id, message_type, content, is_read, created_at
+FROM agent_messages
+WHERE recipient_id = %s AND is_read = FALSE
+ORDER BY created_at, id
+LIMIT %s
+"""
 
 class BaseAgent(ABC):
+    # Message types this agent receives from local publishers (see MessageBroker)
+    subscriptions = ()
+    
     def __init__(self, agent_id=None, agent_type=None):
         self.agent_id = agent_id or f"{agent_type}_{uuid.uuid4()}"
         self.agent_type = agent_type
         self.status = "inactive"
         self.logger = logging.getLogger(f"agent.{self.agent_type}")
+        self.use_notifications = MESSAGING_CONFIG["use_notifications"]
+        self.notify_channel = MESSAGING_CONFIG["notify_channel"]
+        self.poll_interval = MESSAGING_CONFIG["poll_interval"]
+        self.task_batch_size = TASK_WORKER_CONFIG["claim_batch_size"]
+        self._listener = None
+        self.error_backoff = 60  # Seconds to wait after a failed iteration
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        # Socket pair letting wake() interrupt a select() on the listener;
+        # created on first use so agents run by AsyncAgentRuntime hold no sockets
+        self._wake_sockets = None
+        self._wake_lock = threading.Lock()
+        self.wake_callback = None  # Called by wake(); set by AsyncAgentRuntime
+        self.cluster = None  # ClusterNode set by the scheduler when clustering is enabled
+        self.broker = None  # MessageBroker set when the agent is attached to one
+        self.heartbeats = None  # HeartbeatService buffering registry writes, set by the scheduler
+        self.payload_codec = PayloadCodec()  # Encodes message content and task data
         
     def register(self, db_connector):
         """Register agent in the agent_registry table"""
+        if self.heartbeats is not None:
+            self.heartbeats.record(self, self.status)
+            self.logger.info(f"Agent {self.agent_id} registration queued")
+            return
+            
         query = """
         INSERT INTO agent_registry (agent_id, agent_type, status)
         VALUES (%s, %s, %s)
@@ -23,8 +90,13 @@ class BaseAgent(ABC):
         self.logger.info(f"Agent {self.agent_id} registered successfully")
         
     def update_status(self, db_connector, status):
-        """Update agent status in the registry"""
+        """Update agent status in the registry, through the heartbeat service when there is one"""
         self.status = status
+        if self.heartbeats is not None:
+            self.heartbeats.record(self, status)
+            self.logger.info(f"Agent {self.agent_id} status updated to {status}")
+            return
+            
         query = """
         UPDATE agent_registry 
         SET status = %s, last_active = CURRENT_TIMESTAMP
@@ -34,63 +106,327 @@ class BaseAgent(ABC):
         self.logger.info(f"Agent {self.agent_id} status updated to {status}")
     
     def send_message(self, db_connector, recipient_id, message_type, content):
-        """Send a message to another agent"""
-        query = """
-        INSERT INTO agent_messages (sender_id, recipient_id, message_type, content)
-        VALUES (%s, %s, %s, %s)
-        RETURNING id
+        """Send a message to another agent
+        
+        Recipients attached to the same MessageBroker get the message in
+        memory, and None is returned; otherwise it is stored in
+        agent_messages and its id is returned.
         """
-        message_id = db_connector.execute(query, (
-            self.agent_id, recipient_id, message_type, json.dumps(content)
-        ))
-        self.logger.info(f"Message sent to {recipient_id}, type: {message_type}, id: {message_id}")
-        return message_id
+        return self.send_messages(db_connector, [(recipient_id, message_type, content)])[0]
     
-    def get_messages(self, db_connector, mark_as_read=True):
-        """Get messages sent to this agent"""
-        query = """
-        SELECT id, sender_id, message_type, content, created_at
-        FROM agent_messages
-        WHERE recipient_id = %s AND is_read = FALSE
-        ORDER BY created_at ASC
+    def send_messages(self, db_connector, messages):
+        """Send several (recipient_id, message_type, content) messages at once
+        
+        Messages for local recipients are delivered through the broker; the
+        rest are stored with one multi-row INSERT and their recipients woken
+        with one NOTIFY statement, in a single transaction. Returns the
+        message ids in input order (None for local deliveries and, if the
+        insert fails, for every stored message).
+        """
+        message_ids = [None] * len(messages)
+        stored = []
+        for index, (recipient_id, message_type, content) in enumerate(messages):
+            if self.broker is not None:
+                if self.broker.deliver(self.agent_id, recipient_id, message_type, content):
+                    continue
+                self.broker.record_fallback()
+            stored.append(index)
+        
+        if not stored:
+            return message_ids
+        
+        rows = [
+            (self.agent_id, messages[index][0], messages[index][1], self.payload_codec.encode(messages[index][2]))
+            for index in stored
+        ]
+        recipients = sorted({row[1] for row in rows})
+        try:
+            with db_connector.transaction():
+                ids = db_connector.execute_many(SEND_MESSAGES_QUERY, rows)
+                if ids is None:
+                    raise RuntimeError("Failed to store messages")
+                
+                # Wake the recipients immediately instead of waiting for their next poll
+                if self.use_notifications:
+                    db_connector.execute(NOTIFY_RECIPIENTS_QUERY, (self.notify_channel, recipients))
+        except Exception as e:
+            self.logger.error(f"Error sending {len(rows)} message(s): {str(e)}")
+            return message_ids
+        
+        for index, message_id in zip(stored, ids):
+            message_ids[index] = message_id
+        
+        if len(rows) == 1:
+            self.logger.info(f"Message sent to {rows[0][1]}, type: {rows[0][2]}, id: {ids[0]}")
+        else:
+            self.logger.info(f"Sent {len(rows)} messages to {len(recipients)} recipient(s)")
+        return message_ids
+    
+    def is_leader(self):
+        """True if this agent should run its singleton work; always True outside a cluster"""
+        return self.cluster is None or self.cluster.is_leader(self.agent_type)
+    
+    def owned_shards(self):
+        """Source shards this agent should process, or None for all of them outside a cluster"""
+        return None if self.cluster is None else self.cluster.owned_shards()
+    
+    @property
+    def stopping(self):
+        """True once stop() has been called; run loops exit when this is set"""
+        return self._stop_event.is_set()
+    
+    def stop(self):
+        """Ask the run loop to exit, interrupting any wait in progress"""
+        self._stop_event.set()
+        self.wake()
+    
+    def wake(self):
+        """Interrupt the current wait so the run loop checks its work immediately"""
+        self._wake_event.set()
+        wake_sockets = self._wake_sockets
+        if wake_sockets is not None:
+            try:
+                wake_sockets[1].send(b"\0")
+            except (BlockingIOError, OSError):
+                pass  # A wakeup is already pending
+        if self.wake_callback is not None:
+            self.wake_callback()
+    
+    def reset_stop(self):
+        """Clear a previous stop request so the agent can be started again"""
+        self._stop_event.clear()
+    
+    def pause(self, timeout):
+        """Wait up to ``timeout`` seconds or until woken; returns True if woken"""
+        woken = self._wake_event.wait(max(0, timeout))
+        self._clear_wake()
+        return woken
+    
+    def _clear_wake(self):
+        self._wake_event.clear()
+        if self._wake_sockets is None:
+            return
+        try:
+            while self._wake_sockets[0].recv(1024):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+    
+    def _get_wake_reader(self):
+        with self._wake_lock:
+            if self._wake_sockets is None:
+                wake_sockets = socket.socketpair()
+                for wake_socket in wake_sockets:
+                    wake_socket.setblocking(False)
+                self._wake_sockets = wake_sockets
+        return self._wake_sockets[0]
+    
+    def wait_for_messages(self, db_connector, timeout):
+        """Block until a message notification arrives for this agent or timeout expires.
+        
+        Returns True when woken by a notification, wake() or stop(). Without a
+        notification listener this falls back to waiting for at most
+        ``poll_interval`` seconds, so callers must tolerate waking before
+        ``timeout``.
+        """
+        listener = self._get_listener(db_connector)
+        if listener is None:
+            return self.pause(min(timeout, self.poll_interval))
+        
+        # Created before checking the event so a concurrent wake() is not lost
+        wake_reader = self._get_wake_reader()
+        if self._wake_event.is_set():
+            self._clear_wake()
+            return True
+        
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            
+            try:
+                ready, _, _ = select.select([listener, wake_reader], [], [], remaining)
+                if not ready:
+                    return False
+                if wake_reader in ready:
+                    self._clear_wake()
+                    return True
+                listener.poll()
+            except Exception as e:
+                self.logger.warning(f"Notification listener failed, falling back to polling: {str(e)}")
+                self.close_listener()
+                return self.pause(min(deadline - time.monotonic(), self.poll_interval))
+            
+            woken = False
+            while listener.notifies:
+                notification = listener.notifies.pop(0)
+                if notification.payload == self.agent_id:
+                    woken = True
+            if woken:
+                return True
+    
+    def _get_listener(self, db_connector):
+        """Return this agent's LISTEN connection, opening it on first use"""
+        if not self.use_notifications:
+            return None
+        if self._listener is None or self._listener.closed:
+            self._listener = db_connector.listen(self.notify_channel)
+        return self._listener
+    
+    def close_listener(self):
+        """Close the notification listener connection"""
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except Exception:
+                pass
+            self._listener = None
+    
+    def publish(self, db_connector, message_type, content, fallback_recipient=None):
+        """Send a message to every local subscriber of ``message_type``
+        
+        Without a broker or local subscribers, the message is sent through
+        the database to ``fallback_recipient`` when one is given.
         """
-        messages = db_connector.query(query, (self.agent_id,))
-        
-        if mark_as_read and messages:
-            message_ids = [m["id"] for m in messages]
-            update_query = """
-            UPDATE agent_messages
-            SET is_read = TRUE
-            WHERE id IN (%s)
-            """
-            placeholders = ", ".join(["%s"] * len(message_ids))
-            db_connector.execute(update_query % placeholders, tuple(message_ids))
+        self.publish_many(db_connector, message_type, [content], fallback_recipient)
+    
+    def publish_many(self, db_connector, message_type, contents, fallback_recipient=None):
+        """Publish several messages of one type, sending unsubscribed ones in one batch"""
+        unpublished = [
+            content for content in contents
+            if self.broker is None or not self.broker.publish(self.agent_id, message_type, content)
+        ]
+        if unpublished and fallback_recipient is not None:
+            self.send_messages(
+                db_connector, [(fallback_recipient, message_type, content) for content in unpublished]
+            )
+    
+    def get_messages(self, db_connector, mark_as_read=True, limit=None):
+        """Get unread messages sent to this agent, oldest first
+        
+        Messages stored in agent_messages are claimed and marked read by a
+        single UPDATE ... RETURNING, so concurrent readers never receive the
+        same message. Messages queued by the local broker follow them. At
+        most ``limit`` messages are returned; with ``mark_as_read`` False
+        they are left unread.
+        """
+        if mark_as_read:
+            messages = db_connector.execute_returning(
+                RECEIVE_MESSAGES_QUERY, (self.agent_id, limit), record_class=Message
+            )
+            messages.sort(key=lambda message: (message.created_at, message.id))
+        else:
+            messages = db_connector.query(PEEK_MESSAGES_QUERY, (self.agent_id, limit), record_class=Message)
+        
+        if self.broker is not None and (limit is None or len(messages) < limit):
+            remaining = None if limit is None else limit - len(messages)
+            messages.extend(self.broker.take(self.agent_id, limit=remaining, consume=mark_as_read))
             
         return messages
     
-    def create_task(self, db_connector, task_data, priority=5):
-        """Create a new task for this agent"""
+    def create_task(self, db_connector, task_data, priority=5, agent_type=None):
+        """Queue a new task for agents of ``agent_type`` (this agent's type by default)"""
         task_id = f"task_{uuid.uuid4()}"
         query = """
-        INSERT INTO agent_tasks (task_id, agent_id, status, priority, task_data)
-        VALUES (%s, %s, %s, %s, %s)
+        INSERT INTO agent_tasks (task_id, agent_id, agent_type, status, priority, task_data)
+        VALUES (%s, %s, %s, %s, %s, %s)
         RETURNING id
         """
         task_db_id = db_connector.execute(query, (
-            task_id, self.agent_id, "pending", priority, json.dumps(task_data)
+            task_id, self.agent_id, agent_type or self.agent_type, "pending", priority,
+            self.payload_codec.encode(task_data)
         ))
         self.logger.info(f"Task created: {task_id} with priority {priority}")
         return task_id
     
     def get_pending_tasks(self, db_connector):
-        """Get pending tasks for this agent"""
+        """Get pending tasks in this agent's queue without claiming them"""
         query = """
-        SELECT id, task_id, priority, task_data, created_at
+        SELECT id, task_id, agent_id, agent_type, priority, task_data AS encoded_task_data, created_at
         FROM agent_tasks
-        WHERE agent_id = %s AND status = 'pending'
+        WHERE agent_type = %s AND status = 'pending'
         ORDER BY priority DESC, created_at ASC
         """
-        return db_connector.query(query, (self.agent_id,))
+        return db_connector.query(query, (self.agent_type,), record_class=Task)
+    
+    def claim_tasks(self, db_connector, limit=1):
+        """Atomically claim up to ``limit`` pending tasks and mark them in progress.
+        
+        Tasks are queued per agent type, so every instance of a type (on any
+        node) claims from the same queue. Rows locked by a concurrent claimer
+        are skipped, so workers and instances never claim the same task.
+        """
+        query = """
+        UPDATE agent_tasks
+        SET status = 'in_progress', started_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id
+            FROM agent_tasks
+            WHERE agent_type = %s AND status = 'pending'
+            ORDER BY priority DESC, created_at ASC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, task_id, agent_id, agent_type, priority, task_data AS encoded_task_data, created_at
+        """
+        tasks = db_connector.execute_returning(query, (self.agent_type, limit), record_class=Task)
+        tasks.sort(key=lambda task: (-task.priority, task.created_at))
+        
+        if tasks:
+            self.logger.info(f"Claimed {len(tasks)} task(s)")
+        return tasks
+    
+    def process_pending_tasks(self, db_connector, limit=None):
+        """Claim pending tasks and process them one by one, returning the claimed tasks"""
+        tasks = self.claim_tasks(db_connector, limit or self.task_batch_size)
+        
+        for task in tasks:
+            try:
+                self.process_task(db_connector, task)
+            except Exception as e:
+                self.logger.error(f"Error processing task {task['task_id']}: {str(e)}")
+                self.update_task_status(db_connector, task["task_id"], "failed", {"error": str(e)})
+                
+        return tasks
+    
+    def drain_tasks(self, db_connector):
+        """Process pending tasks until none are left, returning all processed tasks"""
+        processed = []
+        while True:
+            tasks = self.process_pending_tasks(db_connector)
+            if not tasks:
+                return processed
+            processed.extend(tasks)
+    
+    def process_task(self, db_connector, task):
+        """Handle a single claimed task; subclasses override this for their task types"""
+        task_type = self.load_task_data(task).get("type")
+        self.logger.warning(f"No handler for task {task['task_id']} of type {task_type}")
+        self.update_task_status(
+            db_connector, task["task_id"], "failed",
+            {"error": f"Unsupported task type: {task_type}"}
+        )
+    
+    def load_task_data(self, task):
+        """Return the task payload as a dict
+        
+        Task records decode their payload lazily; dictionary rows may carry
+        it still encoded (bytes or JSON text) or already decoded.
+        """
+        task_data = task["task_data"]
+        if isinstance(task_data, (str, bytes, memoryview)):
+            return decode_payload(task_data)
+        return task_data or {}
+    
+    def update_task_progress(self, db_connector, task_id, result):
+        """Record intermediate results of a running task without changing its status"""
+        query = """
+        UPDATE agent_tasks
+        SET result = %s
+        WHERE task_id = %s
+        """
+        db_connector.execute(query, (json.dumps(result), task_id))
     
     def update_task_status(self, db_connector, task_id, status, result=None):
         """Update task status and optionally add result"""
@@ -111,7 +447,43 @@ class BaseAgent(ABC):
         db_connector.execute(query, tuple(params))
         self.logger.info(f"Task {task_id} status updated to {status}")
     
-    @abstractmethod
     def run(self, db_connector):
-        """Main agent execution method, must be implemented by subclasses"""
+        """Run the agent loop in the calling thread until stop() is called"""
+        self.update_status(db_connector, "active")
+        
+        try:
+            while not self.stopping:
+                try:
+                    timeout = self.heartbeat(self.run_once(db_connector))
+                    
+                    # Wait for scheduled work, waking early when a message arrives
+                    self.wait_for_messages(db_connector, timeout)
+                    
+                except Exception as e:
+                    self.logger.error(f"Error in {self.agent_type} agent: {str(e)}")
+                    self.update_status(db_connector, "error")
+                    self.pause(self.error_backoff)  # Wait before retrying, returning early on stop
+        finally:
+            self.close()
+        
+        self.update_status(db_connector, "inactive")
+    
+    def close(self):
+        """Release resources held while running; called when run() or an agent runtime stops the agent"""
+        self.close_listener()
+    
+    def heartbeat(self, timeout):
+        """Record a completed run_once() and return ``timeout`` capped so the agent beats again in time"""
+        if self.heartbeats is None:
+            return timeout
+        self.heartbeats.beat(self)
+        return min(timeout, self.heartbeats.max_idle)
+    
+    @abstractmethod
+    def run_once(self, db_connector):
+        """Handle new messages, tasks and any due work once, without blocking.
+        
+        Returns the number of seconds until the agent next has scheduled
+        work. Both the threaded run() loop and AsyncAgentRuntime call this.
+        """
         pass
@@ -1,20 +1,451 @@
+import time
+import heapq
+import datetime
+import itertools
 import threading
 import logging
-from agents.data_collection_agent import DataCollectionAgent
-from agents.analytics_agent import AnalyticsAgent
-from agents.alert_agent import AlertAgent
-from agents.reporting_agent import ReportingAgent
+from collections import deque
+from config.settings import (
+    TASK_WORKER_CONFIG, SCHEDULER_CONFIG, CLUSTER_CONFIG, MESSAGING_CONFIG, HEARTBEAT_CONFIG
+)
+from core.cluster import ClusterNode
+from core.message_broker import MessageBroker
+
+# Persists the scheduled time of each job's last completed run
+RECORD_RUN_QUERY = """
+INSERT INTO scheduled_job_runs (owner, job_name, last_run)
+VALUES (%s, %s, %s)
+ON CONFLICT (owner, job_name) DO UPDATE SET
+    last_run = EXCLUDED.last_run,
+    updated_at = CURRENT_TIMESTAMP
+"""
+
+LOAD_RUNS_QUERY = "SELECT job_name, last_run FROM scheduled_job_runs WHERE owner = %s"
+
+# Writes coalesced registry changes; last_active is backdated by the time
+# each change waited in the buffer
+HEARTBEAT_FLUSH_QUERY = """
+INSERT INTO agent_registry (agent_id, agent_type, status, last_active)
+VALUES %s
+ON CONFLICT (agent_id) DO UPDATE SET
+    status = EXCLUDED.status,
+    last_active = EXCLUDED.last_active
+"""
+
+HEARTBEAT_FLUSH_TEMPLATE = "(%s, %s, %s, CURRENT_TIMESTAMP - make_interval(secs => %s))"
+
+# (name, lowest value, highest value) of each cron field; 7 is also Sunday
+CRON_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7)
+)
+
+class CronSchedule:
+    """Five-field cron expression: minute hour day-of-month month day-of-week.
+    
+    Fields accept ``*``, numbers, ranges (``1-5``), lists (``1,15``) and steps
+    (``*/15``, ``0-30/10``). Day of week counts from 0 = Sunday. As in cron,
+    when both day fields are restricted a day matches if either one does.
+    """
+    
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f"Cron expression needs {len(CRON_FIELDS)} fields: {expression!r}")
+            
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self._parse_field(field, name, low, high)
+            for field, (name, low, high) in zip(fields, CRON_FIELDS)
+        ]
+        self.weekdays = frozenset(weekday % 7 for weekday in weekdays)
+        self.day_restricted = not fields[2].startswith("*")
+        self.weekday_restricted = not fields[4].startswith("*")
+        
+    @staticmethod
+    def _parse_field(field, name, low, high):
+        values = set()
+        for part in field.split(","):
+            span, has_step, step = part.partition("/")
+            try:
+                step = int(step) if has_step else 1
+                if span == "*":
+                    start, end = low, high
+                elif "-" in span:
+                    start, end = (int(value) for value in span.split("-", 1))
+                else:
+                    start = int(span)
+                    end = high if has_step else start
+            except ValueError:
+                raise ValueError(f"Invalid cron {name} field: {field!r}") from None
+                
+            if step < 1 or start < low or end > high or start > end:
+                raise ValueError(f"Invalid cron {name} field: {field!r}")
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+        
+    def _day_matches(self, moment):
+        day_matches = moment.day in self.days
+        weekday_matches = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_matches or weekday_matches
+        return day_matches and weekday_matches
+        
+    def next_after(self, moment):
+        """Return the first matching minute strictly after ``moment``"""
+        candidate = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = candidate + datetime.timedelta(days=5 * 366)
+        
+        # Skip whole months, days and hours that cannot match
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1) + datetime.timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self._day_matches(candidate):
+                candidate = (candidate + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + datetime.timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+        
+    def __repr__(self):
+        return f"CronSchedule({self.expression!r})"
+
+
+class IntervalSchedule:
+    """Fixed interval between runs, in seconds"""
+    
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError(f"Interval must be positive: {seconds}")
+        self.seconds = seconds
+        
+    def next_after(self, moment):
+        return moment + datetime.timedelta(seconds=self.seconds)
+        
+    def __repr__(self):
+        return f"IntervalSchedule({self.seconds})"
+
+
+class ScheduledJob:
+    """A named callback and its schedule, as tracked by JobScheduler"""
+    
+    def __init__(self, name, schedule, callback, catch_up, run_immediately):
+        self.name = name
+        self.schedule = schedule
+        self.callback = callback
+        self.catch_up = catch_up
+        self.run_immediately = run_immediately
+        self.last_run = None  # Scheduled time of the last completed run
+        self.entry = None  # Current heap entry; older entries for the job are stale
+
+
+class JobScheduler:
+    """Heap of scheduled jobs, run from an agent's own loop.
+    
+    ``run_due()`` calls ``callback(db_connector, scheduled_for)`` for every
+    job whose time has come, and ``seconds_until_next()`` tells the agent
+    exactly how long it may wait. The scheduled time of each job's last
+    completed run is stored in scheduled_job_runs under ``owner``. After a
+    restart a ``catch_up`` job runs once for every occurrence missed while
+    the process was down (at most ``max_catch_up_runs``); other jobs run
+    once if they are overdue.
+    
+    A job whose callback raises is retried after ``retry_delay`` seconds
+    with the same scheduled time.
+    """
+    
+    def __init__(self, owner, max_catch_up_runs=None, retry_delay=None):
+        self.owner = owner
+        self.max_catch_up_runs = max_catch_up_runs or SCHEDULER_CONFIG["max_catch_up_runs"]
+        self.retry_delay = retry_delay or SCHEDULER_CONFIG["job_retry_delay"]
+        self.logger = logging.getLogger("agent.scheduler")
+        self.jobs = {}
+        self._heap = []  # (due, sequence, job, scheduled_for)
+        self._sequence = itertools.count()
+        self._loaded = False
+        
+    def add_job(self, name, schedule, callback, catch_up=True, run_immediately=False):
+        """Add or replace a job.
+        
+        ``schedule`` is a CronSchedule or IntervalSchedule, a cron expression
+        string or an interval in seconds. ``run_immediately`` makes a job with
+        no recorded run due at once instead of at its next occurrence.
+        Replacing a job keeps its last run, so changing an interval takes
+        effect relative to when the job last ran.
+        """
+        if isinstance(schedule, str):
+            schedule = CronSchedule(schedule)
+        elif isinstance(schedule, (int, float)):
+            schedule = IntervalSchedule(schedule)
+            
+        job = ScheduledJob(name, schedule, callback, catch_up, run_immediately)
+        previous = self.jobs.get(name)
+        if previous is not None:
+            job.last_run = previous.last_run
+        self.jobs[name] = job
+        
+        if self._loaded:
+            self._schedule(job, datetime.datetime.now())
+        return job
+        
+    def reset(self):
+        """Forget all run state; the next run_due() reloads it from the database.
+        
+        Used when another node may have run the jobs in the meantime, such
+        as after regaining leadership.
+        """
+        for job in self.jobs.values():
+            job.last_run = None
+            job.entry = None
+        self._heap = []
+        self._loaded = False
+        
+    def remove_job(self, name):
+        """Remove a job; returns False if there was none"""
+        return self.jobs.pop(name, None) is not None
+        
+    def next_run(self, name):
+        """Return the time a job is next due, or None before the first run_due()"""
+        job = self.jobs.get(name)
+        if job is None or job.entry is None:
+            return None
+        return job.entry[0]
+        
+    def seconds_until_next(self, default=3600):
+        """Seconds until the earliest job is due; 0 before the first run_due()"""
+        if not self._loaded:
+            return 0
+            
+        self._discard_stale()
+        if not self._heap:
+            return default
+        return max(0.0, (self._heap[0][0] - datetime.datetime.now()).total_seconds())
+        
+    def run_due(self, db_connector):
+        """Run every due job in order of due time, returning the (name, scheduled_for) pairs run"""
+        if not self._loaded:
+            self._load(db_connector)
+            
+        completed = []
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > datetime.datetime.now():
+                return completed
+                
+            _, _, job, scheduled_for = heapq.heappop(self._heap)
+            job.entry = None
+            try:
+                job.callback(db_connector, scheduled_for)
+            except Exception as e:
+                self.logger.error(f"Job {self.owner}.{job.name} for {scheduled_for} failed: {str(e)}")
+                retry_at = datetime.datetime.now() + datetime.timedelta(seconds=self.retry_delay)
+                self._push(job, retry_at, scheduled_for)
+                continue
+                
+            job.last_run = scheduled_for
+            if db_connector.execute(RECORD_RUN_QUERY, (self.owner, job.name, scheduled_for)) is None:
+                self.logger.error(
+                    f"Job {self.owner}.{job.name} for {scheduled_for} ran but could not be recorded; "
+                    f"it runs again after a restart"
+                )
+            completed.append((job.name, scheduled_for))
+            
+            if self.jobs.get(job.name) is job:
+                now = datetime.datetime.now()
+                next_run = job.schedule.next_after(scheduled_for)
+                if next_run <= now and not job.catch_up:
+                    next_run = job.schedule.next_after(now)
+                self._push(job, next_run, next_run)
+                
+    def _load(self, db_connector):
+        """Read recorded last runs and schedule every job from them.
+        
+        Raises if the run state cannot be read or started, instead of
+        treating the jobs as never run, which would skip their catch-up.
+        """
+        # Not through query(), which returns no rows on error
+        with db_connector.transaction() as cursor:
+            cursor.execute(LOAD_RUNS_QUERY, (self.owner,))
+            last_runs = dict(cursor.fetchall())
+        
+        now = datetime.datetime.now()
+        for job in self.jobs.values():
+            if job.last_run is None:
+                job.last_run = last_runs.get(job.name)
+            if job.last_run is None and not job.run_immediately:
+                # Start the history now so downtime from here on is caught up
+                if db_connector.execute(RECORD_RUN_QUERY, (self.owner, job.name, now)) is None:
+                    raise RuntimeError(f"Could not record the first run of job {self.owner}.{job.name}")
+                job.last_run = now
+        
+        for job in self.jobs.values():
+            self._schedule(job, now)
+        self._loaded = True
+        
+    def _schedule(self, job, now):
+        if job.last_run is None:
+            self._push(job, now, now)
+            return
+            
+        next_run = job.schedule.next_after(job.last_run)
+        if next_run <= now and not job.catch_up:
+            # Overdue: run once now rather than once per missed occurrence
+            next_run = now
+        elif next_run <= now:
+            missed = deque(maxlen=self.max_catch_up_runs)
+            occurrence = next_run
+            while occurrence <= now:
+                missed.append(occurrence)
+                occurrence = job.schedule.next_after(occurrence)
+            if missed[0] != next_run:
+                self.logger.warning(
+                    f"Job {self.owner}.{job.name} missed runs from {next_run}; "
+                    f"catching up from {missed[0]}"
+                )
+            next_run = missed[0]
+            self.logger.info(f"Job {self.owner}.{job.name} catching up {len(missed)} missed run(s)")
+        self._push(job, next_run, next_run)
+        
+    def _push(self, job, due, scheduled_for):
+        job.entry = (due, next(self._sequence), job, scheduled_for)
+        heapq.heappush(self._heap, job.entry)
+        
+    def _discard_stale(self):
+        while self._heap:
+            entry = self._heap[0]
+            job = entry[2]
+            if self.jobs.get(job.name) is job and job.entry is entry:
+                return
+            heapq.heappop(self._heap)
+
+
+class HeartbeatService:
+    """Buffers agent_registry writes of local agents and flushes them in batches.
+    
+    Status changes and registrations are coalesced per agent and written,
+    together with a last_active bump for every agent that completed a loop
+    iteration since the last flush (see beat()), by a single multi-row upsert
+    every ``flush_interval`` seconds. An agent wedged inside an iteration
+    stops beating, so its last_active goes stale. A change to one of
+    ``immediate_statuses`` (such as "error" or "inactive") is flushed at
+    once, and stop() flushes whatever is still buffered.
+    """
+    
+    def __init__(self, db_connector, flush_interval=None, immediate_statuses=None, max_idle=None):
+        self.db_connector = db_connector
+        self.flush_interval = flush_interval or HEARTBEAT_CONFIG["flush_interval"]
+        self.max_idle = max_idle or HEARTBEAT_CONFIG["max_idle"]
+        self.immediate_statuses = set(
+            HEARTBEAT_CONFIG["immediate_statuses"] if immediate_statuses is None else immediate_statuses
+        )
+        self.logger = logging.getLogger("agent.heartbeats")
+        self._pending = {}  # agent_id -> (agent_type, status, monotonic time of the change)
+        self._beats = {}  # agent_id -> (agent, monotonic time of its last completed iteration)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        
+    def record(self, agent, status):
+        """Buffer an agent's new status, flushing now if it is an immediate one"""
+        with self._lock:
+            self._pending[agent.agent_id] = (agent.agent_type, status, time.monotonic())
+            if status == "inactive":
+                self._beats.pop(agent.agent_id, None)
+                
+        if status in self.immediate_statuses:
+            self.flush()
+            
+    def beat(self, agent):
+        """Record that an agent completed a loop iteration, bumping its last_active on the next flush"""
+        with self._lock:
+            self._beats[agent.agent_id] = (agent, time.monotonic())
+            
+    def start(self):
+        """Write buffered registrations and start flushing in the background"""
+        self.flush()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="heartbeat-flush", daemon=True)
+        self._thread.start()
+        
+    def stop(self, timeout=None):
+        """Stop the background flush and write everything still buffered"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+        
+    def flush(self):
+        """Write buffered changes and last_active bumps in one statement; returns the rows written"""
+        with self._flush_lock:
+            now = time.monotonic()
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                beats, self._beats = self._beats, {}
+                changes = dict(pending)
+                for agent_id, (agent, beat_at) in beats.items():
+                    if agent_id not in changes:
+                        changes[agent_id] = (agent.agent_type, agent.status, beat_at)
+                        
+            if not changes:
+                return 0
+                
+            # Sorted so concurrent flushes lock registry rows in the same order
+            rows = [
+                (agent_id, agent_type, status, max(0.0, now - changed_at))
+                for agent_id, (agent_type, status, changed_at) in sorted(changes.items())
+            ]
+            written = self.db_connector.execute_many(HEARTBEAT_FLUSH_QUERY, rows, template=HEARTBEAT_FLUSH_TEMPLATE)
+            if written is None:
+                self.logger.error(f"Failed to flush {len(rows)} agent heartbeat(s), retrying on the next flush")
+                with self._lock:
+                    for agent_id, change in pending.items():
+                        self._pending.setdefault(agent_id, change)
+                    for agent_id, beat in beats.items():
+                        self._beats.setdefault(agent_id, beat)
+                return 0
+            return len(rows)
+            
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"Heartbeat flush failed: {str(e)}")
+
 
 class AgentScheduler:
-    def __init__(self, db_connector):
+    def __init__(self, db_connector, cluster=None):
         self.db_connector = db_connector
         self.logger = logging.getLogger("agent.scheduler")
+        if cluster is None and CLUSTER_CONFIG["enabled"]:
+            cluster = ClusterNode(db_connector)
+        self.cluster = cluster
+        self.broker = MessageBroker(db_connector) if MESSAGING_CONFIG["broker"] else None
+        self.heartbeats = HeartbeatService(db_connector) if HEARTBEAT_CONFIG["enabled"] else None
         self.agents = {}
         self.agent_threads = {}
+        self.worker_config = TASK_WORKER_CONFIG
+        self.worker_threads = {}
+        self.worker_stops = {}
+        self.stop_timeout = SCHEDULER_CONFIG["stop_timeout"]
         
     def register_agent(self, agent):
         """Register an agent with the scheduler"""
+        agent.heartbeats = self.heartbeats
         agent.register(self.db_connector)
+        agent.cluster = self.cluster
+        if self.broker is not None:
+            self.broker.attach(agent)
         self.agents[agent.agent_id] = agent
         self.logger.info(f"Agent {agent.agent_id} registered with scheduler")
         
@@ -24,51 +455,173 @@ class AgentScheduler:
             self.logger.error(f"Agent {agent_id} not registered")
             return False
             
+        if agent_id in self.agent_threads and self.agent_threads[agent_id].is_alive():
+            self.logger.error(f"Agent {agent_id} already running")
+            return False
+            
         agent = self.agents[agent_id]
+        agent.reset_stop()
         agent_thread = threading.Thread(
             target=agent.run,
             args=(self.db_connector,),
+            name=agent_id,
             daemon=True
         )
         agent_thread.start()
         
         self.agent_threads[agent_id] = agent_thread
         self.logger.info(f"Agent {agent_id} started")
+        
+        worker_count = self.worker_config["workers"].get(agent.agent_type, 0)
+        if worker_count:
+            self.start_task_workers(agent_id, worker_count)
         return True
+    
+    def start_task_workers(self, agent_id, count):
+        """Start a pool of worker threads that drain an agent's task queue in parallel"""
+        if agent_id not in self.agents:
+            self.logger.error(f"Agent {agent_id} not registered")
+            return False
+            
+        agent = self.agents[agent_id]
+        workers = self.worker_threads.setdefault(agent_id, [])
+        stop_event = self.worker_stops.setdefault(agent_id, threading.Event())
+        stop_event.clear()
+        
+        for _ in range(count):
+            worker_thread = threading.Thread(
+                target=self._run_task_worker,
+                args=(agent, stop_event),
+                name=f"{agent_id}-worker-{len(workers)}",
+                daemon=True
+            )
+            worker_thread.start()
+            workers.append(worker_thread)
+            
+        self.logger.info(f"Started {count} task worker(s) for agent {agent_id}")
+        return True
+    
+    def _run_task_worker(self, agent, stop_event):
+        """Claim and process tasks for an agent until its workers are stopped"""
+        batch_size = self.worker_config["claim_batch_size"]
+        idle_wait = self.worker_config["idle_wait"]
+        
+        while not stop_event.is_set():
+            try:
+                tasks = agent.process_pending_tasks(self.db_connector, batch_size)
+            except Exception as e:
+                self.logger.error(f"Task worker error for agent {agent.agent_id}: {str(e)}")
+                tasks = []
+                
+            if not tasks:
+                stop_event.wait(idle_wait)
+    
+    def stop_task_workers(self, agent_id=None):
+        """Signal task workers (of one agent, or all) to stop after their current task"""
+        agent_ids = list(self.worker_stops) if agent_id is None else [agent_id]
+        for worker_agent_id in agent_ids:
+            if worker_agent_id in self.worker_stops:
+                self.worker_stops[worker_agent_id].set()
         
     def start_agents(self):
-        """Start all registered agents"""
+        """Start all registered agents, joining the cluster first when clustering is enabled"""
+        if self.cluster is not None:
+            self.cluster.start()
+        if self.heartbeats is not None:
+            self.heartbeats.start()
+        if self.broker is not None:
+            self.broker.start()
         for agent_id in self.agents:
             self.start_agent(agent_id)
             
-    def stop_agent(self, agent_id):
-        """Stop a specific agent"""
+    def wake_agent(self, agent_id):
+        """Interrupt an agent's wait so it handles new messages or settings immediately"""
+        if agent_id not in self.agents:
+            self.logger.error(f"Agent {agent_id} not registered")
+            return False
+            
+        self.agents[agent_id].wake()
+        return True
+        
+    def stop_agent(self, agent_id, timeout=None):
+        """Stop a specific agent and its task workers, waiting up to ``timeout`` seconds"""
         if agent_id not in self.agent_threads:
             self.logger.error(f"Agent {agent_id} not running")
             return False
             
-        # Note: This doesn't actually stop the agent thread
-        # The agents would need to implement a stop mechanism
-        agent = self.agents[agent_id]
-        agent.update_status(self.db_connector, "inactive")
+        self._signal_stop(agent_id)
+        deadline = time.monotonic() + (self.stop_timeout if timeout is None else timeout)
+        return self._join_agent(agent_id, deadline)
+        
+    def stop_agents(self, timeout=None):
+        """Stop all running agents, returning True if every thread exited within ``timeout``"""
+        agent_ids = list(self.agent_threads)
+        for agent_id in agent_ids:
+            self._signal_stop(agent_id)
+            
+        # Every agent was signalled first, so they shut down concurrently
+        # and share a single deadline
+        deadline = time.monotonic() + (self.stop_timeout if timeout is None else timeout)
+        stopped = [self._join_agent(agent_id, deadline) for agent_id in agent_ids]
+        
+        # Writes the final "inactive" status of every stopped agent
+        if self.heartbeats is not None:
+            self.heartbeats.stop(max(0, deadline - time.monotonic()))
+        
+        # Messages still queued in memory are persisted for the next start
+        if self.broker is not None:
+            self.broker.close()
+        
+        # Leaving the cluster releases leadership and hands the shards over
+        if self.cluster is not None:
+            self.cluster.stop(max(0, deadline - time.monotonic()))
+        return all(stopped)
+        
+    def _signal_stop(self, agent_id):
+        self.agents[agent_id].stop()
+        self.stop_task_workers(agent_id)
+        
+    def _join_agent(self, agent_id, deadline):
+        """Join an agent's run thread and workers; returns False if any is still alive"""
+        threads = [self.agent_threads[agent_id]] + self.worker_threads.get(agent_id, [])
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+            
+        alive = [thread.name for thread in threads if thread.is_alive()]
+        if alive:
+            self.logger.warning(f"Agent {agent_id} did not stop in time, still running: {alive}")
+            return False
+            
+        del self.agent_threads[agent_id]
+        self.worker_threads.pop(agent_id, None)
         self.logger.info(f"Agent {agent_id} stopped")
         return True
         
     def initialize_default_agents(self):
         """Initialize and register default agent set"""
+        # Imported here because the agents import JobScheduler from this module
+        from agents.data_collection_agent import DataCollectionAgent
+        from agents.analytics_agent import AnalyticsAgent
+        from agents.alert_agent import AlertAgent
+        from agents.reporting_agent import ReportingAgent
+        from agents.maintenance_agent import MaintenanceAgent
+        
         data_agent = DataCollectionAgent()
         analytics_agent = AnalyticsAgent()
         alert_agent = AlertAgent()
         reporting_agent = ReportingAgent()
+        maintenance_agent = MaintenanceAgent()
         
         self.register_agent(data_agent)
         self.register_agent(analytics_agent)
         self.register_agent(alert_agent)
         self.register_agent(reporting_agent)
+        self.register_agent(maintenance_agent)
         
         return {
             "data_collection": data_agent.agent_id,
             "analytics": analytics_agent.agent_id,
             "alert": alert_agent.agent_id,
-            "reporting": reporting_agent.agent_id
+            "reporting": reporting_agent.agent_id,
+            "maintenance": maintenance_agent.agent_id
         }
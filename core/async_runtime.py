@@ -0,0 +1,224 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import ASYNC_RUNTIME_CONFIG, MESSAGING_CONFIG
+
+class AsyncAgentRuntime:
+    """Runs agents as coroutines on a single asyncio event loop.
+
+    Each agent's blocking ``run_once`` step is executed on a thread pool of
+    ``max_workers`` threads. Between steps an agent waits on an
+    ``asyncio.Event`` with a timeout, so an idle agent costs one coroutine
+    rather than an OS thread. One shared LISTEN connection, registered with
+    the event loop, wakes agents when messages are addressed to them.
+    With a HeartbeatService, agent_registry writes of all agents are
+    batched instead of issued one by one.
+    """
+
+    def __init__(self, db_connector, max_workers=None, broker=None, heartbeats=None):
+        self.db_connector = db_connector
+        self.broker = broker
+        self.heartbeats = heartbeats
+        self.logger = logging.getLogger("agent.async_runtime")
+        self.max_workers = max_workers or ASYNC_RUNTIME_CONFIG["max_workers"]
+        self.stop_timeout = ASYNC_RUNTIME_CONFIG["stop_timeout"]
+        self.use_notifications = MESSAGING_CONFIG["use_notifications"]
+        self.notify_channel = MESSAGING_CONFIG["notify_channel"]
+        self.poll_interval = MESSAGING_CONFIG["poll_interval"]
+        self.agents = {}
+        self.agent_tasks = {}
+        self._wake_events = {}
+        self._executor = None
+        self._listener = None
+        self._loop = None
+        self._stopped = None
+
+    def register_agent(self, agent):
+        """Register an agent with the runtime"""
+        agent.heartbeats = self.heartbeats
+        agent.register(self.db_connector)
+        if self.broker is not None:
+            self.broker.attach(agent)
+        self.agents[agent.agent_id] = agent
+        self.logger.info(f"Agent {agent.agent_id} registered with async runtime")
+
+    async def start(self):
+        """Start the shared listener and every registered agent"""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="agent-runtime")
+
+        if self.heartbeats is not None:
+            await self._call(self.heartbeats.start)
+        if self.broker is not None:
+            self.broker.start()
+        await self._start_listener()
+        for agent_id in self.agents:
+            self.start_agent(agent_id)
+        self.logger.info(f"Async runtime started {len(self.agent_tasks)} agent(s) "
+                         f"on {self.max_workers} worker thread(s)")
+
+    async def serve(self):
+        """Start all agents and run until stop() is called"""
+        await self.start()
+        await self._stopped.wait()
+
+    def start_agent(self, agent_id):
+        """Start an agent's coroutine; must be called from the event loop"""
+        if agent_id not in self.agents:
+            self.logger.error(f"Agent {agent_id} not registered")
+            return False
+
+        task = self.agent_tasks.get(agent_id)
+        if task is not None and not task.done():
+            self.logger.error(f"Agent {agent_id} already running")
+            return False
+
+        agent = self.agents[agent_id]
+        wake_event = asyncio.Event()
+        self._wake_events[agent_id] = wake_event
+        agent.wake_callback = lambda: self._loop.call_soon_threadsafe(wake_event.set)
+        agent.reset_stop()
+        self.agent_tasks[agent_id] = self._loop.create_task(self._run_agent(agent), name=agent_id)
+        return True
+
+    def wake_agent(self, agent_id):
+        """Wake an agent so it handles new messages immediately; safe from any thread"""
+        if agent_id not in self._wake_events:
+            self.logger.error(f"Agent {agent_id} not running")
+            return False
+
+        self.agents[agent_id].wake()
+        return True
+
+    def stop_agent(self, agent_id):
+        """Ask an agent to stop after its current step; safe from any thread"""
+        if agent_id not in self.agents:
+            self.logger.error(f"Agent {agent_id} not registered")
+            return False
+
+        self.agents[agent_id].stop()
+        return True
+
+    async def stop(self, timeout=None):
+        """Stop all agents, returning True if every one finished within ``timeout``"""
+        for agent_id in self.agent_tasks:
+            self.stop_agent(agent_id)
+
+        tasks = [task for task in self.agent_tasks.values() if not task.done()]
+        pending = set()
+        if tasks:
+            _, pending = await asyncio.wait(
+                tasks, timeout=self.stop_timeout if timeout is None else timeout
+            )
+
+        # A step still blocked on the database cannot be interrupted; its
+        # coroutine is cancelled and the worker thread finishes on its own
+        for task in pending:
+            self.logger.warning(f"Agent {task.get_name()} did not stop in time")
+            task.cancel()
+
+        self._close_listener()
+        if self.heartbeats is not None:
+            await self._call(self.heartbeats.stop)
+        if self.broker is not None:
+            self.broker.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._stopped is not None:
+            self._stopped.set()
+
+        self.logger.info("Async runtime stopped")
+        return not pending
+
+    async def _run_agent(self, agent):
+        """Call the agent's run_once() until it is stopped, waiting on timers in between"""
+        db_connector = self.db_connector
+        wake_event = self._wake_events[agent.agent_id]
+        try:
+            await self._call(agent.update_status, db_connector, "active")
+
+            while not agent.stopping:
+                # Cleared before the step so a wakeup during it triggers another step
+                wake_event.clear()
+                try:
+                    timeout = agent.heartbeat(await self._call(agent.run_once, db_connector))
+                except Exception as e:
+                    agent.logger.error(f"Error in {agent.agent_type} agent: {str(e)}")
+                    await self._call(agent.update_status, db_connector, "error")
+                    timeout = agent.error_backoff
+
+                if self._listener is None:
+                    timeout = min(timeout, self.poll_interval)
+                if agent.stopping:
+                    break
+
+                try:
+                    await asyncio.wait_for(wake_event.wait(), max(0, timeout))
+                except asyncio.TimeoutError:
+                    pass
+
+            await self._call(agent.update_status, db_connector, "inactive")
+        finally:
+            # Also reached when the step is cancelled on stop, so resources
+            # such as process pools are released either way
+            agent.close()
+            agent.wake_callback = None
+            self._wake_events.pop(agent.agent_id, None)
+
+    async def _call(self, func, *args):
+        """Run a blocking call on the runtime's bounded thread pool"""
+        return await self._loop.run_in_executor(self._executor, func, *args)
+
+    async def _start_listener(self):
+        if not self.use_notifications or self._listener is not None:
+            return
+
+        listener = await self._call(self.db_connector.listen, self.notify_channel)
+        if listener is None:
+            self.logger.warning(f"No notification listener, agents will poll every {self.poll_interval}s")
+            self._retry_listener()
+            return
+
+        self._listener = listener
+        self._loop.add_reader(listener.fileno(), self._dispatch_notifications)
+
+        # Messages sent while no listener was open produced no wakeup
+        for wake_event in self._wake_events.values():
+            wake_event.set()
+
+    def _retry_listener(self):
+        if self._stopped is not None and not self._stopped.is_set():
+            self._loop.call_later(self.poll_interval, lambda: self._loop.create_task(self._start_listener()))
+
+    def _dispatch_notifications(self):
+        """Wake the agents named in pending notifications"""
+        listener = self._listener
+        try:
+            listener.poll()
+        except Exception as e:
+            self.logger.warning(f"Notification listener failed, falling back to polling: {str(e)}")
+            self._close_listener()
+            self._retry_listener()
+            return
+
+        while listener.notifies:
+            notification = listener.notifies.pop(0)
+            wake_event = self._wake_events.get(notification.payload)
+            if wake_event is not None:
+                wake_event.set()
+
+    def _close_listener(self):
+        if self._listener is None:
+            return
+        try:
+            self._loop.remove_reader(self._listener.fileno())
+        except Exception:
+            pass
+        try:
+            self._listener.close()
+        except Exception:
+            pass
+        self._listener = None
@@ -0,0 +1,198 @@
+import os
+import uuid
+import socket
+import hashlib
+import logging
+import threading
+from config.settings import CLUSTER_CONFIG
+
+# Session advisory lock class id for leader election; the object id is
+# hashtext() of the role, so each role has its own leader
+LEADER_LOCK_ID = 7301004
+
+# agent_type of the agent_registry rows that record node heartbeats
+NODE_AGENT_TYPE = "node"
+
+HEARTBEAT_QUERY = """
+INSERT INTO agent_registry (agent_id, agent_type, status)
+VALUES (%s, %s, %s)
+ON CONFLICT (agent_id) DO UPDATE
+SET status = EXCLUDED.status, last_active = CURRENT_TIMESTAMP
+"""
+
+LIVE_NODES_QUERY = """
+SELECT agent_id
+FROM agent_registry
+WHERE agent_type = %s AND status = 'active'
+AND last_active > CURRENT_TIMESTAMP - make_interval(secs => %s)
+ORDER BY agent_id
+"""
+
+def all_shards():
+    """Return every shard number"""
+    return list(range(CLUSTER_CONFIG["shard_count"]))
+
+
+def shard_condition(column):
+    """SQL condition matching rows whose ``column`` hashes into a shard in an int array parameter"""
+    return f"mod(hashtext({column}) & 2147483647, {int(CLUSTER_CONFIG['shard_count'])}) = ANY(%s)"
+
+
+def lock_shards(db_connector, lock_id, shards, shared=False):
+    """Take transaction-level advisory locks on shards within db_connector.transaction().
+
+    Locks are taken in ascending shard order so concurrent callers cannot
+    deadlock. Shared locks only exclude exclusive holders of the same shard.
+    """
+    function = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+    db_connector.query(
+        f"SELECT {function}(%s, shard) FROM unnest(%s::int[]) AS shard",
+        (lock_id, sorted(shards))
+    )
+
+
+def rendezvous_owner(key, nodes):
+    """Return the node that owns ``key``: the one with the highest hash of (node, key).
+
+    When a node joins or leaves only the keys it gains or held move, so
+    every other node keeps its shards.
+    """
+    return max(nodes, key=lambda node: (_rendezvous_score(node, key), node))
+
+
+def _rendezvous_score(node, key):
+    digest = hashlib.blake2b(f"{node}:{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class ClusterNode:
+    """Membership of this process in a group of nodes sharing one database.
+
+    A background thread heartbeats the node's row in agent_registry and
+    reads back the nodes seen within ``node_timeout`` seconds. Source shards
+    are divided among those live nodes by rendezvous hashing.
+
+    Leadership of a role is a session-level advisory lock held on a
+    dedicated connection. If the leader dies its session ends, and the lock
+    passes to whichever node retries first on its next heartbeat.
+    """
+
+    def __init__(self, db_connector, node_id=None):
+        self.db_connector = db_connector
+        self.node_id = node_id or f"node_{socket.gethostname()}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self.shard_count = CLUSTER_CONFIG["shard_count"]
+        self.heartbeat_interval = CLUSTER_CONFIG["heartbeat_interval"]
+        self.node_timeout = CLUSTER_CONFIG["node_timeout"]
+        self.logger = logging.getLogger("agent.cluster")
+        self.live_nodes = [self.node_id]
+        self._owned_shards = list(range(self.shard_count))
+        self._leading = {}  # role -> whether this node holds the role's lock
+        self._lock_connection = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Join the cluster and start heartbeating"""
+        self._stop_event.clear()
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._run, name=f"{self.node_id}-heartbeat", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Node {self.node_id} joined cluster of {len(self.live_nodes)} node(s)")
+
+    def stop(self, timeout=None):
+        """Stop heartbeating, give up all leadership and leave the cluster"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+        with self._lock:
+            self._close_lock_connection()
+        self.db_connector.execute(HEARTBEAT_QUERY, (self.node_id, NODE_AGENT_TYPE, "inactive"))
+        self.logger.info(f"Node {self.node_id} left the cluster")
+
+    def owned_shards(self):
+        """Return the shards this node currently owns"""
+        return list(self._owned_shards)
+
+    def is_leader(self, role):
+        """True if this node leads ``role``; the first call for a role joins its election"""
+        with self._lock:
+            if role not in self._leading:
+                self._leading[role] = False
+                self._try_lead(role)
+            return self._leading[role]
+
+    def heartbeat(self):
+        """Record this node as alive, refresh shard ownership and retry leadership"""
+        self.db_connector.execute(HEARTBEAT_QUERY, (self.node_id, NODE_AGENT_TYPE, "active"))
+        rows = self.db_connector.query(LIVE_NODES_QUERY, (NODE_AGENT_TYPE, self.node_timeout))
+        if rows:
+            nodes = [row["agent_id"] for row in rows]
+            if self.node_id not in nodes:
+                nodes.append(self.node_id)
+            self._assign_shards(sorted(nodes))
+
+        with self._lock:
+            self._check_leadership()
+            for role, leading in self._leading.items():
+                if not leading:
+                    self._try_lead(role)
+
+    def _run(self):
+        while not self._stop_event.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                self.logger.error(f"Heartbeat failed for node {self.node_id}: {str(e)}")
+
+    def _assign_shards(self, nodes):
+        owned = [shard for shard in range(self.shard_count) if rendezvous_owner(shard, nodes) == self.node_id]
+        if nodes != self.live_nodes or owned != self._owned_shards:
+            self.logger.info(
+                f"Node {self.node_id} owns {len(owned)} of {self.shard_count} shards "
+                f"across {len(nodes)} live node(s)"
+            )
+        self.live_nodes = nodes
+        self._owned_shards = owned
+
+    def _check_leadership(self):
+        """Drop every role if the session holding the locks is gone"""
+        if self._lock_connection is None:
+            return
+        try:
+            with self._lock_connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except Exception as e:
+            self.logger.warning(f"Leader lock session lost: {str(e)}")
+            self._close_lock_connection()
+
+    def _try_lead(self, role):
+        try:
+            if self._lock_connection is None or self._lock_connection.closed:
+                self._lock_connection = self.db_connector.session_connection()
+            with self._lock_connection.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s))", (LEADER_LOCK_ID, role))
+                acquired = cursor.fetchone()[0]
+        except Exception as e:
+            self.logger.warning(f"Leader election for {role} failed: {str(e)}")
+            self._close_lock_connection()
+            return
+
+        if acquired:
+            self.logger.info(f"Node {self.node_id} is now leader for {role}")
+        self._leading[role] = acquired
+
+    def _close_lock_connection(self):
+        for role, leading in self._leading.items():
+            if leading:
+                self.logger.info(f"Node {self.node_id} is no longer leader for {role}")
+            self._leading[role] = False
+
+        if self._lock_connection is not None:
+            try:
+                self._lock_connection.close()
+            except Exception:
+                pass
+            self._lock_connection = None
@@ -0,0 +1,212 @@
+import time
+import logging
+import threading
+from psycopg2 import extensions
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of database connections with checkout health checks.
+
+    Up to ``max_size`` connections are kept open and reused. When all of them
+    are in use, up to ``max_overflow`` extra connections may be opened; those
+    are closed again as soon as they are returned. Callers beyond that limit
+    wait up to ``checkout_timeout`` seconds for a connection to be released.
+    """
+
+    def __init__(self, connection_factory, min_size=2, max_size=10, max_overflow=5,
+                 checkout_timeout=30, health_check_interval=60):
+        self.connection_factory = connection_factory
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.max_overflow = max_overflow
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.logger = logging.getLogger("agent.connection_pool")
+
+        self._condition = threading.Condition()
+        self._idle = []  # (connection, returned_at) pairs, most recently used last
+        self._in_use = set()
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "total_wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "peak_in_use": 0,
+            "peak_overflow": 0
+        }
+
+    def open(self):
+        """Open the minimum number of connections"""
+        with self._condition:
+            self._closed = False
+            while self._size < self.min_size:
+                self._idle.append((self._create_connection(), time.monotonic()))
+
+    def close(self):
+        """Close all idle connections and refuse further checkouts"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+
+        for connection, _ in idle:
+            self._close_connection(connection)
+
+    def getconn(self, timeout=None):
+        """Check out a healthy connection, waiting if the pool is exhausted"""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            connection, returned_at = self._reserve(timeout, deadline)
+
+            if connection is None:
+                # A slot was reserved; connect outside the lock
+                try:
+                    connection = self.connection_factory()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+                with self._condition:
+                    self._stats["connections_created"] += 1
+                    self._in_use.add(id(connection))
+                break
+
+            if self._is_healthy(connection, returned_at):
+                break
+
+            with self._condition:
+                self._in_use.discard(id(connection))
+                self._stats["health_check_failures"] += 1
+                self._discard(connection)
+                self._condition.notify()
+
+        with self._condition:
+            self._record_checkout(time.monotonic() - started)
+        return connection
+
+    def putconn(self, connection, discard=False):
+        """Return a connection to the pool, closing it if broken or overflow"""
+        with self._condition:
+            self._in_use.discard(id(connection))
+
+            if not discard and not connection.closed:
+                try:
+                    if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                        connection.rollback()
+                except Exception as e:
+                    self.logger.warning(f"Discarding connection that failed to reset: {str(e)}")
+                    discard = True
+
+            # Overflow connections are closed unless another thread is waiting
+            overflow = self._size > self.max_size and not self._waiting
+            if discard or connection.closed or self._closed or overflow:
+                self._discard(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+
+            self._condition.notify()
+
+    def stats(self):
+        """Return a snapshot of pool usage statistics"""
+        with self._condition:
+            stats = dict(self._stats)
+            in_use = len(self._in_use)
+            stats.update({
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "overflow": max(0, self._size - self.max_size),
+                "waiting": self._waiting,
+                "max_size": self.max_size,
+                "max_overflow": self.max_overflow,
+                "avg_wait_time": (
+                    stats["total_wait_time"] / stats["checkouts"] if stats["checkouts"] else 0.0
+                )
+            })
+            return stats
+
+    def _reserve(self, timeout, deadline):
+        """Take an idle connection or reserve a slot for a new one"""
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                    self._in_use.add(id(connection))
+                    return connection, returned_at
+
+                if self._size < self.max_size + self.max_overflow:
+                    self._size += 1
+                    return None, None
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available after {timeout} seconds"
+                    )
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+    def _is_healthy(self, connection, returned_at):
+        """Check a connection before handing it out"""
+        if connection.closed:
+            return False
+
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except Exception as e:
+            self.logger.warning(f"Pooled connection failed health check: {str(e)}")
+            return False
+
+    def _create_connection(self):
+        connection = self.connection_factory()
+        self._size += 1
+        self._stats["connections_created"] += 1
+        return connection
+
+    def _discard(self, connection):
+        self._size -= 1
+        self._stats["connections_closed"] += 1
+        self._close_connection(connection)
+
+    def _close_connection(self, connection):
+        try:
+            if not connection.closed:
+                connection.close()
+        except Exception as e:
+            self.logger.warning(f"Error closing pooled connection: {str(e)}")
+
+    def _record_checkout(self, wait_time):
+        stats = self._stats
+        stats["checkouts"] += 1
+        stats["total_wait_time"] += wait_time
+        stats["max_wait_time"] = max(stats["max_wait_time"], wait_time)
+        stats["peak_in_use"] = max(stats["peak_in_use"], len(self._in_use))
+        stats["peak_overflow"] = max(stats["peak_overflow"], self._size - self.max_size)
@@ -1,105 +1,505 @@
 import psycopg2
 import psycopg2.extras
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+import io
 import logging
-from config.settings import DATABASE_CONFIG
+import threading
+import uuid
+import numpy as np
+from contextlib import contextmanager
+from config.settings import DATABASE_CONFIG, DATABASE_POOL_CONFIG, QUERY_CONFIG
+from core.connection_pool import ConnectionPool
+from core.records import SalesMetric
+
+# NumPy dtype built by query_columns for each column type OID
+COLUMN_DTYPES = {
+    16: np.bool_,  # boolean
+    20: np.int64, 21: np.int64, 23: np.int64,  # bigint, smallint, integer
+    700: np.float64, 701: np.float64, 1700: np.float64,  # real, double precision, numeric
+    1082: "datetime64[D]",  # date
+    1114: "datetime64[us]",  # timestamp
+    25: np.str_, 1042: np.str_, 1043: np.str_  # text, char, varchar
+}
+
+# Cursor-level typecasters for query_columns: skip building Decimal and
+# date objects that would only be converted again
+COLUMN_CASTERS = (
+    psycopg2.extensions.new_type(
+        (1700,), "NUMERIC_FLOAT", lambda value, cursor: float(value) if value is not None else None
+    ),
+    psycopg2.extensions.new_type(
+        (1082, 1114), "DATETIME_TEXT", lambda value, cursor: value
+    )
+)
 
 class DBConnector:
     def __init__(self):
         self.connection_params = DATABASE_CONFIG
+        self.pool_config = DATABASE_POOL_CONFIG
+        self.stream_itersize = QUERY_CONFIG["stream_itersize"]
+        self.bulk_page_size = QUERY_CONFIG["bulk_page_size"]
+        self.copy_chunk_size = QUERY_CONFIG["copy_chunk_size"]
         self.logger = logging.getLogger("agent.db_connector")
-        self.connection = None
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
         
     def connect(self):
-        """Establish a database connection"""
-        try:
-            self.connection = psycopg2.connect(
-                host=self.connection_params["host"],
-                port=self.connection_params["port"],
-                dbname=self.connection_params["database"],
-                user=self.connection_params["user"],
-                password=self.connection_params["password"]
-            )
-            self.logger.info("Database connection established")
-            return True
-        except Exception as e:
-            self.logger.error(f"Database connection error: {str(e)}")
-            return False
+        """Open the connection pool"""
+        with self._pool_lock:
+            if self.pool:
+                return True
+            
+            try:
+                pool = ConnectionPool(self._create_connection, **self.pool_config)
+                pool.open()
+                self.pool = pool
+                self.logger.info("Database connection pool established")
+                return True
+            except Exception as e:
+                self.logger.error(f"Database connection error: {str(e)}")
+                return False
     
     def disconnect(self):
-        """Close database connection"""
-        if self.connection:
-            self.connection.close()
-            self.connection = None
-            self.logger.info("Database connection closed")
+        """Close all pooled database connections"""
+        with self._pool_lock:
+            if self.pool:
+                self.pool.close()
+                self.pool = None
+                self.logger.info("Database connection pool closed")
+    
+    def _create_connection(self):
+        """Open a new raw database connection"""
+        return psycopg2.connect(
+            host=self.connection_params["host"],
+            port=self.connection_params["port"],
+            dbname=self.connection_params["database"],
+            user=self.connection_params["user"],
+            password=self.connection_params["password"]
+        )
+    
+    @contextmanager
+    def connection(self):
+        """Check out a pooled connection for the calling thread.
+        
+        Nested use within the same thread reuses the connection that is
+        already checked out, so helpers can be composed freely.
+        """
+        held = getattr(self._local, "connection", None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+        
+        if not self.pool and not self.connect():
+            raise psycopg2.OperationalError("Database connection pool unavailable")
+        
+        connection = self.pool.getconn()
+        self._local.connection = connection
+        self._local.depth = 1
+        broken = False
+        try:
+            yield connection
+        except (psycopg2.InterfaceError, psycopg2.OperationalError):
+            broken = True
+            raise
+        finally:
+            self._local.connection = None
+            self._local.depth = 0
+            self.pool.putconn(connection, discard=broken)
+    
+    @contextmanager
+    def dedicated_connection(self):
+        """Check out a pooled connection that is not shared with the calling thread.
+        
+        Used for long-lived work such as server-side cursors, which must not
+        be closed by commits issued from other queries on the same thread.
+        """
+        if not self.pool and not self.connect():
+            raise psycopg2.OperationalError("Database connection pool unavailable")
+        
+        connection = self.pool.getconn()
+        broken = False
+        try:
+            yield connection
+        except (psycopg2.InterfaceError, psycopg2.OperationalError):
+            broken = True
+            raise
+        finally:
+            self.pool.putconn(connection, discard=broken)
+    
+    @contextmanager
+    def transaction(self, cursor_factory=None):
+        """Yield a cursor whose statements are committed together or rolled back.
+        
+        Transactions opened while another one is active on the same thread
+        join the outer transaction; only the outermost one commits. A failure
+        anywhere inside marks the whole transaction for rollback.
+        """
+        with self.connection() as connection:
+            depth = getattr(self._local, "transaction_depth", 0)
+            if depth == 0:
+                self._local.transaction_failed = False
+            self._local.transaction_depth = depth + 1
+            
+            try:
+                with connection.cursor(cursor_factory=cursor_factory) as cursor:
+                    yield cursor
+            except Exception:
+                self._local.transaction_failed = True
+                if depth == 0:
+                    connection.rollback()
+                raise
+            finally:
+                self._local.transaction_depth = depth
+                
+            if depth == 0:
+                if self._local.transaction_failed:
+                    connection.rollback()
+                    raise psycopg2.DatabaseError("Transaction rolled back after a failed statement")
+                connection.commit()
+    
+    def get_pool_stats(self):
+        """Return connection pool statistics (wait time, in-use, overflow)"""
+        if not self.pool:
+            return {}
+        return self.pool.stats()
+    
+    def notify(self, channel, payload=""):
+        """Send a NOTIFY on a channel; listeners receive it once committed"""
+        return self.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+    
+    def session_connection(self):
+        """Open an autocommit connection outside the pool.
+        
+        Used for session state that must outlive a single checkout, such as
+        LISTEN registrations and session-level advisory locks; the caller is
+        responsible for closing it.
+        """
+        connection = self._create_connection()
+        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        return connection
+    
+    def listen(self, channel):
+        """Open a dedicated autocommit connection that LISTENs on a channel.
+        
+        The connection is kept outside the pool because it stays open for the
+        lifetime of the listener; the caller is responsible for closing it.
+        """
+        connection = None
+        try:
+            connection = self.session_connection()
+            with connection.cursor() as cursor:
+                cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+            self.logger.info(f"Listening for notifications on {channel}")
+            return connection
+        except Exception as e:
+            self.logger.error(f"Error listening on {channel}: {str(e)}")
+            if connection:
+                connection.close()
+            return None
     
     def execute(self, query, params=None):
         """Execute a query and return inserted ID if applicable"""
-        if not self.connection:
-            if not self.connect():
-                return None
-        
         try:
-            with self.connection.cursor() as cursor:
+            with self.transaction() as cursor:
                 cursor.execute(query, params)
-                self.connection.commit()
                 
                 if query.strip().upper().startswith("INSERT") and "RETURNING" in query.upper():
                     return cursor.fetchone()[0]
                 return True
         except Exception as e:
             self.logger.error(f"Query execution error: {str(e)}")
-            self.connection.rollback()
             return None
     
-    def query(self, query, params=None):
-        """Execute a query and return results as a list of dictionaries"""
-        if not self.connection:
-            if not self.connect():
-                return []
+    def execute_returning(self, query, params=None, record_class=None):
+        """Execute a data-modifying query, commit it and return its RETURNING rows as dictionaries
         
+        With ``record_class`` rows are returned as instances of that class.
+        """
         try:
-            with self.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            with self.transaction(cursor_factory=self._row_factory(record_class)) as cursor:
+                cursor.execute(query, params)
+                return list(cursor.fetchall())
+        except Exception as e:
+            self.logger.error(f"Query execution error: {str(e)}")
+            return []
+    
+    def execute_many(self, query, rows, template=None, page_size=None):
+        """Insert many rows in a single transaction using multi-row VALUES.
+        
+        ``query`` must contain a single ``VALUES %s`` placeholder. Returns the
+        list of first RETURNING values for every row (in input order) when the
+        query has a RETURNING clause, True otherwise, or None on error.
+        """
+        if not rows:
+            return [] if "RETURNING" in query.upper() else True
+        
+        try:
+            with self.transaction() as cursor:
+                returning = "RETURNING" in query.upper()
+                results = psycopg2.extras.execute_values(
+                    cursor, query, rows,
+                    template=template,
+                    page_size=page_size or self.bulk_page_size,
+                    fetch=returning
+                )
+                if returning:
+                    return [result[0] for result in results]
+                return True
+        except Exception as e:
+            self.logger.error(f"Bulk execution error: {str(e)}")
+            return None
+    
+    def copy_records(self, table, columns, rows):
+        """Bulk load rows into a table with COPY in a single transaction.
+        
+        Returns the number of rows written, or None on error.
+        """
+        copy_query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+            sql.Identifier(table),
+            sql.SQL(", ").join(sql.Identifier(column) for column in columns)
+        )
+        
+        try:
+            with self.transaction() as cursor:
+                count = 0
+                buffer = io.StringIO()
+                
+                for row in rows:
+                    buffer.write("\t".join(self._copy_value(value) for value in row))
+                    buffer.write("\n")
+                    count += 1
+                    if count % self.copy_chunk_size == 0:
+                        self._copy_buffer(cursor, copy_query, buffer)
+                        
+                self._copy_buffer(cursor, copy_query, buffer)
+                return count
+        except Exception as e:
+            self.logger.error(f"Bulk copy error: {str(e)}")
+            return None
+    
+    def _copy_value(self, value):
+        """Render a value in COPY text format"""
+        if value is None:
+            return "\\N"
+        return (str(value)
+                .replace("\\", "\\\\")
+                .replace("\t", "\\t")
+                .replace("\n", "\\n")
+                .replace("\r", "\\r"))
+    
+    def _copy_buffer(self, cursor, copy_query, buffer):
+        """Send buffered COPY rows to the server and reset the buffer"""
+        if not buffer.tell():
+            return
+        buffer.seek(0)
+        cursor.copy_expert(copy_query, buffer)
+        buffer.seek(0)
+        buffer.truncate()
+    
+    def query(self, query, params=None, record_class=None):
+        """Execute a query and return results as a list of dictionaries
+        
+        With ``record_class`` (a core.records.Record subclass) rows are
+        returned as instances of that class instead.
+        """
+        try:
+            with self.transaction(cursor_factory=self._row_factory(record_class)) as cursor:
                 cursor.execute(query, params)
                 results = cursor.fetchall()
                 return list(results)
         except Exception as e:
             self.logger.error(f"Query error: {str(e)}")
             return []
+    
+    def stream(self, query, params=None, itersize=None, record_class=None):
+        """Execute a query through a server-side cursor and yield rows as dictionaries.
+        
+        Rows are fetched in batches of ``itersize`` so memory stays bounded
+        regardless of the result size. Errors are logged and re-raised, since
+        a silently truncated stream would look like a complete result. With
+        ``record_class`` rows are yielded as instances of that class.
+        """
+        try:
+            with self.dedicated_connection() as connection:
+                cursor_name = f"stream_{uuid.uuid4().hex}"
+                with connection.cursor(name=cursor_name, cursor_factory=self._row_factory(record_class)) as cursor:
+                    cursor.itersize = itersize or self.stream_itersize
+                    cursor.execute(query, params)
+                    for row in cursor:
+                        yield row
+        except Exception as e:
+            self.logger.error(f"Streaming query error: {str(e)}")
+            raise
+            
+    def query_columns(self, query, params=None, chunk_size=None):
+        """Execute a query and return its result as one NumPy array per column.
+        
+        Rows are fetched from a server-side cursor in chunks of ``chunk_size``
+        and each chunk is converted column by column, so no per-row dicts are
+        built and only one chunk of Python row tuples exists at a time.
+        Numeric columns become float64 (int64 for integer types without
+        NULLs), dates and timestamps datetime64, text fixed-width strings and
+        anything else object arrays; NULLs become NaN/NaT (or None in object
+        arrays). Errors are logged and re-raised, like stream().
+        
+        Returns:
+            dict: Column name -> array, in select-list order
+        """
+        chunk_size = chunk_size or self.stream_itersize
+        
+        try:
+            with self.dedicated_connection() as connection:
+                cursor_name = f"columns_{uuid.uuid4().hex}"
+                with connection.cursor(name=cursor_name) as cursor:
+                    for caster in COLUMN_CASTERS:
+                        psycopg2.extensions.register_type(caster, cursor)
+                    cursor.itersize = chunk_size
+                    cursor.execute(query, params)
+                    
+                    chunks = None
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        if chunks is None:
+                            # Named cursors describe their columns after the first fetch
+                            columns = [(column.name, column.type_code) for column in cursor.description]
+                            chunks = [[] for _ in columns]
+                        if not rows:
+                            break
+                        for index, values in enumerate(zip(*rows)):
+                            chunks[index].append(self._column_array(values, columns[index][1]))
             
-    def retrieve_data(self, source=None, time_range=None):
-        """Retrieve data with filters - interface used by AnalyticsAgent"""
+            return {
+                name: (
+                    np.concatenate(chunks[index]) if chunks[index]
+                    else np.empty(0, dtype=COLUMN_DTYPES.get(type_code, object))
+                )
+                for index, (name, type_code) in enumerate(columns)
+            }
+        except Exception as e:
+            self.logger.error(f"Columnar query error: {str(e)}")
+            raise
+    
+    def _column_array(self, values, type_code):
+        """Convert one chunk of a column's values to a NumPy array"""
+        dtype = COLUMN_DTYPES.get(type_code, object)
+        
+        if dtype is not object and None in values:
+            if dtype is np.int64 or dtype is np.float64:
+                return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+            if dtype in ("datetime64[D]", "datetime64[us]"):
+                return np.array(values, dtype=dtype)  # None becomes NaT
+            dtype = object
+        
+        if dtype is object:
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+            return array
+        return np.array(values, dtype=dtype)
+    
+    def retrieve_data(self, source=None, time_range=None, stream=False, itersize=None,
+                      columnar=False, columns=None):
+        """Retrieve data with filters - interface used by AnalyticsAgent
+        
+        With ``stream=True`` a generator over a server-side cursor is returned
+        instead of a fully materialized list. Rows are SalesMetric records.
+        With ``columnar=True`` the
+        result is a dict of NumPy arrays (see query_columns), optionally
+        limited to ``columns``.
+        """
+        conditions, query_params = self._sales_metrics_filter(source, time_range)
+        
+        if columnar:
+            selected = sql.SQL(", ").join(map(sql.Identifier, columns)) if columns else sql.SQL("*")
+            query = sql.SQL("SELECT {} FROM sales_metrics WHERE {} ORDER BY date DESC").format(
+                selected, sql.SQL(conditions)
+            )
+            return self.query_columns(query, query_params, chunk_size=itersize)
+        
+        query = f"SELECT * FROM sales_metrics WHERE {conditions} ORDER BY date DESC"
+        
+        if stream:
+            return self.stream(query, query_params, itersize=itersize, record_class=SalesMetric)
+        return self.query(query, query_params, record_class=SalesMetric)
+    
+    def _row_factory(self, record_class):
+        """Cursor factory building ``record_class`` rows, or dictionaries by default"""
+        if record_class is None:
+            return psycopg2.extras.RealDictCursor
+        return record_class.cursor_factory
+    
+    def get_data_version(self, source=None, time_range=None):
+        """Return a cheap fingerprint of the sales_metrics rows retrieve_data would return
+        
+        The row count, highest id and latest update time change whenever a
+        row in the range is inserted, updated or deleted. Returns None on error.
+        """
+        conditions, query_params = self._sales_metrics_filter(source, time_range)
+        query = f"""
+        SELECT COUNT(*) as row_count, MAX(id) as max_id, MAX(updated_at) as max_updated_at
+        FROM sales_metrics
+        WHERE {conditions}
+        """
+        rows = self.query(query, query_params)
+        if not rows:
+            return None
+        return (rows[0]["row_count"], rows[0]["max_id"], rows[0]["max_updated_at"])
+    
+    def _sales_metrics_filter(self, source=None, time_range=None):
+        """Build the WHERE clause and parameters shared by sales_metrics lookups"""
+        conditions = ["1=1"]
         query_params = []
-        query = "SELECT * FROM sales_metrics WHERE 1=1"
         
         if source:
-            query += " AND source = %s"
+            conditions.append("source = %s")
             query_params.append(source)
             
         if time_range and len(time_range) == 2:
-            query += " AND date >= %s AND date <= %s"
+            conditions.append("date >= %s AND date <= %s")
             query_params.extend(time_range)
             
-        query += " ORDER BY date DESC"
-        
-        return self.query(query, tuple(query_params))
+        return " AND ".join(conditions), tuple(query_params)
         
     def store_analysis_results(self, results):
-        """Store analysis results - interface used by AnalyticsAgent"""
+        """Store analysis results - interface used by AnalyticsAgent
+        
+        Every entry of ``results["insights"]`` is written in one multi-row
+        insert. Entries are dicts with ``description`` and optionally
+        ``date``, ``insight_type``, ``severity`` and ``metrics``; missing
+        fields (or plain string entries) default to the run's date, analysis
+        method, "medium" and the run's metrics. Returns the list of inserted
+        ids, or None on error.
+        """
         query = """
         INSERT INTO sales_insights (
             date, insight_type, description, severity, metrics
-        ) VALUES (%s, %s, %s, %s, %s)
+        ) VALUES %s
         RETURNING id
         """
         
         try:
             date = results.get("date") or results.get("timestamp").split("T")[0]
             insight_type = results.get("analysis_method", "basic_analysis")
-            description = results.get("insights", ["No insights generated"])[0]
-            severity = "medium"  # Default severity
             metrics = results.get("metrics", {})
             
-            return self.execute(query, (date, insight_type, description, severity, psycopg2.extras.Json(metrics)))
+            rows = []
+            for insight in results.get("insights") or ["No insights generated"]:
+                if not isinstance(insight, dict):
+                    insight = {"description": insight}
+                rows.append((
+                    insight.get("date") or date,
+                    insight.get("insight_type") or insight_type,
+                    insight["description"],
+                    insight.get("severity") or "medium",
+                    psycopg2.extras.Json(insight.get("metrics", metrics))
+                ))
+            
+            return self.execute_many(query, rows)
         except Exception as e:
             self.logger.error(f"Error storing analysis results: {str(e)}")
             return None
@@ -0,0 +1,218 @@
+import datetime
+import logging
+import threading
+from collections import deque
+from config.settings import MESSAGING_CONFIG
+from core.records import Message
+from utils.payload_codec import PayloadCodec
+
+PERSIST_QUERY = """
+INSERT INTO agent_messages (sender_id, recipient_id, message_type, content, is_read, created_at)
+VALUES %s
+"""
+
+PERSIST_TEMPLATE = "(%s, %s, %s, %s, %s, %s)"
+
+class MessageBroker:
+    """In-process delivery of agent messages, falling back to agent_messages.
+
+    Agents attached to the broker receive messages from agents in the same
+    process through in-memory queues and are woken with ``agent.wake()``,
+    so no INSERT, SELECT or UPDATE is issued on the delivery path. Messages
+    for recipients that are not attached are left to the database path.
+
+    Agents can also subscribe to message types. A published message is
+    queued for every local subscriber. Payloads are shared between the
+    sender and all local recipients, so they must be treated as read-only.
+
+    With ``persist`` enabled, consumed messages are written to agent_messages
+    in batches (marked read) by a background thread for auditing. Whether
+    or not it is enabled, messages still queued on close() or detach() are
+    written unread, so the database path delivers them after a restart.
+    Messages queued when the process crashes are lost. start() reopens a
+    closed broker.
+    """
+
+    def __init__(self, db_connector, persist=None, flush_interval=None, batch_size=None):
+        self.db_connector = db_connector
+        self.persist = MESSAGING_CONFIG["broker_persist"] if persist is None else persist
+        self.flush_interval = flush_interval or MESSAGING_CONFIG["broker_flush_interval"]
+        self.batch_size = batch_size or MESSAGING_CONFIG["broker_batch_size"]
+        self.payload_codec = PayloadCodec()
+        self.logger = logging.getLogger("agent.message_broker")
+        self.agents = {}
+        self.subscriptions = {}  # message_type -> [agent_id]
+        self._queues = {}  # agent_id -> deque of Message
+        self._pending_writes = []  # Consumed messages awaiting persistence
+        self._lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._closed = threading.Event()
+        self._flusher = None
+        self._stats = {"delivered": 0, "published": 0, "persisted": 0, "fallbacks": 0}
+
+    def attach(self, agent):
+        """Deliver messages for ``agent`` locally and subscribe it to ``agent.subscriptions``"""
+        with self._lock:
+            self.agents[agent.agent_id] = agent
+            self._queues.setdefault(agent.agent_id, deque())
+        for message_type in agent.subscriptions:
+            self.subscribe(agent.agent_id, message_type)
+        agent.broker = self
+
+    def detach(self, agent_id):
+        """Stop local delivery to an agent, persisting its queued messages unread"""
+        with self._lock:
+            agent = self.agents.pop(agent_id, None)
+            queue = self._queues.pop(agent_id, deque())
+            for subscribers in self.subscriptions.values():
+                if agent_id in subscribers:
+                    subscribers.remove(agent_id)
+        if agent is not None:
+            agent.broker = None
+        self._write(list(queue))
+
+    def subscribe(self, agent_id, message_type):
+        """Queue every published message of ``message_type`` for a local agent"""
+        with self._lock:
+            subscribers = self.subscriptions.setdefault(message_type, [])
+            if agent_id not in subscribers:
+                subscribers.append(agent_id)
+
+    def unsubscribe(self, agent_id, message_type):
+        with self._lock:
+            subscribers = self.subscriptions.get(message_type, [])
+            if agent_id in subscribers:
+                subscribers.remove(agent_id)
+
+    def deliver(self, sender_id, recipient_id, message_type, content):
+        """Queue a message for a local recipient; returns False if the recipient is not local"""
+        with self._lock:
+            if recipient_id not in self._queues or self._closed.is_set():
+                return False
+            self._enqueue(sender_id, recipient_id, message_type, content)
+            self._stats["delivered"] += 1
+            agent = self.agents[recipient_id]
+        agent.wake()
+        return True
+
+    def publish(self, sender_id, message_type, content):
+        """Queue a message for every local subscriber of its type, returning their ids"""
+        with self._lock:
+            if self._closed.is_set():
+                return []
+            recipients = [
+                agent_id for agent_id in self.subscriptions.get(message_type, [])
+                if agent_id != sender_id
+            ]
+            for recipient_id in recipients:
+                self._enqueue(sender_id, recipient_id, message_type, content)
+            if recipients:
+                self._stats["published"] += 1
+            agents = [self.agents[recipient_id] for recipient_id in recipients]
+        for agent in agents:
+            agent.wake()
+        return recipients
+
+    def take(self, agent_id, limit=None, consume=True):
+        """Return queued messages for an agent, oldest first, removing them when ``consume``"""
+        with self._lock:
+            queue = self._queues.get(agent_id)
+            if not queue:
+                return []
+            count = len(queue) if limit is None else min(limit, len(queue))
+            if not consume:
+                return [queue[index] for index in range(count)]
+
+            messages = [queue.popleft() for _ in range(count)]
+            for message in messages:
+                message.is_read = True
+            if self.persist:
+                self._pending_writes.extend(messages)
+                if len(self._pending_writes) >= self.batch_size:
+                    self._flush_requested.set()
+        if self.persist:
+            self._ensure_flusher()
+        return messages
+
+    def record_fallback(self):
+        """Count a message that went through the database because no local recipient existed"""
+        with self._lock:
+            self._stats["fallbacks"] += 1
+
+    def flush(self):
+        """Write consumed messages to agent_messages now"""
+        with self._lock:
+            messages, self._pending_writes = self._pending_writes, []
+        self._write(messages)
+
+    def start(self):
+        """Resume local delivery after close()"""
+        self._closed.clear()
+
+    def close(self):
+        """Stop local delivery and the flusher, and persist everything still held in memory"""
+        self._closed.set()
+        self._flush_requested.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+
+        with self._lock:
+            messages, self._pending_writes = self._pending_writes, []
+            for queue in self._queues.values():
+                messages.extend(queue)
+                queue.clear()
+        self._write(messages)
+
+    def stats(self):
+        """Return broker counters and current queue depths"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queued"] = sum(len(queue) for queue in self._queues.values())
+            stats["pending_writes"] = len(self._pending_writes)
+            return stats
+
+    def _enqueue(self, sender_id, recipient_id, message_type, content):
+        self._queues[recipient_id].append(Message(
+            sender_id=sender_id,
+            recipient_id=recipient_id,
+            message_type=message_type,
+            is_read=False,
+            created_at=datetime.datetime.now(),
+            _payload=content
+        ))
+
+    def _ensure_flusher(self):
+        with self._lock:
+            if self._flusher is not None or self._closed.is_set():
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, name="message-broker-flush", daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._closed.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self.flush()
+
+    def _write(self, messages):
+        """Insert messages into agent_messages in one multi-row statement
+
+        Only consumed messages are gated on ``persist``, by take(); unread
+        messages passed here must always be written or they are lost.
+        """
+        if not messages:
+            return
+
+        rows = [
+            (
+                message.sender_id, message.recipient_id, message.message_type,
+                self.payload_codec.encode(message.payload), bool(message.is_read), message.created_at
+            )
+            for message in messages
+        ]
+        if self.db_connector.execute_many(PERSIST_QUERY, rows, template=PERSIST_TEMPLATE) is None:
+            self.logger.error(f"Failed to persist {len(rows)} broker messages")
+            return
+        with self._lock:
+            self._stats["persisted"] += len(rows)
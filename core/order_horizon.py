@@ -0,0 +1,88 @@
+import time
+import logging
+from config.settings import COLLECTION_CONFIG
+
+# Highest order id drawn so far (0 before the first order)
+LAST_ORDER_ID_QUERY = """
+SELECT COALESCE(pg_sequence_last_value(pg_get_serial_sequence('orders', 'id')::regclass), 0) AS last_id
+"""
+
+IN_FLIGHT_QUERY = "SELECT pg_snapshot_xip(pg_current_snapshot())::text AS xid"
+
+STILL_RUNNING_QUERY = """
+SELECT xid::text AS xid
+FROM unnest(%s::xid8[]) AS xid
+WHERE pg_xact_status(xid) = 'in progress'
+"""
+
+STATE_QUERY = """
+SELECT settled_id, pending_id, pending_xids::text[] AS pending_xids
+FROM order_id_horizon
+WHERE name = 'orders'
+FOR UPDATE
+"""
+
+SAVE_STATE_QUERY = """
+INSERT INTO order_id_horizon (name, settled_id, pending_id, pending_xids, updated_at)
+VALUES ('orders', %s, %s, %s::xid8[], CURRENT_TIMESTAMP)
+ON CONFLICT (name) DO UPDATE SET
+    settled_id = EXCLUDED.settled_id,
+    pending_id = EXCLUDED.pending_id,
+    pending_xids = EXCLUDED.pending_xids,
+    updated_at = CURRENT_TIMESTAMP
+"""
+
+logger = logging.getLogger("agent.order_horizon")
+
+def settled_order_id(db_connector, settle_wait=None):
+    """Return the highest order id up to which every order insert has finished.
+
+    Order ids are drawn when an insert starts, not when it commits, so an
+    order with a lower id can become visible after a higher one. Scanning
+    only ids up to this horizon lets id watermarks advance without skipping
+    such orders.
+
+    The horizon is the last drawn id, once every transaction that was in
+    progress when it was read has committed or rolled back. Those
+    transactions are waited on for up to ``settle_wait`` seconds. If they are
+    still running, the candidate is stored in order_id_horizon and settles on
+    a later call, and the previous horizon is returned. Must be called
+    outside the caller's own write transaction. An insert that has drawn its
+    id but not yet written its row is the one case this cannot see.
+    """
+    settle_wait = COLLECTION_CONFIG["settle_wait"] if settle_wait is None else settle_wait
+
+    last_id = db_connector.query(LAST_ORDER_ID_QUERY)[0]["last_id"]
+    # Taken after reading the sequence, so every transaction that drew an id
+    # up to last_id has either finished or is listed here
+    in_flight = [row["xid"] for row in db_connector.query(IN_FLIGHT_QUERY)]
+
+    deadline = time.monotonic() + settle_wait
+    while in_flight and time.monotonic() < deadline:
+        time.sleep(0.05)
+        in_flight = _still_running(db_connector, in_flight)
+
+    with db_connector.transaction():
+        state = db_connector.query(STATE_QUERY)
+        settled_id = state[0]["settled_id"] if state else 0
+        pending_id = state[0]["pending_id"] if state else None
+        pending_xids = state[0]["pending_xids"] if state else None
+
+        if pending_id is not None and not _still_running(db_connector, pending_xids or []):
+            settled_id = max(settled_id, pending_id)
+            pending_id = pending_xids = None
+
+        if not in_flight:
+            settled_id = max(settled_id, last_id)
+        elif pending_id is None:
+            pending_id, pending_xids = last_id, in_flight
+            logger.info(f"Order ids above {settled_id} wait for {len(in_flight)} running transaction(s)")
+
+        db_connector.execute(SAVE_STATE_QUERY, (settled_id, pending_id, pending_xids))
+    return settled_id
+
+
+def _still_running(db_connector, xids):
+    if not xids:
+        return []
+    return [row["xid"] for row in db_connector.query(STILL_RUNNING_QUERY, (xids,))]
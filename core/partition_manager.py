@@ -0,0 +1,226 @@
+import re
+import datetime
+import logging
+import psycopg2.errors
+from config.settings import RETENTION_CONFIG
+
+# Advisory lock serializing partition maintenance across nodes
+PARTITION_LOCK_ID = 7301005
+
+# Schema that detached partitions are moved to when archiving
+ARCHIVE_SCHEMA = "agent_archive"
+
+# Partitioned table -> (RETENTION_CONFIG key of its retention in months,
+# condition matching rows that are still in use and block archiving)
+PARTITIONED_TABLES = {
+    "agent_messages": ("messages_months", "is_read = FALSE"),
+    "agent_tasks": ("tasks_months", "status IN ('pending', 'in_progress')")
+}
+
+PARTITIONS_QUERY = """
+SELECT c.relname AS name
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = %s::regclass
+"""
+
+DEFAULT_PARTITION_QUERY = """
+SELECT c.relname AS name
+FROM pg_partitioned_table p
+JOIN pg_class c ON c.oid = p.partdefid
+WHERE p.partrelid = %s::regclass
+"""
+
+# Partitions left half-detached by an interrupted DETACH ... CONCURRENTLY
+DETACH_PENDING_QUERY = """
+SELECT c.relname
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = %s::regclass AND i.inhdetachpending
+"""
+
+PARTITION_NAME = re.compile(r"_p(\d{4})_(\d{2})$")
+
+class PartitionManager:
+    """Creates and retires the monthly partitions of agent_messages and agent_tasks.
+
+    Each table is range-partitioned on created_at with one partition per
+    calendar month plus a default partition. maintain() creates partitions
+    for the current month and ``premake_months`` ahead, moving any rows that
+    already landed in the default partition into them. Partitions older than
+    the table's retention are detached and moved to the agent_archive schema
+    (or dropped), unless they still hold unread messages or unfinished tasks.
+
+    Creating and detaching a partition lock the parent table, which blocks
+    message sends and task claims while the lock is waited for and held.
+    Every such statement gives up after ``lock_timeout`` seconds, so it
+    cannot queue behind a long transaction; the partition is handled on a
+    later run. Partitions are detached outside a transaction block: with
+    DETACH PARTITION ... CONCURRENTLY on PostgreSQL 14+ when the table has
+    no default partition, and otherwise with a plain DETACH that holds the
+    lock only for that one statement. PostgreSQL does not allow concurrent
+    detaching next to a default partition; dropping the (empty) default
+    partition enables it, at the cost of rejecting rows dated outside every
+    monthly partition.
+    """
+
+    def __init__(self, db_connector):
+        self.db_connector = db_connector
+        self.premake_months = RETENTION_CONFIG["premake_months"]
+        self.archive = RETENTION_CONFIG["archive"]
+        self.lock_timeout = RETENTION_CONFIG["lock_timeout"]
+        self.logger = logging.getLogger("agent.partitions")
+
+    def maintain(self, now=None):
+        """Create upcoming partitions and retire expired ones for every partitioned table"""
+        now = now or datetime.datetime.now()
+        summary = {"status": "success", "created": [], "archived": [], "dropped": [], "kept": []}
+
+        for table, (retention_key, live_condition) in PARTITIONED_TABLES.items():
+            try:
+                with self.db_connector.transaction():
+                    self.db_connector.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_ID,))
+                    self.db_connector.execute("SELECT set_config('lock_timeout', %s, true)", (f"{self.lock_timeout}s",))
+                    summary["created"].extend(self.ensure_partitions(table, now))
+                
+                retired = self.retire_partitions(table, live_condition, RETENTION_CONFIG[retention_key], now)
+                for outcome, partitions in retired.items():
+                    summary[outcome].extend(partitions)
+            except Exception as e:
+                self.logger.error(f"Error maintaining partitions of {table}: {str(e)}")
+                summary["status"] = "error"
+                summary["error"] = str(e)
+
+        if summary["created"] or summary["archived"] or summary["dropped"]:
+            self.logger.info(
+                f"Partitions created: {summary['created']}, archived: {summary['archived']}, "
+                f"dropped: {summary['dropped']}"
+            )
+        return summary
+
+    def partitions(self, table):
+        """Return {month start date: partition name} for a table's monthly partitions"""
+        rows = self.db_connector.query(PARTITIONS_QUERY, (table,))
+        partitions = {}
+        for row in rows:
+            match = PARTITION_NAME.search(row["name"])
+            if match:
+                partitions[datetime.date(int(match.group(1)), int(match.group(2)), 1)] = row["name"]
+        return partitions
+
+    def ensure_partitions(self, table, now):
+        """Create missing partitions for the coming months and for months found in the default partition"""
+        current = _month_start(now)
+        months = {_add_months(current, offset) for offset in range(self.premake_months + 1)}
+
+        default = self.default_partition(table)
+        if default is not None:
+            rows = self.db_connector.query(
+                f"SELECT DISTINCT date_trunc('month', created_at)::date AS month FROM {default}"
+            )
+            months.update(row["month"] for row in rows)
+
+        existing = self.partitions(table)
+        created = []
+        for month in sorted(months - set(existing)):
+            created.append(self._create_partition(table, month, default))
+        return created
+
+    def default_partition(self, table):
+        """Return the name of a table's default partition, or None if it has none"""
+        rows = self.db_connector.query(DEFAULT_PARTITION_QUERY, (table,))
+        return rows[0]["name"] if rows else None
+
+    def retire_partitions(self, table, live_condition, retention_months, now):
+        """Archive or drop partitions whose whole month is older than the retention period.
+
+        Runs on an autocommit session connection, since DETACH PARTITION ...
+        CONCURRENTLY cannot run inside a transaction block, holding the
+        maintenance advisory lock for the session.
+        """
+        cutoff = _add_months(_month_start(now), -retention_months)
+        retired = {"archived": [], "dropped": [], "kept": []}
+        expired = [(month, name) for month, name in sorted(self.partitions(table).items()) if month < cutoff]
+        if not expired:
+            return retired
+
+        connection = self.db_connector.session_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_lock(%s)", (PARTITION_LOCK_ID,))
+                cursor.execute("SELECT set_config('lock_timeout', %s, false)", (f"{self.lock_timeout}s",))
+                # DETACH PARTITION ... CONCURRENTLY needs PostgreSQL 14 and a
+                # parent without a default partition
+                concurrently = connection.server_version >= 140000 and self.default_partition(table) is None
+                if concurrently:
+                    self._finalize_detaches(cursor, table)
+
+                for index, (month, name) in enumerate(expired):
+                    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {name} WHERE {live_condition})")
+                    if cursor.fetchone()[0]:
+                        self.logger.warning(f"Keeping expired partition {name}: it still has rows in use")
+                        retired["kept"].append(name)
+                        continue
+
+                    try:
+                        cursor.execute(
+                            f"ALTER TABLE {table} DETACH PARTITION {name}{' CONCURRENTLY' if concurrently else ''}"
+                        )
+                    except psycopg2.errors.LockNotAvailable:
+                        remaining = [name for _, name in expired[index:]]
+                        self.logger.warning(f"{table} is busy; retrying expired partitions {remaining} on the next run")
+                        retired["kept"].extend(remaining)
+                        break
+
+                    if self.archive:
+                        cursor.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+                        retired["archived"].append(name)
+                    else:
+                        cursor.execute(f"DROP TABLE {name}")
+                        retired["dropped"].append(name)
+        finally:
+            connection.close()  # Also releases the advisory lock
+        return retired
+
+    def _finalize_detaches(self, cursor, table):
+        """Complete concurrent detaches of ``table`` that were interrupted"""
+        cursor.execute(DETACH_PENDING_QUERY, (table,))
+        for (name,) in cursor.fetchall():
+            self.logger.info(f"Finishing interrupted detach of partition {name}")
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name} FINALIZE")
+
+    def _create_partition(self, table, month, default):
+        """Create one monthly partition, moving its rows out of the default partition"""
+        name = f"{table}_p{month:%Y_%m}"
+        bounds = (month, _add_months(month, 1))
+
+        # Statements run on the caller's transaction and raise on failure, so
+        # a lock timeout rolls back the whole creation
+        with self.db_connector.transaction() as cursor:
+            if default is None:
+                cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", bounds)
+                return name
+
+            # The new partition cannot be attached while the default partition
+            # holds rows in its range, so they are set aside and re-inserted
+            cursor.execute(f"CREATE TEMP TABLE moved_rows (LIKE {table}) ON COMMIT DROP")
+            cursor.execute(f"""
+                WITH moved AS (
+                    DELETE FROM {default}
+                    WHERE created_at >= %s AND created_at < %s
+                    RETURNING *
+                )
+                INSERT INTO moved_rows SELECT * FROM moved
+            """, bounds)
+            cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", bounds)
+            cursor.execute(f"INSERT INTO {table} SELECT * FROM moved_rows")
+            cursor.execute("DROP TABLE moved_rows")
+        return name
+
+def _month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
@@ -0,0 +1,151 @@
+import json
+import psycopg2.extensions
+from utils.payload_codec import decode_payload
+
+class RecordCursor(psycopg2.extensions.cursor):
+    """Cursor that returns rows as instances of ``record_class``.
+
+    Columns are matched to the record's slots by name once per query;
+    slots without a matching column are set to None.
+    """
+
+    record_class = None
+
+    def execute(self, query, vars=None):
+        self._slot_indexes = None
+        return super().execute(query, vars)
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else self._record(row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany() if size is None else super().fetchmany(size)
+        return [self._record(row) for row in rows]
+
+    def fetchall(self):
+        return [self._record(row) for row in super().fetchall()]
+
+    def __iter__(self):
+        # Delegate to the C iterator so named cursors keep fetching in
+        # batches of itersize
+        next_row = super().__next__
+        while True:
+            try:
+                row = next_row()
+            except StopIteration:
+                return
+            yield self._record(row)
+
+    def _record(self, row):
+        indexes = self._slot_indexes
+        if indexes is None:
+            positions = {column.name: index for index, column in enumerate(self.description)}
+            indexes = self._slot_indexes = [positions.get(slot) for slot in self.record_class.__slots__]
+        return self.record_class(*[None if index is None else row[index] for index in indexes])
+
+
+class Record:
+    """Compact result row with one slot per column.
+
+    Rows also support ``row["column"]``, ``row.get("column")`` and ``keys()``
+    so code written against dictionary rows keeps working. Each subclass
+    gets a matching cursor factory as ``cursor_factory``.
+    """
+
+    __slots__ = ()
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.cursor_factory = type(f"{cls.__name__}Cursor", (RecordCursor,), {"record_class": cls})
+
+    def __init__(self, *values, **named):
+        slots = self.__slots__
+        for slot, value in zip(slots, values):
+            setattr(self, slot, value)
+        for slot in slots[len(values):]:
+            setattr(self, slot, named.get(slot))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return list(self._fields)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(
+            getattr(self, slot) == getattr(other, slot) for slot in self.__slots__
+        )
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({values})"
+
+
+class Message(Record):
+    """Row of agent_messages; ``payload`` decodes ``content`` on first access"""
+
+    __slots__ = ("id", "sender_id", "recipient_id", "message_type", "content",
+                 "is_read", "created_at", "_payload")
+    _fields = ("id", "sender_id", "recipient_id", "message_type", "content", "is_read", "created_at")
+
+    @property
+    def payload(self):
+        if self._payload is None and self.content is not None:
+            self._payload = decode_payload(self.content)
+        return self._payload
+
+
+class Task(Record):
+    """Row of agent_tasks
+
+    Select ``task_data AS encoded_task_data`` so the payload is only
+    decoded when ``task_data`` is first read.
+    """
+
+    __slots__ = ("id", "task_id", "agent_id", "agent_type", "status", "priority", "encoded_task_data",
+                 "result", "created_at", "started_at", "completed_at", "_task_data")
+    _fields = ("id", "task_id", "agent_id", "agent_type", "status", "priority", "task_data",
+               "result", "created_at", "started_at", "completed_at")
+
+    @property
+    def task_data(self):
+        if self._task_data is None and self.encoded_task_data is not None:
+            self._task_data = decode_payload(self.encoded_task_data)
+        return self._task_data
+
+
+class SalesMetric(Record):
+    """Row of sales_metrics"""
+
+    __slots__ = ("id", "date", "total_sales", "total_orders", "average_order_value", "source",
+                 "unique_customers", "customers_hll", "created_at", "updated_at")
+    _fields = __slots__
+
+
+class Insight(Record):
+    """Row of sales_insights
+
+    Select ``metrics::text AS metrics_json`` so the metrics are only decoded
+    when ``metrics`` is first read.
+    """
+
+    __slots__ = ("id", "date", "insight_type", "description", "severity", "metrics_json",
+                 "created_at", "_metrics")
+    _fields = ("id", "date", "insight_type", "description", "severity", "metrics", "created_at")
+
+    @property
+    def metrics(self):
+        if self._metrics is None and self.metrics_json is not None:
+            self._metrics = json.loads(self.metrics_json)
+        return self._metrics
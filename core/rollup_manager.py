@@ -0,0 +1,186 @@
+import datetime
+import logging
+from core.order_horizon import settled_order_id
+
+# Advisory lock serializing rollup refreshes
+ROLLUP_LOCK_ID = 7301002
+
+class RollupManager:
+    """Maintains hourly, daily and monthly sales aggregates over the orders table.
+
+    New orders are folded into the hourly rollup incrementally (tracked by an
+    order id watermark in rollup_state); affected days and months are then
+    recomputed from the level below, which touches at most 24 and 31 rows per
+    source. Orders are assumed to be append-only. Only orders up to the
+    settled order id (see settled_order_id) are folded, so an order that
+    commits after a higher id is folded by a later refresh.
+    """
+
+    def __init__(self, db_connector):
+        self.db_connector = db_connector
+        self.logger = logging.getLogger("agent.rollups")
+
+    def refresh(self):
+        """Fold orders added since the last refresh into all rollup levels"""
+        db = self.db_connector
+
+        try:
+            # Read before the refresh transaction starts; see settled_order_id()
+            settled_id = settled_order_id(db)
+
+            with db.transaction():
+                db.execute("SELECT pg_advisory_xact_lock(%s)", (ROLLUP_LOCK_ID,))
+
+                state = db.query(
+                    "SELECT last_order_id FROM rollup_state WHERE rollup_name = %s",
+                    ("orders",)
+                )
+                last_order_id = state[0]["last_order_id"] if state else 0
+                max_order_id = db.query(
+                    "SELECT COALESCE(MAX(id), 0) as max_id FROM orders WHERE id <= %s", (settled_id,)
+                )[0]["max_id"]
+
+                if max_order_id <= last_order_id:
+                    return {"status": "success", "last_order_id": last_order_id, "hourly_buckets": 0, "days": []}
+
+                hourly_query = """
+                INSERT INTO sales_rollup_hourly (bucket, source, total_sales, total_orders)
+                SELECT date_trunc('hour', date), source, SUM(amount_total), COUNT(*)
+                FROM orders
+                WHERE id > %s AND id <= %s
+                GROUP BY 1, 2
+                ON CONFLICT (bucket, source) DO UPDATE SET
+                    total_sales = sales_rollup_hourly.total_sales + EXCLUDED.total_sales,
+                    total_orders = sales_rollup_hourly.total_orders + EXCLUDED.total_orders,
+                    updated_at = CURRENT_TIMESTAMP
+                RETURNING bucket
+                """
+                hours = db.execute_returning(hourly_query, (last_order_id, max_order_id))
+                days = sorted({row["bucket"].date() for row in hours})
+                months = sorted({day.replace(day=1) for day in days})
+
+                daily_query = """
+                INSERT INTO sales_rollup_daily (bucket, source, total_sales, total_orders)
+                SELECT d.day, h.source, SUM(h.total_sales), SUM(h.total_orders)
+                FROM unnest(%s::date[]) AS d(day)
+                JOIN sales_rollup_hourly h ON h.bucket >= d.day AND h.bucket < d.day + 1
+                GROUP BY d.day, h.source
+                ON CONFLICT (bucket, source) DO UPDATE SET
+                    total_sales = EXCLUDED.total_sales,
+                    total_orders = EXCLUDED.total_orders,
+                    updated_at = CURRENT_TIMESTAMP
+                """
+                db.execute(daily_query, (days,))
+
+                monthly_query = """
+                INSERT INTO sales_rollup_monthly (bucket, source, total_sales, total_orders)
+                SELECT m.month, r.source, SUM(r.total_sales), SUM(r.total_orders)
+                FROM unnest(%s::date[]) AS m(month)
+                JOIN sales_rollup_daily r
+                    ON r.bucket >= m.month AND r.bucket < m.month + INTERVAL '1 month'
+                GROUP BY m.month, r.source
+                ON CONFLICT (bucket, source) DO UPDATE SET
+                    total_sales = EXCLUDED.total_sales,
+                    total_orders = EXCLUDED.total_orders,
+                    updated_at = CURRENT_TIMESTAMP
+                """
+                db.execute(monthly_query, (months,))
+
+                db.execute("""
+                INSERT INTO rollup_state (rollup_name, last_order_id)
+                VALUES (%s, %s)
+                ON CONFLICT (rollup_name) DO UPDATE SET
+                    last_order_id = EXCLUDED.last_order_id,
+                    updated_at = CURRENT_TIMESTAMP
+                """, ("orders", max_order_id))
+
+            self.logger.info(f"Rollups refreshed: {len(hours)} hourly buckets over {len(days)} days")
+            return {
+                "status": "success",
+                "last_order_id": max_order_id,
+                "hourly_buckets": len(hours),
+                "days": [day.isoformat() for day in days]
+            }
+
+        except Exception as e:
+            self.logger.error(f"Error refreshing rollups: {str(e)}")
+            return {"status": "error", "error": str(e)}
+
+    def source_totals(self, start_date, end_date):
+        """Per-source totals for an inclusive date range from the coarsest covering rollups
+
+        Whole calendar months are read from the monthly rollup and the
+        remaining days from the daily rollup.
+        """
+        start = datetime.date.fromisoformat(str(start_date))
+        end = datetime.date.fromisoformat(str(end_date))
+        first_month, last_month = self._full_months(start, end)
+
+        parts = []
+        params = []
+        if first_month:
+            parts.append("""
+                SELECT source, total_sales, total_orders FROM sales_rollup_monthly
+                WHERE bucket >= %s AND bucket <= %s
+            """)
+            params.extend([first_month, last_month])
+
+            day_ranges = [
+                (start, first_month - datetime.timedelta(days=1)),
+                (self._next_month(last_month), end)
+            ]
+        else:
+            day_ranges = [(start, end)]
+
+        for range_start, range_end in day_ranges:
+            if range_start <= range_end:
+                parts.append("""
+                    SELECT source, total_sales, total_orders FROM sales_rollup_daily
+                    WHERE bucket >= %s AND bucket <= %s
+                """)
+                params.extend([range_start, range_end])
+
+        query = f"""
+        SELECT
+            source,
+            SUM(total_sales) as total_sales,
+            SUM(total_orders) as total_orders,
+            SUM(total_sales) / NULLIF(SUM(total_orders), 0) as avg_order_value
+        FROM ({" UNION ALL ".join(parts)}) rollups
+        GROUP BY source
+        ORDER BY total_sales DESC
+        """
+        return self.db_connector.query(query, tuple(params))
+
+    def daily_totals(self, start_date, end_date):
+        """Total sales per day for an inclusive date range from the daily rollup"""
+        query = """
+        SELECT
+            bucket as date,
+            SUM(total_sales) as daily_sales
+        FROM sales_rollup_daily
+        WHERE bucket >= %s AND bucket <= %s
+        GROUP BY bucket
+        ORDER BY bucket
+        """
+        return self.db_connector.query(query, (str(start_date), str(end_date)))
+
+    def _full_months(self, start, end):
+        """Return the first and last calendar months fully inside [start, end], or (None, None)"""
+        first_month = start if start.day == 1 else self._next_month(start)
+        if (end + datetime.timedelta(days=1)).day == 1:
+            last_month = end.replace(day=1)
+        else:
+            last_month = self._previous_month(end.replace(day=1))
+
+        if first_month > last_month:
+            return None, None
+        return first_month, last_month
+
+    def _next_month(self, day):
+        """First day of the month following ``day``"""
+        return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+    def _previous_month(self, month):
+        """First day of the month preceding ``month``"""
+        return (month - datetime.timedelta(days=1)).replace(day=1)
@@ -0,0 +1,208 @@
+import datetime
+import logging
+from utils.anomaly_detection import RunningStats
+from core.cluster import all_shards, lock_shards, shard_condition
+
+# Advisory lock class id serializing updates of the running statistics;
+# locks are taken per source shard (see core.cluster)
+SOURCE_STATS_LOCK_ID = 7301003
+
+# sales_metrics columns that can be tracked
+METRIC_COLUMNS = ("total_sales", "total_orders", "average_order_value", "unique_customers")
+
+UPSERT_STATS_QUERY = """
+INSERT INTO analytics_source_stats (
+    source, metric, last_date, count, mean, m2, ewma, ewm_var,
+    min_value, max_value, last_value, updated_at
+) VALUES %s
+ON CONFLICT (source, metric) DO UPDATE SET
+    last_date = EXCLUDED.last_date,
+    count = EXCLUDED.count,
+    mean = EXCLUDED.mean,
+    m2 = EXCLUDED.m2,
+    ewma = EXCLUDED.ewma,
+    ewm_var = EXCLUDED.ewm_var,
+    min_value = EXCLUDED.min_value,
+    max_value = EXCLUDED.max_value,
+    last_value = EXCLUDED.last_value,
+    updated_at = CURRENT_TIMESTAMP
+"""
+
+STATS_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)"
+
+class SourceStatsManager:
+    """Maintains running statistics per source and metric in analytics_source_stats.
+
+    Only closed days are folded in, since a day's sales_metrics row keeps
+    changing while its orders are collected. A day is closed once it is
+    before today and neither its row nor an earlier unfolded row of the
+    source has changed for ``grace_period`` seconds, so late orders merged into yesterday's row
+    after midnight are counted before the day is folded. Each source
+    tracks the last date it has processed, so an update reads only the rows
+    added since the previous one. Every new value is scored against the
+    statistics as they stood before it was added.
+    """
+
+    def __init__(self, db_connector, metrics=("total_sales",), alpha=0.1,
+                 min_history=7, z_threshold=3.0, grace_period=7200):
+        unknown = set(metrics) - set(METRIC_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unsupported metrics: {', '.join(sorted(unknown))}")
+
+        self.db_connector = db_connector
+        self.metrics = tuple(metrics)
+        self.alpha = alpha
+        self.min_history = min_history
+        self.z_threshold = z_threshold
+        self.grace_period = grace_period
+        self.logger = logging.getLogger("agent.source_stats")
+
+    def update(self, before=None, shards=None):
+        """Score and fold in rows for closed days after each source's last processed date
+
+        Args:
+            before (date, optional): First day that is not yet closed (default
+                today); days with recently updated rows close later
+            shards (list, optional): Only update sources hashing into these shards
+
+        Returns:
+            dict: status, rows processed, anomalies found, sources updated and
+            the last date processed
+        """
+        db = self.db_connector
+        before = before or datetime.date.today()
+
+        try:
+            with db.transaction():
+                lock_shards(db, SOURCE_STATS_LOCK_ID, all_shards() if shards is None else shards)
+                state, last_dates = self.load_state(shards)
+
+                query = f"""
+                SELECT m.date, m.source, {", ".join(f"m.{metric}" for metric in self.metrics)}
+                FROM sales_metrics m
+                LEFT JOIN (
+                    SELECT source, MIN(last_date) as last_date
+                    FROM analytics_source_stats
+                    WHERE metric = ANY(%s)
+                    GROUP BY source
+                    HAVING COUNT(*) = %s
+                ) s ON s.source = m.source
+                WHERE m.date < %s AND (s.last_date IS NULL OR m.date > s.last_date)
+                -- A day stays open while it or an earlier unfolded day of the
+                -- source is still being updated, so last_date never passes it
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM sales_metrics u
+                    WHERE u.source = m.source AND u.date <= m.date
+                    AND (s.last_date IS NULL OR u.date > s.last_date)
+                    AND u.updated_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                )
+                {"" if shards is None else "AND " + shard_condition("m.source")}
+                ORDER BY m.date, m.source
+                """
+                params = (list(self.metrics), len(self.metrics), before, self.grace_period)
+                if shards is not None:
+                    params += (list(shards),)
+
+                anomalies = []
+                touched = set()
+                rows = 0
+                for row in db.stream(query, params):
+                    rows += 1
+                    for metric in self.metrics:
+                        key = (row["source"], metric)
+
+                        # A source is re-read from its earliest watermark, e.g.
+                        # when a metric is newly tracked; skip what is folded in
+                        if key in last_dates and row["date"] <= last_dates[key]:
+                            continue
+
+                        stats = state.setdefault(key, RunningStats())
+                        last_dates[key] = row["date"]
+                        touched.add(key)
+
+                        if row[metric] is None:
+                            continue
+                        value = float(row[metric])
+
+                        anomaly = self._score(stats, row, metric, value)
+                        if anomaly:
+                            anomalies.append(anomaly)
+                        stats.update(value, self.alpha)
+
+                if touched:
+                    stats_rows = []
+                    for key in sorted(touched):
+                        stats = state[key]
+                        stats_rows.append((
+                            key[0], key[1], last_dates[key], stats.count, stats.mean,
+                            stats.m2, stats.ewma, stats.ewm_var, stats.min_value,
+                            stats.max_value, stats.last_value
+                        ))
+                    db.execute_many(UPSERT_STATS_QUERY, stats_rows, template=STATS_TEMPLATE)
+
+            end_date = max((last_dates[key] for key in touched), default=None)
+            self.logger.info(f"Source statistics updated with {rows} rows, {len(anomalies)} anomalies")
+            return {
+                "status": "success",
+                "rows": rows,
+                "anomalies": anomalies,
+                "sources": len({source for source, _ in touched}),
+                "end_date": end_date.isoformat() if end_date else None
+            }
+
+        except Exception as e:
+            self.logger.error(f"Error updating source statistics: {str(e)}")
+            return {"status": "error", "error": str(e)}
+
+    def load_state(self, shards=None):
+        """Load the persisted statistics
+
+        Args:
+            shards (list, optional): Only load sources hashing into these shards
+
+        Returns:
+            tuple: ({(source, metric): RunningStats}, {(source, metric): last date})
+        """
+        query = """
+        SELECT source, metric, last_date, count, mean, m2, ewma, ewm_var,
+               min_value, max_value, last_value
+        FROM analytics_source_stats
+        WHERE metric = ANY(%s)
+        """
+        params = (list(self.metrics),)
+        if shards is not None:
+            query += "AND " + shard_condition("source")
+            params += (list(shards),)
+        rows = self.db_connector.query(query, params)
+
+        state = {}
+        last_dates = {}
+        for row in rows:
+            key = (row["source"], row["metric"])
+            last_dates[key] = row["last_date"]
+            state[key] = RunningStats(
+                count=row["count"], mean=row["mean"], m2=row["m2"], ewma=row["ewma"],
+                ewm_var=row["ewm_var"], min_value=row["min_value"],
+                max_value=row["max_value"], last_value=row["last_value"]
+            )
+        return state, last_dates
+
+    def _score(self, stats, row, metric, value):
+        """Return an anomaly for ``value`` if it deviates from the running baseline"""
+        if stats.count < self.min_history:
+            return None
+
+        z_score = stats.z_score(value)
+        if z_score is None or abs(z_score) < self.z_threshold:
+            return None
+
+        return {
+            "type": "sales_anomaly",
+            "source": row["source"],
+            "metric": metric,
+            "date": row["date"].isoformat(),
+            "value": value,
+            "expected": stats.ewma,
+            "z_score": z_score
+        }
@@ -8,6 +8,7 @@ import sys
 import argparse
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import execute_values
 
 def parse_args():
     """Parse command line arguments."""
@@ -19,6 +20,8 @@ def parse_args():
     parser.add_argument('--dbname', default='mcp_agent_system', help='Database name')
     parser.add_argument('--create-db', action='store_true', help='Create database if it does not exist')
     parser.add_argument('--sample-data', action='store_true', help='Insert sample data')
+    parser.add_argument('--migrate', action='store_true',
+                        help='Upgrade an existing database with the scripts in db/migrations')
     return parser.parse_args()
 
 def create_database(args):
@@ -70,6 +73,33 @@ def init_tables(args):
     cursor.close()
     conn.close()
 
+def apply_migrations(args):
+    """Apply every migration script, in order, to an existing database."""
+    conn = psycopg2.connect(
+        host=args.host,
+        port=args.port,
+        user=args.user,
+        password=args.password,
+        dbname=args.dbname
+    )
+    cursor = conn.cursor()
+    
+    # Scripts are idempotent, so all of them are run every time
+    migrations_dir = os.path.join(os.path.dirname(__file__), 'migrations')
+    for name in sorted(os.listdir(migrations_dir)):
+        if not name.endswith('.sql'):
+            continue
+        with open(os.path.join(migrations_dir, name), 'r') as f:
+            migration_sql = f.read()
+        
+        print(f"Applying migration {name}...")
+        cursor.execute(migration_sql)
+        conn.commit()
+    print("Migrations applied successfully.")
+    
+    cursor.close()
+    conn.close()
+
 def insert_sample_data(args):
     """Insert sample data into the database."""
     conn = psycopg2.connect(
@@ -90,12 +120,12 @@ def insert_sample_data(args):
         ('reporting_agent_1', 'reporting', 'inactive')
     ]
     
-    for agent in agents:
-        cursor.execute(
-            "INSERT INTO agent_registry (agent_id, agent_type, status) VALUES (%s, %s, %s) "
-            "ON CONFLICT (agent_id) DO NOTHING",
-            agent
-        )
+    execute_values(
+        cursor,
+        "INSERT INTO agent_registry (agent_id, agent_type, status) VALUES %s "
+        "ON CONFLICT (agent_id) DO NOTHING",
+        agents
+    )
     
     # Insert sample orders
     print("Inserting sample orders...")
@@ -112,11 +142,11 @@ def insert_sample_data(args):
         ('2025-04-05', 'client_10', 1050.00, 'web')
     ]
     
-    for order in orders:
-        cursor.execute(
-            "INSERT INTO orders (date, client_id, amount_total, source) VALUES (%s, %s, %s, %s)",
-            order
-        )
+    execute_values(
+        cursor,
+        "INSERT INTO orders (date, client_id, amount_total, source) VALUES %s",
+        orders
+    )
     
     conn.commit()
     print("Sample data inserted successfully.")
@@ -131,7 +161,10 @@ def main():
     if args.create_db:
         create_database(args)
     
-    init_tables(args)
+    if args.migrate:
+        apply_migrations(args)
+    else:
+        init_tables(args)
     
     if args.sample_data:
         insert_sample_data(args)
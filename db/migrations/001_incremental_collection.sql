@@ -0,0 +1,35 @@
+-- Upgrades a database created before incremental sales collection.
+-- Safe to run more than once.
+
+ALTER TABLE sales_metrics ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+-- Repeated collections of a day used to insert a new row each time; keep the
+-- most recent row of every (date, source) so the unique constraint can be added
+DELETE FROM sales_metrics m
+USING sales_metrics newer
+WHERE newer.date = m.date AND newer.source = m.source AND newer.id > m.id;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'sales_metrics'::regclass AND conname = 'sales_metrics_date_source_key'
+    ) THEN
+        ALTER TABLE sales_metrics ADD CONSTRAINT sales_metrics_date_source_key UNIQUE (date, source);
+    END IF;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS collection_watermarks (
+    source VARCHAR(100) PRIMARY KEY,
+    last_order_id INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS order_id_horizon (
+    name VARCHAR(100) PRIMARY KEY,
+    settled_id BIGINT NOT NULL,
+    pending_id BIGINT,
+    pending_xids xid8[],
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
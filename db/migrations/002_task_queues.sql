@@ -0,0 +1,32 @@
+-- Upgrades a database created before tasks were queued per agent type.
+-- Safe to run more than once.
+
+ALTER TABLE agent_tasks ADD COLUMN IF NOT EXISTS agent_type VARCHAR(100);
+
+-- Existing tasks belong to the queue of the agent that created them. Agent
+-- ids default to "<agent_type>_<uuid>", which covers unregistered agents.
+UPDATE agent_tasks t
+SET agent_type = COALESCE(
+    (SELECT r.agent_type FROM agent_registry r WHERE r.agent_id = t.agent_id),
+    regexp_replace(t.agent_id, '_[0-9a-f-]{36}$', '')
+)
+WHERE t.agent_type IS NULL;
+
+ALTER TABLE agent_tasks ALTER COLUMN agent_type SET NOT NULL;
+
+-- Pending tasks are now looked up by agent type instead of agent id
+DROP INDEX IF EXISTS idx_agent_tasks_agent_status;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE tablename = 'agent_tasks' AND indexname = 'idx_agent_tasks_pending'
+          AND indexdef LIKE '%(agent_type,%'
+    ) THEN
+        DROP INDEX IF EXISTS idx_agent_tasks_pending;
+        CREATE INDEX idx_agent_tasks_pending ON agent_tasks(agent_type, priority DESC, created_at)
+        WHERE status = 'pending';
+    END IF;
+END
+$$;
@@ -0,0 +1,107 @@
+-- Rebuilds agent_messages and agent_tasks as tables range-partitioned by
+-- month of created_at. A plain table cannot be turned into a partitioned one
+-- in place, so each table is renamed, recreated as a partitioned table with
+-- a partition for every month it holds rows for, filled from the old table,
+-- and the old table is dropped. Ids keep counting from the old sequences.
+-- Payload columns keep their old types; 004_binary_payloads.sql converts
+-- them. Safe to run more than once: partitioned tables are left alone.
+--
+-- The copy locks both tables for its duration, so stop the agents first.
+
+CREATE SCHEMA IF NOT EXISTS agent_archive;
+
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'agent_messages'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE agent_messages RENAME TO agent_messages_unpartitioned;
+    ALTER TABLE agent_messages_unpartitioned RENAME CONSTRAINT agent_messages_pkey TO agent_messages_unpartitioned_pkey;
+    ALTER TABLE agent_messages_unpartitioned ALTER COLUMN id DROP DEFAULT;
+    ALTER SEQUENCE agent_messages_id_seq OWNED BY NONE;
+    DROP INDEX IF EXISTS idx_agent_messages_recipient;
+
+    CREATE TABLE agent_messages (
+        id BIGINT NOT NULL DEFAULT nextval('agent_messages_id_seq'),
+        sender_id VARCHAR(255) NOT NULL,
+        recipient_id VARCHAR(255) NOT NULL,
+        message_type VARCHAR(100) NOT NULL,
+        content TEXT,
+        is_read BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    ALTER SEQUENCE agent_messages_id_seq AS BIGINT OWNED BY agent_messages.id;
+    CREATE TABLE agent_messages_default PARTITION OF agent_messages DEFAULT;
+
+    FOR month IN
+        SELECT DISTINCT date_trunc('month', created_at)::date
+        FROM agent_messages_unpartitioned
+        WHERE created_at IS NOT NULL
+        UNION
+        SELECT date_trunc('month', CURRENT_DATE)::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF agent_messages FOR VALUES FROM (%L) TO (%L)',
+            'agent_messages_p' || to_char(month, 'YYYY_MM'), month, month + INTERVAL '1 month'
+        );
+    END LOOP;
+
+    INSERT INTO agent_messages (id, sender_id, recipient_id, message_type, content, is_read, created_at)
+    SELECT id, sender_id, recipient_id, message_type, content, is_read, COALESCE(created_at, CURRENT_TIMESTAMP)
+    FROM agent_messages_unpartitioned;
+    DROP TABLE agent_messages_unpartitioned;
+
+    ALTER TABLE agent_tasks RENAME TO agent_tasks_unpartitioned;
+    ALTER TABLE agent_tasks_unpartitioned RENAME CONSTRAINT agent_tasks_pkey TO agent_tasks_unpartitioned_pkey;
+    ALTER TABLE agent_tasks_unpartitioned RENAME CONSTRAINT agent_tasks_task_id_key TO agent_tasks_unpartitioned_task_id_key;
+    ALTER TABLE agent_tasks_unpartitioned ALTER COLUMN id DROP DEFAULT;
+    ALTER SEQUENCE agent_tasks_id_seq OWNED BY NONE;
+    DROP INDEX IF EXISTS idx_agent_tasks_agent_status;
+    DROP INDEX IF EXISTS idx_agent_tasks_pending;
+
+    CREATE TABLE agent_tasks (
+        id BIGINT NOT NULL DEFAULT nextval('agent_tasks_id_seq'),
+        task_id VARCHAR(255) NOT NULL,
+        agent_id VARCHAR(255) NOT NULL,
+        agent_type VARCHAR(100) NOT NULL,
+        status VARCHAR(50) NOT NULL,
+        priority INTEGER DEFAULT 5,
+        task_data JSONB,
+        result JSONB,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        completed_at TIMESTAMP,
+        PRIMARY KEY (id, created_at),
+        UNIQUE (task_id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    ALTER SEQUENCE agent_tasks_id_seq AS BIGINT OWNED BY agent_tasks.id;
+    CREATE TABLE agent_tasks_default PARTITION OF agent_tasks DEFAULT;
+
+    FOR month IN
+        SELECT DISTINCT date_trunc('month', created_at)::date
+        FROM agent_tasks_unpartitioned
+        WHERE created_at IS NOT NULL
+        UNION
+        SELECT date_trunc('month', CURRENT_DATE)::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF agent_tasks FOR VALUES FROM (%L) TO (%L)',
+            'agent_tasks_p' || to_char(month, 'YYYY_MM'), month, month + INTERVAL '1 month'
+        );
+    END LOOP;
+
+    INSERT INTO agent_tasks (id, task_id, agent_id, agent_type, status, priority, task_data, result,
+                             created_at, started_at, completed_at)
+    SELECT id, task_id, agent_id, agent_type, status, priority, task_data, result,
+           COALESCE(created_at, CURRENT_TIMESTAMP), started_at, completed_at
+    FROM agent_tasks_unpartitioned;
+    DROP TABLE agent_tasks_unpartitioned;
+
+    CREATE INDEX idx_agent_messages_unread ON agent_messages(recipient_id, created_at, id) WHERE is_read = FALSE;
+    CREATE INDEX idx_agent_tasks_pending ON agent_tasks(agent_type, priority DESC, created_at) WHERE status = 'pending';
+END
+$$;
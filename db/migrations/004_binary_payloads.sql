@@ -0,0 +1,19 @@
+-- Converts message content and task data to BYTEA for PayloadCodec. Existing
+-- rows become their UTF-8 JSON text, which decode_payload still reads.
+-- Safe to run more than once.
+
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'agent_messages'
+          AND column_name = 'content') <> 'bytea' THEN
+        ALTER TABLE agent_messages ALTER COLUMN content TYPE BYTEA USING convert_to(content, 'UTF8');
+    END IF;
+
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'agent_tasks'
+          AND column_name = 'task_data') <> 'bytea' THEN
+        ALTER TABLE agent_tasks ALTER COLUMN task_data TYPE BYTEA USING convert_to(task_data::text, 'UTF8');
+    END IF;
+END
+$$;
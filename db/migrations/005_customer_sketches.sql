@@ -0,0 +1,8 @@
+-- Upgrades a database created before distinct-customer sketches were stored
+-- with the daily sales metrics. Rows collected earlier keep NULL columns
+-- until they are collected again (for example by a backfill).
+-- Safe to run more than once.
+
+ALTER TABLE sales_metrics
+    ADD COLUMN IF NOT EXISTS unique_customers INTEGER,  -- Estimated from customers_hll, not an exact count
+    ADD COLUMN IF NOT EXISTS customers_hll BYTEA;  -- HyperLogLog sketch of the day's distinct customers
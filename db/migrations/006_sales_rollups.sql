@@ -0,0 +1,41 @@
+-- Upgrades a database created before the incrementally maintained sales
+-- rollups. The rollups fill from the first order on the next refresh.
+-- Safe to run more than once.
+
+-- Sales rollups maintained incrementally by RollupManager
+CREATE TABLE IF NOT EXISTS sales_rollup_hourly (
+    bucket TIMESTAMP NOT NULL,
+    source VARCHAR(100) NOT NULL,
+    total_sales NUMERIC(15,2) NOT NULL,
+    total_orders INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (bucket, source)
+);
+
+CREATE TABLE IF NOT EXISTS sales_rollup_daily (
+    bucket DATE NOT NULL,
+    source VARCHAR(100) NOT NULL,
+    total_sales NUMERIC(15,2) NOT NULL,
+    total_orders INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (bucket, source)
+);
+
+-- bucket is the first day of the month
+CREATE TABLE IF NOT EXISTS sales_rollup_monthly (
+    bucket DATE NOT NULL,
+    source VARCHAR(100) NOT NULL,
+    total_sales NUMERIC(15,2) NOT NULL,
+    total_orders INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (bucket, source)
+);
+
+-- Order id watermark of the last rollup refresh
+CREATE TABLE IF NOT EXISTS rollup_state (
+    rollup_name VARCHAR(100) PRIMARY KEY,
+    last_order_id INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(date);
@@ -0,0 +1,20 @@
+-- Upgrades a database created before online analysis kept running
+-- per-source statistics. They are built from all closed days on the next
+-- incremental analysis. Safe to run more than once.
+
+-- Running per-source statistics over closed days, maintained by SourceStatsManager
+CREATE TABLE IF NOT EXISTS analytics_source_stats (
+    source VARCHAR(100) NOT NULL,
+    metric VARCHAR(50) NOT NULL,
+    last_date DATE NOT NULL,  -- Last sales_metrics date folded in
+    count INTEGER NOT NULL,
+    mean DOUBLE PRECISION NOT NULL,
+    m2 DOUBLE PRECISION NOT NULL,  -- Welford sum of squared deviations
+    ewma DOUBLE PRECISION,
+    ewm_var DOUBLE PRECISION NOT NULL,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    last_value DOUBLE PRECISION,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source, metric)
+);
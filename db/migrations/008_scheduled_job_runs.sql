@@ -0,0 +1,13 @@
+-- Upgrades a database created before JobScheduler recorded job runs. Jobs
+-- start their run history on first load, so only downtime from then on is
+-- caught up. Safe to run more than once.
+
+-- Scheduled time of each JobScheduler job's last completed run, used to
+-- catch up runs missed while the system was down
+CREATE TABLE IF NOT EXISTS scheduled_job_runs (
+    owner VARCHAR(100) NOT NULL,  -- Agent type owning the job
+    job_name VARCHAR(100) NOT NULL,
+    last_run TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (owner, job_name)
+);
@@ -12,30 +12,45 @@ CREATE TABLE agent_registry (
     last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Agent messages table
+-- Archived (detached) agent_messages and agent_tasks partitions
+CREATE SCHEMA agent_archive;
+
+-- Agent messages table, partitioned by month of created_at. PartitionManager
+-- creates monthly partitions ahead of time and archives expired ones; rows
+-- outside every monthly partition land in the default partition.
 CREATE TABLE agent_messages (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     sender_id VARCHAR(255) NOT NULL,
     recipient_id VARCHAR(255) NOT NULL,
     message_type VARCHAR(100) NOT NULL,
-    content TEXT,
+    content BYTEA,  -- Encoded by PayloadCodec (utils/payload_codec.py)
     is_read BOOLEAN DEFAULT FALSE,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
--- Agent tasks table
+CREATE TABLE agent_messages_default PARTITION OF agent_messages DEFAULT;
+
+-- Agent tasks table, partitioned like agent_messages. Unique constraints must
+-- include the partition key; task ids are UUID-based and unique on their own.
+-- Tasks are queued per agent_type: any agent of that type may claim them.
 CREATE TABLE agent_tasks (
-    id SERIAL PRIMARY KEY,
-    task_id VARCHAR(255) UNIQUE NOT NULL,
-    agent_id VARCHAR(255) NOT NULL,
+    id BIGSERIAL,
+    task_id VARCHAR(255) NOT NULL,
+    agent_id VARCHAR(255) NOT NULL,  -- Agent that created the task
+    agent_type VARCHAR(100) NOT NULL,
     status VARCHAR(50) NOT NULL,
     priority INTEGER DEFAULT 5,
-    task_data JSONB,
+    task_data BYTEA,  -- Encoded by PayloadCodec
     result JSONB,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     started_at TIMESTAMP,
-    completed_at TIMESTAMP
-);
+    completed_at TIMESTAMP,
+    PRIMARY KEY (id, created_at),
+    UNIQUE (task_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE agent_tasks_default PARTITION OF agent_tasks DEFAULT;
 
 -- Sales metrics table
 CREATE TABLE sales_metrics (
@@ -45,7 +60,91 @@ CREATE TABLE sales_metrics (
     total_orders INTEGER NOT NULL,
     average_order_value NUMERIC(15,2) NOT NULL,
     source VARCHAR(100) NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    unique_customers INTEGER,  -- Estimated from customers_hll, not an exact count
+    customers_hll BYTEA,  -- HyperLogLog sketch of the day's distinct customers
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (date, source)
+);
+
+-- Per-source high-water marks for incremental sales collection
+CREATE TABLE collection_watermarks (
+    source VARCHAR(100) PRIMARY KEY,
+    last_order_id INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Order ids up to settled_id belong to finished inserts; pending_id settles
+-- once the transactions in pending_xids have finished (core/order_horizon.py)
+CREATE TABLE order_id_horizon (
+    name VARCHAR(100) PRIMARY KEY,
+    settled_id BIGINT NOT NULL,
+    pending_id BIGINT,
+    pending_xids xid8[],
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Sales rollups maintained incrementally by RollupManager
+CREATE TABLE sales_rollup_hourly (
+    bucket TIMESTAMP NOT NULL,
+    source VARCHAR(100) NOT NULL,
+    total_sales NUMERIC(15,2) NOT NULL,
+    total_orders INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (bucket, source)
+);
+
+CREATE TABLE sales_rollup_daily (
+    bucket DATE NOT NULL,
+    source VARCHAR(100) NOT NULL,
+    total_sales NUMERIC(15,2) NOT NULL,
+    total_orders INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (bucket, source)
+);
+
+-- bucket is the first day of the month
+CREATE TABLE sales_rollup_monthly (
+    bucket DATE NOT NULL,
+    source VARCHAR(100) NOT NULL,
+    total_sales NUMERIC(15,2) NOT NULL,
+    total_orders INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (bucket, source)
+);
+
+-- Order id watermark of the last rollup refresh
+CREATE TABLE rollup_state (
+    rollup_name VARCHAR(100) PRIMARY KEY,
+    last_order_id INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Running per-source statistics over closed days, maintained by SourceStatsManager
+CREATE TABLE analytics_source_stats (
+    source VARCHAR(100) NOT NULL,
+    metric VARCHAR(50) NOT NULL,
+    last_date DATE NOT NULL,  -- Last sales_metrics date folded in
+    count INTEGER NOT NULL,
+    mean DOUBLE PRECISION NOT NULL,
+    m2 DOUBLE PRECISION NOT NULL,  -- Welford sum of squared deviations
+    ewma DOUBLE PRECISION,
+    ewm_var DOUBLE PRECISION NOT NULL,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    last_value DOUBLE PRECISION,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source, metric)
+);
+
+-- Scheduled time of each JobScheduler job's last completed run, used to
+-- catch up runs missed while the system was down
+CREATE TABLE scheduled_job_runs (
+    owner VARCHAR(100) NOT NULL,  -- Agent type owning the job
+    job_name VARCHAR(100) NOT NULL,
+    last_run TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (owner, job_name)
 );
 
 -- Sales insights table
@@ -92,9 +191,12 @@ CREATE TABLE orders (
 );
 
 -- Create indexes for better performance
-CREATE INDEX idx_agent_messages_recipient ON agent_messages(recipient_id, is_read);
-CREATE INDEX idx_agent_tasks_agent_status ON agent_tasks(agent_id, status);
+-- Partial indexes only hold unread messages and pending tasks, so they stay
+-- small in every partition however much history is kept
+CREATE INDEX idx_agent_messages_unread ON agent_messages(recipient_id, created_at, id) WHERE is_read = FALSE;
+CREATE INDEX idx_agent_tasks_pending ON agent_tasks(agent_type, priority DESC, created_at) WHERE status = 'pending';
 CREATE INDEX idx_sales_metrics_date ON sales_metrics(date);
+CREATE INDEX idx_orders_date ON orders(date);
 CREATE INDEX idx_sales_insights_date ON sales_insights(date, severity);
 CREATE INDEX idx_system_notifications_type ON system_notifications(notification_type, is_read);
 CREATE INDEX idx_report_archive_type_date ON report_archive(report_type, period_start, period_end);
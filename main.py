@@ -2,7 +2,8 @@
 import os
 import logging
 import logging.config
-import time
+import signal
+import threading
 from config.settings import LOGGING_CONFIG
 from core.db_connector import DBConnector
 from core.agent_scheduler import AgentScheduler
@@ -33,14 +34,20 @@ def main():
     
     logger.info("All agents started. System running...")
     
+    # Stop on SIGTERM as well as Ctrl+C
+    shutdown = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown.set())
+    
     try:
         # Keep main thread alive
-        while True:
-            time.sleep(60)
+        while not shutdown.wait(60):
+            logger.info(f"Database pool stats: {db_connector.get_pool_stats()}")
     except KeyboardInterrupt:
-        logger.info("Shutdown requested. Stopping agents...")
-        for agent_id in agent_ids.values():
-            scheduler.stop_agent(agent_id)
+        pass
+    
+    logger.info("Shutdown requested. Stopping agents...")
+    if not scheduler.stop_agents():
+        logger.warning("Some agents did not stop before the timeout")
     
     logger.info("MCP Agent System shutdown complete.")
 
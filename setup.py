@@ -12,6 +12,7 @@ setup(
         "schedule>=1.2.0",
         "pyyaml>=6.0.1",
         "requests>=2.31.0",
+        "numpy>=1.24",
     ],
     python_requires=">=3.8",
 )
@@ -2,28 +2,36 @@
 from core.db_connector import DBConnector
 import datetime
 import random
+import sys
 
-def create_test_data():
+def create_test_data(num_orders=100):
     db = DBConnector()
     
     # Create some test orders
     sources = ["web", "mobile", "in_store", "phone"]
+    now = datetime.datetime.now()
     
-    for i in range(100):
-        days_ago = random.randint(0, 30)
-        date = datetime.datetime.now() - datetime.timedelta(days=days_ago)
-        source = random.choice(sources)
-        client_id = f"client_{random.randint(1000, 9999)}"
-        amount = random.uniform(50, 500)
-        
-        query = """
-        INSERT INTO orders (date, client_id, amount_total, source)
-        VALUES (%s, %s, %s, %s)
-        """
-        
-        db.execute(query, (date, client_id, amount, source))
+    def generate_orders():
+        for i in range(num_orders):
+            days_ago = random.randint(0, 30)
+            date = now - datetime.timedelta(days=days_ago)
+            source = random.choice(sources)
+            client_id = f"client_{random.randint(1000, 9999)}"
+            amount = round(random.uniform(50, 500), 2)
+            
+            yield (date, client_id, amount, source)
     
-    print("Created 100 test orders")
+    # Load all orders with COPY in a single transaction
+    count = db.copy_records(
+        "orders",
+        ["date", "client_id", "amount_total", "source"],
+        generate_orders()
+    )
+    
+    if count is None:
+        print("Failed to create test orders")
+    else:
+        print(f"Created {count} test orders")
 
 if __name__ == "__main__":
-    create_test_data()
+    create_test_data(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
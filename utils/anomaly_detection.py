@@ -0,0 +1,341 @@
+import math
+import numpy as np
+
+
+def factorize(items):
+    """Map items to (distinct items array, integer code per item)"""
+    if isinstance(items, np.ndarray):
+        return np.unique(items, return_inverse=True)
+
+    codes = {}
+    index = np.fromiter(
+        (codes.setdefault(item, len(codes)) for item in items), dtype=np.int64, count=len(items)
+    )
+    return np.array(list(codes)), index
+
+
+def to_days(dates):
+    """Convert a sequence of dates to a datetime64[D] array"""
+    if isinstance(dates, np.ndarray):
+        return dates.astype("datetime64[D]")
+
+    # Converting each date object to datetime64 is slow; convert only the
+    # distinct dates and expand them by index
+    unique_dates, date_index = factorize(dates)
+    return unique_dates.astype("datetime64[D]")[date_index]
+
+
+def partition_series(dates, sources, values, partitions):
+    """Split (date, source, value) columns into groups of whole sources
+
+    Groups hold roughly equal numbers of rows. Each one is encoded as
+    (source names, rows per source as int32 bytes, day numbers as int32
+    bytes, values as float64 bytes), so it pickles compactly for a worker
+    process; see detect_partition.
+    """
+    names, codes = factorize(sources)
+    days = to_days(dates).astype(np.int64).astype(np.int32)
+    values = np.asarray(values, dtype=np.float64)
+
+    order = np.argsort(codes, kind="stable")
+    days, values = days[order], values[order]
+    counts = np.bincount(codes, minlength=len(names))
+    row_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    targets = np.linspace(0, len(values), partitions + 1)[1:-1]
+    source_bounds = np.unique(np.concatenate((
+        [0], np.searchsorted(row_offsets, targets), [len(names)]
+    )))
+
+    result = []
+    for first, last in zip(source_bounds[:-1], source_bounds[1:]):
+        start, end = row_offsets[first], row_offsets[last]
+        result.append((
+            names[first:last].tolist(),
+            counts[first:last].astype(np.int32).tobytes(),
+            days[start:end].tobytes(),
+            values[start:end].tobytes()
+        ))
+    return result
+
+
+def detect_partition(settings, partition, seasonal=False):
+    """Run an AnomalyDetector built from ``settings`` over one partition_series group
+
+    Module-level so it can be used as a process pool task.
+    """
+    names, counts, days, values = partition
+    sources = np.repeat(np.array(names), np.frombuffer(counts, dtype=np.int32))
+    dates = np.frombuffer(days, dtype=np.int32).astype("datetime64[D]")
+    return AnomalyDetector(**settings).detect(
+        dates, sources, np.frombuffer(values, dtype=np.float64), seasonal=seasonal
+    )
+
+
+def merge_detections(detections):
+    """Combine AnomalyDetector.detect results computed for disjoint sets of sources"""
+    detections = [detection for detection in detections if detection['sources']]
+    if not detections:
+        return {'anomalies': [], 'source_stats': {}, 'sources': 0, 'days': 0,
+                'start_date': None, 'end_date': None}
+
+    anomalies = [anomaly for detection in detections for anomaly in detection['anomalies']]
+    anomalies.sort(key=lambda anomaly: (anomaly['date'], anomaly['source']))
+
+    source_stats = {}
+    for detection in detections:
+        source_stats.update(detection['source_stats'])
+
+    start_date = min(detection['start_date'] for detection in detections)
+    end_date = max(detection['end_date'] for detection in detections)
+    days = int((np.datetime64(end_date) - np.datetime64(start_date)).astype(np.int64)) + 1
+
+    return {
+        'anomalies': anomalies,
+        'source_stats': source_stats,
+        'sources': sum(detection['sources'] for detection in detections),
+        'days': days,
+        'start_date': start_date,
+        'end_date': end_date
+    }
+
+
+class AnomalyDetector:
+    """Vectorized anomaly detection over daily per-source metric series.
+
+    All sources are pivoted into a single sources x days matrix (NaN where a
+    source has no row for a day) and trailing baselines are computed for
+    every cell at once with cumulative sums, so the cost is a handful of
+    array passes regardless of the number of sources.
+
+    Each day is compared with a baseline built only from earlier days:
+    the trailing ``window``-day mean and standard deviation, or with
+    ``seasonal=True`` the mean of the same weekday over the previous
+    ``seasonal_weeks`` weeks (when at least ``min_seasonal_history`` of them
+    exist), with the spread taken from the trailing window's relative
+    deviations from their own weekday baselines.
+    """
+
+    def __init__(self, window=28, z_threshold=3.0, min_history=7,
+                 seasonal_weeks=8, min_seasonal_history=3):
+        self.window = window
+        self.z_threshold = z_threshold
+        self.min_history = min_history
+        self.seasonal_weeks = seasonal_weeks
+        self.min_seasonal_history = min_seasonal_history
+
+    @property
+    def settings(self):
+        """Constructor arguments, e.g. to rebuild the detector in a worker process"""
+        return {
+            'window': self.window,
+            'z_threshold': self.z_threshold,
+            'min_history': self.min_history,
+            'seasonal_weeks': self.seasonal_weeks,
+            'min_seasonal_history': self.min_seasonal_history
+        }
+
+    def build_matrix(self, dates, sources, values):
+        """Pivot (date, source, value) columns into a sources x days matrix
+
+        Returns:
+            tuple: (source names, first date as datetime64[D], matrix)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        source_names, source_index = factorize(sources)
+        order = np.argsort(source_names)
+        source_names = source_names[order]
+        source_index = np.argsort(order)[source_index]
+
+        days = to_days(dates)
+        start = days.min()
+        day_index = (days - start).astype(np.int64)
+
+        matrix = np.full((len(source_names), int(day_index.max()) + 1), np.nan)
+        matrix[source_index, day_index] = values
+        return source_names, start, matrix
+
+    def detect(self, dates, sources, values, seasonal=False):
+        """Score every (source, day) against its trailing baseline
+
+        Args:
+            dates: Sequence of dates (date objects, ISO strings or datetime64)
+            sources: Sequence of source names aligned with ``dates``
+            values: Sequence of metric values aligned with ``dates``
+            seasonal (bool): Prefer same-weekday baselines when available
+
+        Returns:
+            dict: ``anomalies`` (list of dicts in the anomalies_detected
+            message format, ordered by date), per-source ``source_stats``,
+            the analyzed ``sources`` and ``days`` counts and the covered
+            ``start_date`` and ``end_date``
+        """
+        if len(values) == 0:
+            return {'anomalies': [], 'source_stats': {}, 'sources': 0, 'days': 0,
+                    'start_date': None, 'end_date': None}
+
+        source_names, start, matrix = self.build_matrix(dates, sources, values)
+        valid = ~np.isnan(matrix)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Center each series so running sums of squares stay well conditioned
+            offset = np.nanmean(matrix, axis=1, keepdims=True)
+            centered = matrix - offset
+
+            expected, std, history = self._trailing_stats(centered, self.window)
+
+            if seasonal:
+                # Expected value: mean of the same weekday in previous weeks
+                seasonal_mean = np.full_like(matrix, np.nan)
+                seasonal_history = np.zeros_like(matrix)
+                for weekday in range(7):
+                    (seasonal_mean[:, weekday::7], _,
+                     seasonal_history[:, weekday::7]) = self._trailing_stats(
+                        centered[:, weekday::7], self.seasonal_weeks
+                    )
+                seasonal_mean[seasonal_history < self.min_seasonal_history] = np.nan
+
+                # Spread: RMS of the trailing window's relative deviations from
+                # their own weekday baselines, rescaled to this weekday's level
+                # (busy weekdays vary more in absolute terms). A handful of
+                # same-weekday samples is too few to estimate it on its own.
+                level = np.abs(seasonal_mean + offset)
+                residual_mean, residual_std, residual_history = self._trailing_stats(
+                    (centered - seasonal_mean) / level, self.window
+                )
+                residual_rms = np.sqrt(
+                    residual_mean * residual_mean
+                    + residual_std * residual_std * (residual_history - 1) / residual_history
+                )
+
+                use_seasonal = ~np.isnan(seasonal_mean) & (residual_history >= self.min_history)
+                expected = np.where(use_seasonal, seasonal_mean, expected)
+                std = np.where(use_seasonal, residual_rms * level, std)
+
+            z_scores = (centered - expected) / std
+            expected = expected + offset
+
+        scored = valid & (history >= self.min_history) & np.isfinite(z_scores) & (std > 0)
+        flagged = scored & (np.abs(z_scores) >= self.z_threshold)
+
+        # Order by date, then source
+        day_idx, source_idx = np.nonzero(flagged.T)
+        anomaly_dates = (start + day_idx.astype("timedelta64[D]")).astype(str)
+
+        anomalies = [
+            {
+                'type': 'sales_anomaly',
+                'source': str(source_names[s]),
+                'date': str(day),
+                'value': float(matrix[s, d]),
+                'expected': float(expected[s, d]),
+                'z_score': float(z_scores[s, d])
+            }
+            for s, d, day in zip(source_idx.tolist(), day_idx.tolist(), anomaly_dates)
+        ]
+
+        return {
+            'anomalies': anomalies,
+            'source_stats': self._source_stats(source_names, matrix, valid, z_scores, scored),
+            'sources': len(source_names),
+            'days': matrix.shape[1],
+            'start_date': str(start),
+            'end_date': str(start + np.timedelta64(matrix.shape[1] - 1, 'D'))
+        }
+
+    def _trailing_stats(self, matrix, window):
+        """Mean, sample std and count of the previous ``window`` cells along axis 1"""
+        valid = ~np.isnan(matrix)
+        filled = np.where(valid, matrix, 0.0)
+
+        columns = np.arange(matrix.shape[1])
+        lower = np.maximum(columns - window, 0)
+
+        def trailing_sum(array):
+            cumulative = np.zeros((array.shape[0], array.shape[1] + 1))
+            np.cumsum(array, axis=1, out=cumulative[:, 1:])
+            return cumulative[:, columns] - cumulative[:, lower]
+
+        count = trailing_sum(valid.astype(np.float64))
+        total = trailing_sum(filled)
+        total_sq = trailing_sum(filled * filled)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            variance = (total_sq - count * mean * mean) / (count - 1)
+            std = np.sqrt(np.maximum(variance, 0.0))
+
+        return mean, std, count
+
+    def _source_stats(self, source_names, matrix, valid, z_scores, scored):
+        """Per-source summary of the analyzed series"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.nanmean(matrix, axis=1)
+            stds = np.nanstd(matrix, axis=1)
+
+        counts = valid.sum(axis=1)
+        last_day = np.where(valid, np.arange(matrix.shape[1]), -1).max(axis=1)
+
+        stats = {}
+        for i, name in enumerate(source_names.tolist()):
+            last = last_day[i]
+            stats[name] = {
+                'data_points': int(counts[i]),
+                'mean': float(means[i]),
+                'std': float(stds[i]),
+                'last_value': float(matrix[i, last]),
+                'last_z_score': float(z_scores[i, last]) if scored[i, last] else None
+            }
+        return stats
+
+
+class RunningStats:
+    """Online statistics for one metric series, updated one value at a time.
+
+    Keeps a Welford mean/variance over all values seen, an exponentially
+    weighted mean/variance (``alpha`` weight on the newest value) and the
+    extremes, so a new value can be scored without re-reading history.
+    """
+
+    __slots__ = ('count', 'mean', 'm2', 'ewma', 'ewm_var', 'min_value', 'max_value', 'last_value')
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, ewma=None, ewm_var=0.0,
+                 min_value=None, max_value=None, last_value=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.ewma = ewma
+        self.ewm_var = ewm_var
+        self.min_value = min_value
+        self.max_value = max_value
+        self.last_value = last_value
+
+    def update(self, value, alpha):
+        """Fold one value into the statistics"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            diff = value - self.ewma
+            increment = alpha * diff
+            self.ewma += increment
+            self.ewm_var = (1 - alpha) * (self.ewm_var + diff * increment)
+
+        self.min_value = value if self.min_value is None else min(self.min_value, value)
+        self.max_value = value if self.max_value is None else max(self.max_value, value)
+        self.last_value = value
+
+    @property
+    def variance(self):
+        """Sample variance of all values seen"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def z_score(self, value):
+        """Deviation of ``value`` from the EWMA in exponentially weighted standard deviations"""
+        if self.ewma is None or self.ewm_var <= 0:
+            return None
+        return (value - self.ewma) / math.sqrt(self.ewm_var)
@@ -0,0 +1,259 @@
+import json
+import zlib
+import struct
+from config.settings import PAYLOAD_CODEC_CONFIG
+
+# Encoded payloads start with a format byte. JSON is stored untagged: a JSON
+# document always starts with a printable character, so the control bytes
+# below can never be mistaken for it and rows written before the codec
+# existed still decode.
+BINARY_FORMAT = 0x01  # MessagePack-compatible encoding of the value
+ZLIB_FORMAT = 0x02  # zlib-compressed encoded payload (JSON or binary)
+
+FORMATS = ("json", "binary")
+
+_UINT8 = struct.Struct(">BB")
+_UINT16 = struct.Struct(">BH")
+_UINT32 = struct.Struct(">BI")
+_UINT64 = struct.Struct(">BQ")
+_INT8 = struct.Struct(">Bb")
+_INT16 = struct.Struct(">Bh")
+_INT32 = struct.Struct(">Bi")
+_INT64 = struct.Struct(">Bq")
+_FLOAT64 = struct.Struct(">Bd")
+
+# Decoding layouts of the fixed-width integers and length prefixes
+_INT_FORMATS = {
+    0xcc: struct.Struct(">B"), 0xcd: struct.Struct(">H"),
+    0xce: struct.Struct(">I"), 0xcf: struct.Struct(">Q"),
+    0xd0: struct.Struct(">b"), 0xd1: struct.Struct(">h"),
+    0xd2: struct.Struct(">i"), 0xd3: struct.Struct(">q")
+}
+_STR_LENGTHS = {0xd9: struct.Struct(">B"), 0xda: struct.Struct(">H"), 0xdb: struct.Struct(">I")}
+_LENGTHS = {
+    0xdc: struct.Struct(">H"), 0xdd: struct.Struct(">I"),
+    0xde: struct.Struct(">H"), 0xdf: struct.Struct(">I")
+}
+
+class PayloadCodec:
+    """Encodes message content and task data to bytes and back.
+
+    ``format`` is "json" (compact UTF-8 JSON) or "binary" (a MessagePack
+    subset: nil, booleans, 64-bit integers, doubles, strings, arrays and
+    maps). Both accept the same values as ``json.dumps`` and decode to the
+    same result. Encoded payloads of at least ``compress_threshold`` bytes
+    are zlib-compressed when that makes them smaller. Decoding reads the
+    format byte, so it does not depend on the settings used to encode.
+    """
+
+    def __init__(self, format=None, compress_threshold=None, compression_level=None):
+        self.format = format or PAYLOAD_CODEC_CONFIG["format"]
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown payload format {self.format!r}, expected one of {FORMATS}")
+        self.compress_threshold = (
+            PAYLOAD_CODEC_CONFIG["compress_threshold"] if compress_threshold is None else compress_threshold
+        )
+        self.compression_level = compression_level or PAYLOAD_CODEC_CONFIG["compression_level"]
+
+    def encode(self, value):
+        """Return ``value`` encoded as bytes"""
+        if self.format == "binary":
+            out = bytearray((BINARY_FORMAT,))
+            _pack(value, out)
+            data = bytes(out)
+        else:
+            data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+        if self.compress_threshold and len(data) >= self.compress_threshold:
+            compressed = bytes((ZLIB_FORMAT,)) + zlib.compress(data, self.compression_level)
+            if len(compressed) < len(data):
+                return compressed
+        return data
+
+    def decode(self, data):
+        return decode_payload(data)
+
+
+def decode_payload(data):
+    """Decode a payload written by any PayloadCodec, or a plain JSON string"""
+    if data is None:
+        return None
+    if isinstance(data, str):
+        return json.loads(data)
+
+    data = bytes(data)
+    if not data:
+        return None
+    if data[0] == ZLIB_FORMAT:
+        return decode_payload(zlib.decompress(data[1:]))
+    if data[0] == BINARY_FORMAT:
+        value, offset = _unpack(data, 1)
+        if offset != len(data):
+            raise ValueError(f"Trailing data after binary payload at byte {offset}")
+        return value
+    return json.loads(data)
+
+
+def _pack(value, out):
+    kind = type(value)
+    if kind is str:
+        _pack_str(value, out)
+    elif kind is float:
+        out += _FLOAT64.pack(0xcb, value)
+    elif kind is bool:
+        out.append(0xc3 if value else 0xc2)
+    elif kind is int:
+        _pack_int(value, out)
+    elif kind is dict:
+        _pack_length(len(value), out, 0x80, 0xde, 0xdf)
+        for key, item in value.items():
+            _pack_str(key if type(key) is str else _json_key(key), out)
+            _pack(item, out)
+    elif kind is list or kind is tuple:
+        _pack_length(len(value), out, 0x90, 0xdc, 0xdd)
+        for item in value:
+            _pack(item, out)
+    elif value is None:
+        out.append(0xc0)
+    # Subclasses (such as numpy.float64 or str enums) encode like json.dumps does
+    elif isinstance(value, str):
+        _pack_str(str.__str__(value), out)
+    elif isinstance(value, float):
+        out += _FLOAT64.pack(0xcb, float(value))
+    elif isinstance(value, int):
+        _pack_int(int(value), out)
+    elif isinstance(value, dict):
+        _pack(dict(value), out)
+    elif isinstance(value, (list, tuple)):
+        _pack(list(value), out)
+    else:
+        raise TypeError(f"Object of type {kind.__name__} is not serializable")
+
+
+def _pack_str(value, out):
+    data = value.encode("utf-8")
+    length = len(data)
+    if length < 32:
+        out.append(0xa0 | length)
+    elif length < 0x100:
+        out += _UINT8.pack(0xd9, length)
+    elif length < 0x10000:
+        out += _UINT16.pack(0xda, length)
+    else:
+        out += _UINT32.pack(0xdb, length)
+    out += data
+
+
+def _pack_int(value, out):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -32 <= value < 0:
+        out.append(value & 0xff)
+    elif value >= 0:
+        if value < 0x100:
+            out += _UINT8.pack(0xcc, value)
+        elif value < 0x10000:
+            out += _UINT16.pack(0xcd, value)
+        elif value < 0x100000000:
+            out += _UINT32.pack(0xce, value)
+        elif value < 0x10000000000000000:
+            out += _UINT64.pack(0xcf, value)
+        else:
+            raise OverflowError(f"Integer {value} does not fit in 64 bits")
+    elif value >= -0x80:
+        out += _INT8.pack(0xd0, value)
+    elif value >= -0x8000:
+        out += _INT16.pack(0xd1, value)
+    elif value >= -0x80000000:
+        out += _INT32.pack(0xd2, value)
+    elif value >= -0x8000000000000000:
+        out += _INT64.pack(0xd3, value)
+    else:
+        raise OverflowError(f"Integer {value} does not fit in 64 bits")
+
+
+def _pack_length(length, out, fix_marker, marker16, marker32):
+    if length < 16:
+        out.append(fix_marker | length)
+    elif length < 0x10000:
+        out += _UINT16.pack(marker16, length)
+    else:
+        out += _UINT32.pack(marker32, length)
+
+
+def _json_key(key):
+    """Convert a non-string dict key the way json.dumps does"""
+    if key is True:
+        return "true"
+    if key is False:
+        return "false"
+    if key is None:
+        return "null"
+    if isinstance(key, int):
+        return str(int(key))
+    if isinstance(key, float):
+        return float.__repr__(key)
+    if isinstance(key, str):
+        return str.__str__(key)
+    raise TypeError(f"keys must be str, int, float, bool or None, not {type(key).__name__}")
+
+
+def _unpack(data, offset):
+    """Decode the value starting at ``offset``, returning it and the offset after it"""
+    marker = data[offset]
+    offset += 1
+
+    if marker < 0x80:
+        return marker, offset
+    if marker >= 0xe0:
+        return marker - 0x100, offset
+    if 0xa0 <= marker <= 0xbf:
+        end = offset + (marker & 0x1f)
+        return data[offset:end].decode("utf-8"), end
+    if 0x90 <= marker <= 0x9f:
+        return _unpack_array(data, offset, marker & 0x0f)
+    if 0x80 <= marker <= 0x8f:
+        return _unpack_map(data, offset, marker & 0x0f)
+
+    if marker == 0xc0:
+        return None, offset
+    if marker == 0xc2:
+        return False, offset
+    if marker == 0xc3:
+        return True, offset
+    if marker == 0xcb:
+        return struct.unpack_from(">d", data, offset)[0], offset + 8
+
+    if marker in _INT_FORMATS:
+        layout = _INT_FORMATS[marker]
+        return layout.unpack_from(data, offset)[0], offset + layout.size
+    if marker in _STR_LENGTHS:
+        layout = _STR_LENGTHS[marker]
+        length = layout.unpack_from(data, offset)[0]
+        offset += layout.size
+        return data[offset:offset + length].decode("utf-8"), offset + length
+    if marker in (0xdc, 0xdd):
+        layout = _LENGTHS[marker]
+        return _unpack_array(data, offset + layout.size, layout.unpack_from(data, offset)[0])
+    if marker in (0xde, 0xdf):
+        layout = _LENGTHS[marker]
+        return _unpack_map(data, offset + layout.size, layout.unpack_from(data, offset)[0])
+
+    raise ValueError(f"Unsupported binary payload marker 0x{marker:02x} at byte {offset - 1}")
+
+
+def _unpack_array(data, offset, length):
+    items = []
+    for _ in range(length):
+        item, offset = _unpack(data, offset)
+        items.append(item)
+    return items, offset
+
+
+def _unpack_map(data, offset, length):
+    items = {}
+    for _ in range(length):
+        key, offset = _unpack(data, offset)
+        items[key], offset = _unpack(data, offset)
+    return items, offset
+